@@ -0,0 +1,53 @@
+import bisect
+
+import netaddr
+
+def aggregate_routes(routes):
+    """
+        merge adjacent subnets sharing the same next hop into supernets.
+        routes[subnet] = next_hop, next_hop must be hashable.
+        return a dictionary in the same format.
+
+        flow entries are prioritized by prefix length, a supernet
+        is used only if no route of other next hop lies inside it
+        with a shorter prefix than the merged subnets, otherwise
+        longest-prefix-match result would be changed.
+        a withdrawn subnet splits the supernet again on the next call.
+    """
+    groups = {}
+    for subnet, next_hop in routes.items():
+        groups.setdefault(next_hop, []).append(subnet)
+
+    # all the subnets ordered by first address
+    prefixes = sorted(routes.keys(), key=lambda s: (s.first, s.prefixlen))
+    firsts = [s.first for s in prefixes]
+
+    aggregated = {}
+    for next_hop, subnets in groups.items():
+        if len(subnets) == 1:
+            aggregated[subnets[0]] = next_hop
+            continue
+
+        for supernet in netaddr.cidr_merge(subnets):
+            components = []
+            others = []
+            i = bisect.bisect_left(firsts, supernet.first)
+            while i < len(prefixes) and firsts[i] <= supernet.last:
+                subnet = prefixes[i]
+                i += 1
+                if subnet.prefixlen < supernet.prefixlen:
+                    # contains the supernet
+                    continue
+                if routes[subnet] == next_hop:
+                    components.append(subnet)
+                else:
+                    others.append(subnet)
+
+            max_prefixlen = max(s.prefixlen for s in components)
+            if any(s.prefixlen < max_prefixlen for s in others):
+                for subnet in components:
+                    aggregated[subnet] = next_hop
+            else:
+                aggregated[supernet] = next_hop
+
+    return aggregated
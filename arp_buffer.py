@@ -0,0 +1,147 @@
+import time
+from collections import deque
+
+MAX_PACKETS_PER_HOST = 32
+MAX_PACKETS = 4096
+PACKET_TTL = 5
+ARP_RETRY_INTERVAL = 1
+ARP_RETRY_INTERVAL_MAX = 8
+
+# an unresolved host is forgotten after this many ARP requests
+# once it has no buffered packets
+ARP_MAX_REQUESTS = 4
+
+# hosts being resolved, with or without buffered packets
+MAX_HOSTS = 4096
+
+class PendingHost(object):
+    """
+        packets waiting for the ARP reply of a single host,
+        and the state of the ARP requests sent for it.
+    """
+    __slots__ = ('packets', 'next_request', 'retry_interval', 'requests')
+
+    def __init__(self):
+        # packets = deque of (time_stamp, item)
+        self.packets = deque()
+        self.next_request = 0
+        self.retry_interval = ARP_RETRY_INTERVAL
+        self.requests = 0
+
+class ARPPendingBuffer(object):
+    """
+        temporarily store packets without ARP entry,
+        indexed by (out_port_no, ip_addr) so that an ARP reply
+        releases only the packets waiting for that host.
+    """
+    def __init__(self, max_packets_per_host=MAX_PACKETS_PER_HOST,
+                 max_packets=MAX_PACKETS, ttl=PACKET_TTL, max_hosts=MAX_HOSTS):
+        self.max_packets_per_host = max_packets_per_host
+        self.max_packets = max_packets
+        self.ttl = ttl
+        self.max_hosts = max_hosts
+
+        # hosts[(out_port_no, ip_addr)] = PendingHost
+        self.hosts = {}
+        self.size = 0
+
+        self.stats = {'buffered': 0,
+                      'released': 0,
+                      'dropped_overflow': 0,
+                      'dropped_expired': 0,
+                      'arp_requests': 0}
+
+    def add(self, outport_no, ip, item):
+        """
+            buffer the item for specific host.
+            when the host queue is full the oldest packet is dropped,
+            when the whole buffer is full the new packet is dropped,
+            but the host is still resolved by request_due.
+            return False if the item is dropped.
+        """
+        key = (outport_no, ip)
+        try:
+            host = self.hosts[key]
+        except KeyError:
+            if len(self.hosts) >= self.max_hosts:
+                self.stats['dropped_overflow'] += 1
+                return False
+            host = self.hosts[key] = PendingHost()
+
+        if len(host.packets) >= self.max_packets_per_host:
+            host.packets.popleft()
+            self.size -= 1
+            self.stats['dropped_overflow'] += 1
+        elif self.size >= self.max_packets:
+            self.stats['dropped_overflow'] += 1
+            return False
+
+        host.packets.append((time.time(), item))
+        self.size += 1
+        self.stats['buffered'] += 1
+        return True
+
+    def request_due(self, outport_no, ip):
+        """
+            return True if an ARP request should be sent for the host now.
+            only one request is outstanding for each host,
+            the retry interval is doubled after each request.
+        """
+        try:
+            host = self.hosts[(outport_no, ip)]
+        except KeyError:
+            return False
+
+        return self.request(host, time.time())
+
+    def request(self, host, now):
+        if now < host.next_request:
+            return False
+
+        host.next_request = now + host.retry_interval
+        host.retry_interval = min(host.retry_interval * 2, ARP_RETRY_INTERVAL_MAX)
+        host.requests += 1
+        self.stats['arp_requests'] += 1
+        return True
+
+    def release(self, outport_no, ip):
+        """
+            remove and return the items waiting for the host.
+        """
+        try:
+            host = self.hosts.pop((outport_no, ip))
+        except KeyError:
+            return []
+
+        self.size -= len(host.packets)
+        self.stats['released'] += len(host.packets)
+        return [item for (time_stamp, item) in host.packets]
+
+    def expire(self):
+        """
+            drop the packets buffered longer than ttl, forget the
+            hosts without buffered packets after ARP_MAX_REQUESTS,
+            and return a list of (out_port_no, ip_addr) whose
+            ARP request should be sent again now.
+            called every second by the timer of the switch,
+            so a lost request is retried without new packets.
+        """
+        now = time.time()
+        last_valid_time = now - self.ttl
+        retry_list = []
+
+        for key, host in self.hosts.items():
+            while host.packets and host.packets[0][0] < last_valid_time:
+                host.packets.popleft()
+                self.size -= 1
+                self.stats['dropped_expired'] += 1
+
+            if not host.packets and host.requests >= ARP_MAX_REQUESTS:
+                del self.hosts[key]
+            elif self.request(host, now):
+                retry_list.append(key)
+
+        return retry_list
+
+    def __len__(self):
+        return self.size
@@ -0,0 +1,166 @@
+import time
+import datetime
+from collections import OrderedDict
+
+import netaddr
+
+MAX_ENTRIES = 4096
+ENTRY_TTL = 300
+REFRESH_BEFORE = 30
+
+class ARPEntry(object):
+    __slots__ = ('hw_addr', 'last_update', 'last_used', 'refreshing')
+
+    def __init__(self, hw_addr):
+        self.hw_addr = hw_addr
+        self.last_update = time.time()
+        self.last_used = 0
+        self.refreshing = False
+
+class ARPCache(object):
+    """
+        ARP table with LRU and TTL eviction.
+        an entry used since its last update is refreshed by
+        an unicast ARP request before it expires, so the hosts
+        with active flows are never evicted.
+        set refresh_all to refresh the unused entries too.
+        evict_callback(ip_addr, hw_addr) is called for every
+        evicted entry.
+    """
+    def __init__(self, max_entries=MAX_ENTRIES, ttl=ENTRY_TTL, refresh_before=REFRESH_BEFORE,
+                 refresh_all=False, evict_callback=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.refresh_before = refresh_before
+        self.refresh_all = refresh_all
+        self.evict_callback = evict_callback
+
+        # entries[ip_addr] = ARPEntry, least recently used first
+        self.entries = OrderedDict()
+
+        # increased when entries are added, updated or evicted
+        self.revision = 0
+
+        self.stats = {'hits': 0,
+                      'misses': 0,
+                      'evictions_lru': 0,
+                      'evictions_ttl': 0,
+                      'refreshes': 0}
+
+    def update(self, ip, hw_addr, last_update=None):
+        """
+            add or update the MAC address of specific IP address,
+            evict the least recently used entry if the table is full.
+            last_update is given when restored from a snapshot.
+            an updated entry keeps its last_used, so it is refreshed
+            again as long as it is in use.
+        """
+        ip = netaddr.IPAddress(ip)
+        try:
+            entry = self.entries.pop(ip)
+            entry.hw_addr = netaddr.EUI(hw_addr)
+            entry.last_update = time.time()
+            entry.refreshing = False
+        except KeyError:
+            entry = ARPEntry(netaddr.EUI(hw_addr))
+        self.entries[ip] = entry
+        if last_update is not None:
+            entry.last_update = last_update
+        self.revision += 1
+
+        while len(self.entries) > self.max_entries:
+            evicted_ip, evicted = self.entries.popitem(last=False)
+            self.stats['evictions_lru'] += 1
+            self.evict(evicted_ip, evicted)
+
+    def evict(self, ip, entry):
+        self.revision += 1
+        if self.evict_callback:
+            self.evict_callback(ip, entry.hw_addr)
+
+    def lifetime(self, ip):
+        """
+            return the seconds before the entry expires,
+            at least 1 second.
+        """
+        try:
+            entry = self.entries[ip]
+        except KeyError:
+            return 1
+
+        return max(1, int(entry.last_update + self.ttl - time.time()))
+
+    def lookup(self, ip):
+        """
+            return the MAC address of specific IP address,
+            or None if not found.
+        """
+        try:
+            entry = self.entries.pop(ip)
+        except KeyError:
+            self.stats['misses'] += 1
+            return None
+
+        self.entries[ip] = entry
+        entry.last_used = time.time()
+        self.stats['hits'] += 1
+        return entry.hw_addr
+
+    def expire(self):
+        """
+            evict the expired entries and return a list of
+            (ip_addr, hw_addr) which should be refreshed now.
+        """
+        now = time.time()
+        last_valid_time = now - self.ttl
+        refresh_time = last_valid_time + self.refresh_before
+        refresh_list = []
+
+        for ip, entry in self.entries.items():
+            if entry.last_update < last_valid_time:
+                del self.entries[ip]
+                self.stats['evictions_ttl'] += 1
+                self.evict(ip, entry)
+            elif entry.last_update < refresh_time and not entry.refreshing \
+                    and (self.refresh_all or entry.last_used > entry.last_update):
+                entry.refreshing = True
+                refresh_list.append((ip, entry.hw_addr))
+                self.stats['refreshes'] += 1
+
+        return refresh_list
+
+    def to_list(self):
+        """
+            return ARP table as a list of dictionary.
+        """
+        return [self.entry_to_dict(ip, entry) for ip, entry in self.entries.items()]
+
+    def iter_list(self, within=None):
+        """
+            yield the entries as dictionary ordered by IP address,
+            only the ones inside subnet within if given.
+            the entries are converted one by one while iterating.
+        """
+        for ip in sorted(self.entries.keys()):
+            if within is not None and ip not in within:
+                continue
+            entry = self.entries.get(ip)
+            if entry is not None:
+                yield self.entry_to_dict(ip, entry)
+
+    def entry_to_dict(self, ip, entry):
+        return {'ip': str(ip),
+                'hw_addr': str(entry.hw_addr),
+                'last_update': datetime.datetime.fromtimestamp(entry.last_update).strftime('%Y-%m-%d %H:%M:%S')}
+
+    def get_stats(self):
+        d = dict(self.stats)
+        d['entries'] = len(self.entries)
+        d['max_entries'] = self.max_entries
+        return d
+
+    def __contains__(self, ip):
+        return ip in self.entries
+
+    def __len__(self):
+        return len(self.entries)
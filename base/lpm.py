@@ -0,0 +1,72 @@
+import netaddr
+
+IPV4_MAX_PREFIXLEN = 32
+
+# MASKS[prefixlen] = netmask as integer
+MASKS = [((1 << IPV4_MAX_PREFIXLEN) - 1) ^ ((1 << (IPV4_MAX_PREFIXLEN - l)) - 1)
+         for l in xrange(IPV4_MAX_PREFIXLEN + 1)]
+
+class PrefixTable(object):
+    """
+        longest-prefix-match index for IPv4 subnets,
+        implemented as one hash table per prefix length.
+        lookup probes the tables from the longest prefix length
+        to the shortest, so the cost is bounded by the number of
+        distinct prefix lengths instead of the number of subnets.
+    """
+    def __init__(self):
+        # tables[prefixlen][network] = (subnet, value)
+        self.tables = {}
+
+        # prefix lengths in use, longest first
+        self.prefixlens = []
+
+    def insert(self, subnet, value):
+        """
+            add or replace the value for specific subnet.
+        """
+        prefixlen = subnet.prefixlen
+        try:
+            tbl = self.tables[prefixlen]
+        except KeyError:
+            tbl = self.tables[prefixlen] = {}
+            self.prefixlens.append(prefixlen)
+            self.prefixlens.sort(reverse=True)
+
+        tbl[int(subnet.network)] = (subnet, value)
+
+    def remove(self, subnet):
+        """
+            remove specific subnet, do nothing if it does not exist.
+        """
+        prefixlen = subnet.prefixlen
+        try:
+            tbl = self.tables[prefixlen]
+            del tbl[int(subnet.network)]
+        except KeyError:
+            return
+
+        if not tbl:
+            del self.tables[prefixlen]
+            self.prefixlens.remove(prefixlen)
+
+    def lookup(self, ip, accept=None):
+        """
+            return (subnet, value) of the longest prefix containing
+            the IP address, or None if nothing matched.
+            the prefixes whose value is rejected by accept(value)
+            are skipped if accept is given.
+        """
+        addr = int(netaddr.IPAddress(ip))
+        for prefixlen in self.prefixlens:
+            r = self.tables[prefixlen].get(addr & MASKS[prefixlen])
+            if r is not None and (accept is None or accept(r[1])):
+                return r
+        return None
+
+    def clear(self):
+        self.tables = {}
+        self.prefixlens = []
+
+    def __len__(self):
+        return sum(len(tbl) for tbl in self.tables.itervalues())
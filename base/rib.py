@@ -1,25 +1,157 @@
 import netaddr
 import time
 import datetime
+from collections import namedtuple
 
 from ryu.lib.dpid import dpid_to_str
 from ryu.lib.port_no import port_no_to_str
 
+from base.lpm import PrefixTable
+
+class Advertisement(namedtuple('Advertisement', ['base_version', 'version', 'routes'])):
+    """
+        routing information sent to a neighbor,
+        routes[key] = value changed in (base_version, version].
+        the key and value are defined by the protocol.
+        the receiver never modifies it.
+    """
+    def merge(self, adv):
+        """
+            return an advertisement covering both self and
+            the later advertisement adv, or adv alone if it replaces
+            self or changes between them are missing.
+        """
+        if adv.base_version <= self.base_version or adv.base_version > self.version:
+            return adv
+
+        routes = dict(self.routes)
+        routes.update(adv.routes)
+        return Advertisement(self.base_version, adv.version, routes)
+
+class RoutingTableVersion(namedtuple('RoutingTableVersion', ['revision', 'routes'])):
+    """
+        read-only copy of a routing table at a revision,
+        routes is a tuple of (subnet, source, dictionary of the entry)
+        ordered by subnet. never modified once published, so a reader
+        can hold it across green thread switches.
+    """
+    pass
+
 class RoutingTable(dict):
     """
         base class for RoutingTable,
-        the protocol should implement the following two methods.
+        the protocol should implement the following methods.
+        every subnet stored in the table is also indexed by a
+        PrefixTable to support longest-prefix-match lookup.
     """
+    def __init__(self):
+        super(RoutingTable, self).__init__()
+        self.lpm = PrefixTable()
+
+        # changes to be sent to neighbors since last advertisement
+        self.changed = set()
+
+        # increased on every modification of the entries
+        self.revision = 0
+
+        # RoutingTableVersion published for the readers
+        self.published = RoutingTableVersion(0, ())
+
+    def __setitem__(self, subnet, entry):
+        super(RoutingTable, self).__setitem__(subnet, entry)
+        self.lpm.insert(subnet, entry)
+        self.revision += 1
+
+    def __delitem__(self, subnet):
+        super(RoutingTable, self).__delitem__(subnet)
+        self.lpm.remove(subnet)
+        self.revision += 1
+
+    def lookup(self, ip, accept=None):
+        """
+            return (subnet, entry) of the longest prefix matched
+            with the IP address, or None if no route found.
+            only the entries accepted by accept(entry) match if given.
+        """
+        return self.lpm.lookup(ip, accept)
+
+    def current(self):
+        """
+            return the RoutingTableVersion of the current revision.
+            the entries are only modified by the writer, a new version
+            is built on the first read after a modification and
+            replaces the former one by a single assignment.
+        """
+        published = self.published
+        if published.revision == self.revision:
+            return published
+
+        routes = []
+        for subnet in sorted(self.keys(), key=lambda s: (s.first, s.prefixlen)):
+            entry = self[subnet]
+            d = entry.to_dict()
+            d['subnet'] = str(subnet)
+            routes.append((subnet, getattr(entry, 'source', None), d))
+
+        published = self.published = RoutingTableVersion(self.revision, tuple(routes))
+        return published
+
+    def pop_changes(self):
+        """
+            return the changes recorded since last call.
+        """
+        changed = self.changed
+        self.changed = set()
+        return changed
+
+    def reachable(self, entry):
+        """
+            return True if the entry should be deployed.
+        """
+        return True
+
     def update_entry(self, subnet, receive_port, neighbor_port=None, metric=0):
         raise NotImplementedError
 
+    def remove_entry(self, subnet):
+        raise NotImplementedError
+
     def update_by_neighbor(self, receive_port, neighbor_port, tbl):
         raise NotImplementedError
 
+    def advertisement(self, port, full=False):
+        raise NotImplementedError
+
+    def invalidate_port(self, port_no, connected=False):
+        raise NotImplementedError
+
+    def restore_entry(self, subnet, receive_port, neighbor_port, metric):
+        """
+            add a learned route saved before the controller restarted.
+            protocols computing routes from their own state ignore it.
+        """
+        pass
+
+    def mark_invalid_route(self):
+        pass
+
+    def garbage_collect(self):
+        pass
+
+    def acknowledge(self, port_no, version):
+        pass
+
+    def reset_neighbor(self, port_no):
+        pass
+
 class RoutingEntry(object):
     """
         base class for RoutingEntry.
+        entries are stored with __slots__, the subclasses should
+        declare their own attributes in __slots__ too.
     """
+    __slots__ = ('receive_port', 'neighbor_port', 'metric', 'last_update', 'flow_entry')
+
     def __init__(self, receive_port, neighbor_port, metric=0):
         self.receive_port = receive_port
         self.neighbor_port = neighbor_port
@@ -27,6 +159,13 @@ class RoutingEntry(object):
         self.last_update = time.time()
         self.flow_entry = None
 
+    def paths(self):
+        """
+            return list of (receive_port, neighbor_port) of
+            the equal-cost paths, the primary path first.
+        """
+        return [(self.receive_port, self.neighbor_port)]
+
     def to_dict(self):
         r = {}
         if self.receive_port.port_no:
@@ -0,0 +1,138 @@
+import socket
+import struct
+
+from ryu.ofproto import ether
+
+ETH_HEADER_LEN = 14
+VLAN_HEADER_LEN = 4
+ARP_PACKET_LEN = 28
+IPV4_HEADER_LEN = 20
+
+_ethertype = struct.Struct('!H')
+
+# hwtype, proto, hlen, plen, opcode, src_mac, src_ip, dst_mac, dst_ip
+_arp = struct.Struct('!HHBBH6s4s6s4s')
+
+def mac_to_str(b):
+    return ':'.join('%02x' % ord(c) for c in b)
+
+class PacketHeader(object):
+    """
+        the fields of a PacketIn required by RoutingFlow,
+        read directly from the raw data without building
+        the ryu packet objects.
+        src_ip/dst_ip are taken from ARP or IPv4 header.
+    """
+    __slots__ = ('data', 'ethertype', 'opcode', 'src_ip', 'dst_ip', 'sha')
+
+    def __init__(self, data, ethertype):
+        self.data = data
+        self.ethertype = ethertype
+        self.opcode = None
+        self.src_ip = None
+        self.dst_ip = None
+        self.sha = None
+
+    @property
+    def eth_dst(self):
+        return mac_to_str(self.data[0:6])
+
+    @property
+    def eth_src(self):
+        return mac_to_str(self.data[6:12])
+
+    @property
+    def src_mac(self):
+        """
+            sender hardware address of ARP packet.
+        """
+        return mac_to_str(self.sha)
+
+def parse_packet(data):
+    """
+        return PacketHeader of the data,
+        or None if the ethernet, ARP or IPv4 header is truncated.
+    """
+    if len(data) < ETH_HEADER_LEN:
+        return None
+
+    offset = ETH_HEADER_LEN - 2
+    (ethertype, ) = _ethertype.unpack_from(data, offset)
+    offset += 2
+
+    # skip 802.1Q tag
+    if ethertype == ether.ETH_TYPE_8021Q:
+        if len(data) < offset + VLAN_HEADER_LEN:
+            return None
+        (ethertype, ) = _ethertype.unpack_from(data, offset + 2)
+        offset += VLAN_HEADER_LEN
+
+    header = PacketHeader(data, ethertype)
+
+    if ethertype == ether.ETH_TYPE_ARP:
+        if len(data) < offset + ARP_PACKET_LEN:
+            return None
+        (hwtype, proto, hlen, plen, header.opcode, header.sha,
+            src_ip, dst_mac, dst_ip) = _arp.unpack_from(data, offset)
+        header.src_ip = socket.inet_ntoa(src_ip)
+        header.dst_ip = socket.inet_ntoa(dst_ip)
+    elif ethertype == ether.ETH_TYPE_IP:
+        if len(data) < offset + IPV4_HEADER_LEN:
+            return None
+        header.src_ip = socket.inet_ntoa(data[offset + 12:offset + 16])
+        header.dst_ip = socket.inet_ntoa(data[offset + 16:offset + 20])
+
+    return header
+
+# ethernet frames are padded to the minimum length without FCS
+ETH_MIN_LEN = 60
+
+ARP_REQUEST = 1
+ARP_REPLY = 2
+
+# offsets in an untagged ARP frame
+_ETH_DST = slice(0, 6)
+_ARP_THA = slice(32, 38)
+_ARP_TPA = slice(38, 42)
+
+class ARPTemplate(object):
+    """
+        wire-format ARP request and reply sent from a gateway port,
+        built once per gateway. a packet is a copy of the template
+        with the destination and target addresses patched in.
+        MAC addresses are given as 6-byte strings.
+    """
+    __slots__ = ('request_template', 'reply_template')
+
+    def __init__(self, hw_addr, ip):
+        src_ip = socket.inet_aton(str(ip))
+        self.request_template = self.build('\xff' * 6, hw_addr, ARP_REQUEST, src_ip)
+        self.reply_template = self.build('\x00' * 6, hw_addr, ARP_REPLY, src_ip)
+
+    @staticmethod
+    def build(eth_dst, hw_addr, opcode, src_ip):
+        data = eth_dst + hw_addr + _ethertype.pack(ether.ETH_TYPE_ARP) + \
+            _arp.pack(1, ether.ETH_TYPE_IP, 6, 4, opcode, hw_addr, src_ip, '\x00' * 6, '\x00' * 4)
+        return bytearray(data.ljust(ETH_MIN_LEN, '\x00'))
+
+    def request(self, dst_ip, dst_mac=None):
+        """
+            return ARP request for dst_ip,
+            broadcast unless the MAC address is given.
+        """
+        data = bytearray(self.request_template)
+        if dst_mac is not None:
+            data[_ETH_DST] = dst_mac
+        data[_ARP_TPA] = socket.inet_aton(str(dst_ip))
+        return data
+
+    def reply(self, eth_dst, dst_mac, dst_ip):
+        """
+            return ARP reply to the requester with dst_mac and dst_ip
+            in the ARP header, sent to eth_dst.
+        """
+        data = bytearray(self.reply_template)
+        data[_ETH_DST] = eth_dst
+        data[_ARP_THA] = dst_mac
+        data[_ARP_TPA] = socket.inet_aton(dst_ip)
+        return data
@@ -0,0 +1,470 @@
+import time
+import datetime
+import random
+import heapq
+import logging
+from collections import namedtuple, OrderedDict
+
+from ryu.lib.dpid import dpid_to_str
+from ryu.lib.port_no import port_no_to_str
+
+import base.rib as rib
+from base.rib import Advertisement
+
+logger = logging.getLogger(__name__)
+
+TIMER_BASE_MIN = 25
+TIMER_BASE_MAX = 35
+LINK_COST = 1
+INFINITY = float('inf')
+
+class LSA(namedtuple('LSA', ['dpid', 'seq', 'links', 'prefixes'])):
+    """
+        link state originated by a switch.
+        links[neighbor_dpid] = cost, prefixes = frozenset(subnet).
+        an LSA is never modified, a newer one with greater seq
+        replaces it.
+    """
+
+class LinkStateRoutingTable(rib.RoutingTable):
+    """
+        OSPF-style link-state routing.
+        every switch floods its LSA to the neighbors through the
+        same advertisement channel as RIP, and computes the shortest
+        path tree rooted at itself from the link state database.
+        the tree is updated incrementally, only the nodes whose
+        distance or first hop may change are recomputed.
+    """
+    def __init__(self, dpid):
+        super(LinkStateRoutingTable, self).__init__()
+        self.dpid = dpid
+        self.advertise_interval = random.randint(TIMER_BASE_MIN, TIMER_BASE_MAX + 1)
+        self.gc_interval = self.advertise_interval * 2
+        self.expire_time = self.advertise_interval * 3
+
+        # link state database
+        # lsdb[dpid] = LSA
+        # learned_from[dpid] = port_no the LSA was received from,
+        # None for the LSA of this switch
+        self.lsdb = {}
+        self.learned_from = {}
+        self.seq = 0
+
+        # journal[dpid] = version of last installed LSA, ordered by version
+        # acked[port_no] = version acknowledged by the neighbor
+        self.version = 0
+        self.journal = OrderedDict()
+        self.acked = {}
+
+        # neighbors heard through each port
+        # adjacencies[port_no] = (receive_port, neighbor_port)
+        # neighbor_heard[port_no] = time_stamp
+        # neighbor_versions[port_no] = version
+        self.adjacencies = {}
+        self.neighbor_heard = {}
+        self.neighbor_versions = {}
+
+        # graph of the links reported by both ends
+        # edges[u][v] = cost, in_edges[v][u] = cost
+        self.edges = {}
+        self.in_edges = {}
+
+        # shortest path tree rooted at self.dpid
+        # first_hop[dpid] = port_no of the first link on the path
+        self.dist = {dpid: 0}
+        self.parent = {}
+        self.children = {}
+        self.first_hop = {}
+
+        # prefix_nodes[subnet] = set(dpid) advertising the subnet
+        self.prefix_nodes = {}
+
+        # edge changes and subnets waiting for recompute
+        self.pending_edges = []
+        self.pending_nodes = set()
+        self.pending_subnets = set()
+
+        self.originate()
+        self.recompute()
+
+    # override
+    def update_entry(self, subnet, receive_port, neighbor_port=None, metric=0, source="CONNECTED"):
+        """
+            add a connected route, the routes to other switches
+            are computed from the link state database.
+        """
+        self[subnet] = LinkStateRoutingEntry(receive_port, neighbor_port, metric, source)
+        self.originate()
+        self.recompute()
+
+    # override
+    def remove_entry(self, subnet):
+        """
+            remove single routing entry, do nothing if not exists.
+            the subnet may still be reachable through other switches.
+        """
+        try:
+            entry = self[subnet]
+        except KeyError:
+            return
+
+        del self[subnet]
+        if entry.source == "CONNECTED":
+            self.originate()
+            self.pending_subnets.add(subnet)
+            self.recompute()
+
+    def originate(self, force=False):
+        """
+            install a new LSA of this switch describing the current
+            adjacencies and connected subnets, unless nothing changed.
+        """
+        links = {}
+        for receive_port, neighbor_port in self.adjacencies.values():
+            links[neighbor_port.dpid] = LINK_COST
+
+        prefixes = frozenset(subnet for subnet, entry in self.items() if entry.source == "CONNECTED")
+
+        old = self.lsdb.get(self.dpid)
+        if not force and old is not None and old.links == links and old.prefixes == prefixes:
+            return
+
+        self.seq += 1
+        self.install(self.dpid, LSA(self.dpid, self.seq, links, prefixes))
+
+    def install(self, dpid, lsa, port_no=None):
+        """
+            replace the LSA of dpid, lsa=None removes it.
+            port_no is the port the LSA was received from.
+            the changed edges and subnets are recorded for recompute.
+        """
+        old = self.lsdb.pop(dpid, None)
+        self.journal.pop(dpid, None)
+        self.learned_from.pop(dpid, None)
+        if lsa is not None:
+            self.lsdb[dpid] = lsa
+            self.learned_from[dpid] = port_no
+            self.version += 1
+            self.journal[dpid] = self.version
+            self.changed.add(dpid)
+
+        old_links = old.links if old else {}
+        new_links = lsa.links if lsa else {}
+        for neighbor in set(old_links) | set(new_links):
+            for u, v in ((dpid, neighbor), (neighbor, dpid)):
+                old_cost = self.edges.get(u, {}).get(v)
+                new_cost = self.edge_cost(u, v)
+                if old_cost == new_cost:
+                    continue
+                if new_cost is None:
+                    del self.edges[u][v]
+                    del self.in_edges[v][u]
+                else:
+                    self.edges.setdefault(u, {})[v] = new_cost
+                    self.in_edges.setdefault(v, {})[u] = new_cost
+                self.pending_edges.append((u, v, old_cost, new_cost))
+
+        old_prefixes = old.prefixes if old else frozenset()
+        new_prefixes = lsa.prefixes if lsa else frozenset()
+        for subnet in old_prefixes - new_prefixes:
+            nodes = self.prefix_nodes[subnet]
+            nodes.discard(dpid)
+            if not nodes:
+                del self.prefix_nodes[subnet]
+        for subnet in new_prefixes - old_prefixes:
+            self.prefix_nodes.setdefault(subnet, set()).add(dpid)
+        self.pending_subnets.update(old_prefixes ^ new_prefixes)
+
+    def edge_cost(self, u, v):
+        """
+            return cost of the link u->v if both ends report it,
+            otherwise None.
+        """
+        try:
+            if u in self.lsdb[v].links:
+                return self.lsdb[u].links[v]
+        except KeyError:
+            pass
+        return None
+
+    def recompute(self):
+        """
+            apply the recorded changes to the shortest path tree
+            and update the routes of the affected subnets.
+        """
+        edges = self.pending_edges
+        self.pending_edges = []
+        forced = self.pending_nodes
+        self.pending_nodes = set()
+        subnets = self.pending_subnets
+        self.pending_subnets = set()
+
+        for node in self.spf(edges, forced):
+            try:
+                subnets.update(self.lsdb[node].prefixes)
+            except KeyError:
+                pass
+
+        self.update_routes(subnets)
+
+    def spf(self, edges, forced=()):
+        """
+            incremental SPF.
+            (1) detach the subtrees below removed or worse tree edges
+                and the forced nodes.
+            (2) seed the detached nodes from their attached neighbors,
+                and the nodes behind added or better edges.
+            (3) run Dijkstra from the seeds, only the nodes whose
+                distance decreases are visited.
+            return the nodes whose distance or first hop changed.
+        """
+        detached = set()
+        for u, v, old_cost, new_cost in edges:
+            if self.parent.get(v) == u and (new_cost is None or new_cost > old_cost):
+                detached.update(self.subtree(v))
+        for node in forced:
+            if node in self.parent:
+                detached.update(self.subtree(node))
+
+        before = {}
+        for node in detached:
+            before[node] = (self.dist[node], self.first_hop[node])
+            self.detach(node)
+
+        heap = []
+        for node in detached:
+            for u, cost in self.in_edges.get(node, {}).items():
+                if u in self.dist:
+                    heapq.heappush(heap, (self.dist[u] + cost, node, u))
+        for u, v, old_cost, new_cost in edges:
+            if new_cost is not None and u in self.dist:
+                if self.dist[u] + new_cost < self.dist.get(v, INFINITY):
+                    heapq.heappush(heap, (self.dist[u] + new_cost, v, u))
+
+        while heap:
+            d, node, u = heapq.heappop(heap)
+            if d >= self.dist.get(node, INFINITY) or u not in self.dist:
+                continue
+            if node not in before:
+                before[node] = (self.dist.get(node), self.first_hop.get(node))
+            self.attach(node, u, d)
+            for v, cost in self.edges.get(node, {}).items():
+                if d + cost < self.dist.get(v, INFINITY):
+                    heapq.heappush(heap, (d + cost, v, node))
+
+        return [node for node, state in before.items()
+                if state != (self.dist.get(node), self.first_hop.get(node))]
+
+    def subtree(self, node):
+        nodes = [node]
+        i = 0
+        while i < len(nodes):
+            nodes.extend(self.children.get(nodes[i], ()))
+            i += 1
+        return nodes
+
+    def detach(self, node):
+        parent = self.parent.pop(node)
+        if parent in self.children:
+            self.children[parent].discard(node)
+        self.children.pop(node, None)
+        del self.dist[node]
+        del self.first_hop[node]
+
+    def attach(self, node, parent, d):
+        if node in self.parent:
+            self.children[self.parent[node]].discard(node)
+        self.parent[node] = parent
+        self.children.setdefault(parent, set()).add(node)
+        self.dist[node] = d
+        if parent == self.dpid:
+            self.first_hop[node] = self.port_to(node)
+        else:
+            self.first_hop[node] = self.first_hop[parent]
+
+    def port_to(self, dpid):
+        """
+            return the lowest port_no adjacent to dpid.
+        """
+        return min(port_no for port_no, (receive_port, neighbor_port) in self.adjacencies.items()
+                   if neighbor_port.dpid == dpid)
+
+    def update_routes(self, subnets):
+        """
+            point each subnet to the nearest switch advertising it,
+            connected routes are kept as is.
+        """
+        for subnet in subnets:
+            entry = self.get(subnet)
+            if entry is not None and entry.source == "CONNECTED":
+                continue
+
+            best = None
+            for node in self.prefix_nodes.get(subnet, ()):
+                if node != self.dpid and node in self.first_hop:
+                    candidate = (self.dist[node], self.first_hop[node], node)
+                    if best is None or candidate < best:
+                        best = candidate
+
+            if best is None:
+                if entry is not None:
+                    del self[subnet]
+                continue
+
+            metric, port_no, node = best
+            receive_port, neighbor_port = self.adjacencies[port_no]
+            if entry is None or entry.metric != metric \
+                    or entry.receive_port is not receive_port or entry.neighbor_port is not neighbor_port:
+                self[subnet] = LinkStateRoutingEntry(receive_port, neighbor_port, metric)
+
+    # override
+    def advertisement(self, port, full=False):
+        """
+            return the LSAs installed after the version acknowledged
+            by the neighbor on port, the whole database is sent to
+            a new neighbor, or if full is set.
+            the LSAs originated by the neighbor or received from it
+            are left out of the changes, the whole database still
+            carries them so a restarted neighbor learns its last seq.
+        """
+        base_version = 0 if full else self.acked.get(port.port_no, 0)
+
+        lsas = {}
+        for dpid in reversed(self.journal):
+            if self.journal[dpid] <= base_version:
+                break
+            if base_version and (dpid == port.neighbor_switch_dpid or
+                                 self.learned_from[dpid] == port.port_no):
+                continue
+            lsas[dpid] = self.lsdb[dpid]
+
+        return Advertisement(base_version, self.version, lsas)
+
+    # override
+    def reset_neighbor(self, port_no):
+        self.acked.pop(port_no, None)
+
+    # override
+    def acknowledge(self, port_no, version):
+        self.acked[port_no] = version
+
+    # override
+    def update_by_neighbor(self, receive_port, neighbor_port, adv):
+        """
+            form the adjacency with the neighbor and install the
+            LSAs newer than the ones in the database.
+            an LSA of this switch from its previous incarnation,
+            newer than the current one, makes it originate a newer one.
+            return the version to acknowledge, or 0 if changes were
+            missed and the whole database is required.
+        """
+        port_no = receive_port.port_no
+        self.neighbor_heard[port_no] = time.time()
+
+        adjacency = self.adjacencies.get(port_no)
+        if adjacency is None or adjacency[0] is not receive_port or adjacency[1] is not neighbor_port:
+            if adjacency is not None and adjacency[1].dpid in self.first_hop:
+                self.pending_nodes.add(adjacency[1].dpid)
+            self.adjacencies[port_no] = (receive_port, neighbor_port)
+            if neighbor_port.dpid in self.first_hop:
+                self.pending_nodes.add(neighbor_port.dpid)
+            self.originate()
+
+        for dpid, lsa in adv.routes.items():
+            if dpid == self.dpid:
+                if lsa.seq > self.seq:
+                    self.seq = lsa.seq
+                    self.originate(force=True)
+                continue
+
+            old = self.lsdb.get(dpid)
+            if old is None or lsa.seq > old.seq:
+                self.install(dpid, lsa, port_no)
+
+        self.recompute()
+
+        if adv.base_version > self.neighbor_versions.get(port_no, 0):
+            self.neighbor_versions[port_no] = 0
+            return 0
+
+        self.neighbor_versions[port_no] = adv.version
+        return adv.version
+
+    def remove_adjacency(self, port_no):
+        try:
+            receive_port, neighbor_port = self.adjacencies.pop(port_no)
+        except KeyError:
+            return
+
+        self.neighbor_heard.pop(port_no, None)
+        self.neighbor_versions.pop(port_no, None)
+        if neighbor_port.dpid in self.first_hop:
+            self.pending_nodes.add(neighbor_port.dpid)
+
+    # override
+    def invalidate_port(self, port_no, connected=False):
+        """
+            drop the adjacency on port_no when the link is down,
+            remove the connected routes too if the port itself is deleted.
+        """
+        self.remove_adjacency(port_no)
+
+        if connected:
+            for subnet, entry in self.items():
+                if entry.source == "CONNECTED" and entry.receive_port.port_no == port_no:
+                    del self[subnet]
+                    self.pending_subnets.add(subnet)
+
+        self.originate()
+        self.recompute()
+
+    # override
+    def mark_invalid_route(self):
+        """
+            drop the adjacencies not heard within expire_time.
+            called every advertise_interval by the timer of the switch.
+        """
+        last_valid_time = time.time() - self.expire_time
+
+        for port_no in list(self.adjacencies):
+            if self.neighbor_heard.get(port_no, 0) < last_valid_time:
+                logger.info('adjacency on port %s expired (dpid=%s)', port_no_to_str(port_no), dpid_to_str(self.dpid))
+                self.remove_adjacency(port_no)
+
+        self.originate()
+        self.recompute()
+
+    # override
+    def garbage_collect(self):
+        """
+            remove the LSAs of unreachable switches.
+            called every gc_interval by the timer of the switch.
+        """
+        for dpid in list(self.lsdb):
+            if dpid != self.dpid and dpid not in self.dist:
+                logger.info('GC: LSA of dpid=%s on dpid=%s', dpid_to_str(dpid), dpid_to_str(self.dpid))
+                self.install(dpid, None)
+
+        self.recompute()
+
+class LinkStateRoutingEntry(rib.RoutingEntry):
+    __slots__ = ('source', )
+
+    def __init__(self, receive_port, neighbor_port, metric=0, source="LINKSTATE"):
+        self.receive_port = receive_port
+        self.neighbor_port = neighbor_port
+        self.metric = metric
+        self.last_update = time.time()
+        self.source = source
+
+    def to_dict(self):
+        r = {}
+        if self.receive_port.port_no:
+            r['out_port'] = port_no_to_str(self.receive_port.port_no)
+        if self.metric != 0:
+            r['next_hop'] = dpid_to_str(self.neighbor_port.dpid)
+        r['metric'] = self.metric
+        r['source'] = self.source
+        r['last_update'] = datetime.datetime.fromtimestamp(self.last_update).strftime('%Y-%m-%d %H:%M:%S')
+
+        return r
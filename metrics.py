@@ -0,0 +1,194 @@
+import time
+import bisect
+import logging
+
+# Prometheus text exposition format, served with charset=utf-8
+CONTENT_TYPE = 'text/plain; version=0.0.4'
+
+# upper bounds of histogram buckets in seconds
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60)
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+def format_labels(labelnames, labelvalues, extra=''):
+    pairs = ['%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+             for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(pairs) + '}'
+
+class Metric(object):
+    """
+        base class of metrics, the samples are indexed by
+        the tuple of label values in the order of labelnames.
+    """
+    metric_type = 'untyped'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help),
+                 '# TYPE %s %s' % (self.name, self.metric_type)]
+        lines.extend(self.samples())
+        return lines
+
+    def samples(self):
+        raise NotImplementedError
+
+class Counter(Metric):
+    metric_type = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        super(Counter, self).__init__(name, help, labelnames)
+        self.values = {}
+
+    def inc(self, *labelvalues):
+        self.add(1, *labelvalues)
+
+    def add(self, amount, *labelvalues):
+        try:
+            self.values[labelvalues] += amount
+        except KeyError:
+            self.values[labelvalues] = amount
+
+    def samples(self):
+        return ['%s%s %s' % (self.name, format_labels(self.labelnames, labelvalues), format_value(value))
+                for labelvalues, value in sorted(self.values.items())]
+
+class Gauge(Metric):
+    """
+        gauge read by callback when rendered,
+        collect() returns list of (labelvalues, value).
+    """
+    metric_type = 'gauge'
+
+    def __init__(self, name, help, labelnames=(), collect=None):
+        super(Gauge, self).__init__(name, help, labelnames)
+        self.collect = collect
+
+    def samples(self):
+        return ['%s%s %s' % (self.name, format_labels(self.labelnames, labelvalues), format_value(value))
+                for labelvalues, value in sorted(self.collect())]
+
+class Histogram(Metric):
+    metric_type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+        # values[labelvalues] = [bucket counts, sum]
+        self.values = {}
+
+    def observe(self, value, *labelvalues):
+        try:
+            h = self.values[labelvalues]
+        except KeyError:
+            h = self.values[labelvalues] = [[0] * (len(self.buckets) + 1), 0]
+        h[0][bisect.bisect_left(self.buckets, value)] += 1
+        h[1] += value
+
+    def samples(self):
+        lines = []
+        for labelvalues, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'), ), counts):
+                cumulative += count
+                lines.append('%s_bucket%s %d' % (self.name, format_labels(self.labelnames, labelvalues,
+                                                 'le="%s"' % format_value(bound)), cumulative))
+            labels = format_labels(self.labelnames, labelvalues)
+            lines.append('%s_sum%s %s' % (self.name, labels, format_value(total)))
+            lines.append('%s_count%s %d' % (self.name, labels, cumulative))
+        return lines
+
+class MetricsRegistry(object):
+    """
+        collection of metrics rendered in Prometheus text format.
+        a metric registered again with the same name replaces
+        the former one.
+    """
+    def __init__(self):
+        # metrics[name] = Metric, in registration order
+        self.metrics = {}
+        self.names = []
+
+    def register(self, metric):
+        if metric.name not in self.metrics:
+            self.names.append(metric.name)
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=(), collect=None):
+        return self.register(Gauge(name, help, labelnames, collect))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def render(self):
+        lines = []
+        for name in self.names:
+            lines.extend(self.metrics[name].render())
+        return '\n'.join(lines) + '\n'
+
+class ConvergenceTracker(object):
+    """
+        measure the time from the last topology or gateway change
+        to the last routing flow change caused by it.
+    """
+    def __init__(self):
+        self.last_change = 0
+        self.last_flow_change = 0
+
+    def change(self):
+        self.last_change = time.time()
+
+    def flows_changed(self):
+        self.last_flow_change = time.time()
+
+    def collect(self):
+        if not self.last_change or self.last_flow_change < self.last_change:
+            return []
+        return [((), self.last_flow_change - self.last_change)]
+
+class SampledLogger(object):
+    """
+        log only one of every rate messages of the same format,
+        for the messages logged on every packet.
+    """
+    def __init__(self, logger, rate):
+        self.logger = logger
+        self.rate = rate
+
+        # counts[msg] = number of calls
+        self.counts = {}
+
+    def log(self, level, msg, *args):
+        if not self.logger.isEnabledFor(level):
+            return
+        count = self.counts.get(msg, 0)
+        self.counts[msg] = count + 1
+        if count % self.rate == 0:
+            self.logger.log(level, msg + ' (sampled 1/%d)' % self.rate, *args)
+
+    def debug(self, msg, *args):
+        self.log(logging.DEBUG, msg, *args)
+
+    def warning(self, msg, *args):
+        self.log(logging.WARNING, msg, *args)
+
+REGISTRY = MetricsRegistry()
+CONVERGENCE = ConvergenceTracker()
+REGISTRY.gauge('routingflow_convergence_seconds',
+               'time from the last topology or gateway change to the last routing flow change',
+               collect=CONVERGENCE.collect)
@@ -15,6 +15,9 @@ class Port(switches.Port):
         self.neighbor_port_no = None
         self.gateway = None
 
+        # ARPTemplate of the gateway, built when the gateway is set
+        self.arp_template = None
+
         if isinstance(port, Port_type): # port to neighbor switch
             self.dpid = port.dpid
             self._ofproto = port._ofproto
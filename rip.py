@@ -3,17 +3,30 @@ import time
 import datetime
 import random
 import logging
-from threading import Thread
+from collections import OrderedDict
 
 from ryu.lib.dpid import dpid_to_str
 from ryu.lib.port_no import port_no_to_str
 
 import base.rib as rib
+from base.rib import Advertisement
 
 logger = logging.getLogger(__name__)
 
 TIMER_BASE_MIN = 25
 TIMER_BASE_MAX = 35
+METRIC_INFINITY = 16
+
+# maximum number of equal-cost paths kept for a subnet
+ECMP_MAX_PATHS = 4
+
+def same_port(port1, port2):
+    """
+        compare two Port objects by dpid and port_no.
+    """
+    if port1 is None or port2 is None:
+        return port1 is port2
+    return port1.dpid == port2.dpid and port1.port_no == port2.port_no
 
 class RIPRoutingTable(rib.RoutingTable):
     def __init__(self, dpid):
@@ -22,88 +35,336 @@ class RIPRoutingTable(rib.RoutingTable):
             TIMER_BASE_MIN and TIMER_BASE_MAX to prevent all the
             swtiches broadcast and update in the same time.
         """
+        super(RIPRoutingTable, self).__init__()
         self.dpid = dpid
         self.advertise_interval = random.randint(TIMER_BASE_MIN, TIMER_BASE_MAX + 1)
         self.gc_interval = self.advertise_interval * 2
         self.expire_time = self.advertise_interval * 3
-        self.updating = False
 
-        self.init_thread()
+        # every change increases version, the journal records
+        # the version of last change for each subnet including
+        # the removed ones, ordered by version.
+        # journal[subnet] = version
+        self.version = 0
+        self.journal = OrderedDict()
 
-    def init_thread(self):
-        """
-            create a thread to do garbage collect.
-        """
-        logger.info('garbage collector thread start with interval %ds (dpid=%s)', self.gc_interval, dpid_to_str(self.dpid))
-        gc_thread = Thread(target=self.garbage_collect)
-        gc_thread.setDaemon(True)
-        gc_thread.start()
+        # version acknowledged by the neighbor on each port
+        # acked[port_no] = version
+        self.acked = {}
+
+        # subnets withdrawn by the neighbor on each port while this
+        # switch has another route, sent with the next changes
+        # resend[port_no] = set(subnet)
+        self.resend = {}
+
+        # state of the advertisements received from neighbors
+        # neighbor_versions[(dpid, port_no)] = version
+        # neighbor_heard[(dpid, port_no)] = time_stamp
+        self.neighbor_versions = {}
+        self.neighbor_heard = {}
+
+        # reverse index from output port to routes,
+        # including the alternate paths
+        # port_routes[port_no] = set(subnet)
+        self.port_routes = {}
+
+    def __setitem__(self, subnet, entry):
+        super(RIPRoutingTable, self).__setitem__(subnet, entry)
+        self.index_ports(subnet, entry)
+
+    def __delitem__(self, subnet):
+        entry = self[subnet]
+        super(RIPRoutingTable, self).__delitem__(subnet)
+        self.unindex_ports(subnet, entry)
+
+    def index_ports(self, subnet, entry):
+        for receive_port, neighbor_port in entry.paths():
+            self.port_routes.setdefault(receive_port.port_no, set()).add(subnet)
+
+    def unindex_ports(self, subnet, entry):
+        for receive_port, neighbor_port in entry.paths():
+            routes = self.port_routes.get(receive_port.port_no)
+            if routes is not None:
+                routes.discard(subnet)
+                if not routes:
+                    del self.port_routes[receive_port.port_no]
 
     # override
     def update_entry(self, subnet, receive_port, neighbor_port=None, metric=0, source="RIP"):
         """
-            update single routing entry.
+            update single routing entry,
+            record the subnet as changed if the route is modified,
+            refreshing the same route publishes no new version.
+            the alternate paths are dropped when the metric or
+            the primary path changes.
         """
         try:
             r = self[subnet]
+            if r.metric != metric or r.receive_port is not receive_port \
+                    or not same_port(r.neighbor_port, neighbor_port):
+                self.touch(subnet)
+            elif r.source != source:
+                self.revision += 1
+            self.unindex_ports(subnet, r)
+            if r.metric != metric or not same_port(r.neighbor_port, neighbor_port):
+                r.alternates = ()
             r.receive_port = receive_port
             r.neighbor_port = neighbor_port
             r.metric = metric
             r.source = source
             r.last_update = time.time()
+            self.index_ports(subnet, r)
         except KeyError:
             self[subnet] = RIPRoutingEntry(receive_port, neighbor_port, metric, source)
+            self.touch(subnet)
+
+    # override
+    def remove_entry(self, subnet):
+        """
+            remove single routing entry, do nothing if not exists.
+        """
+        try:
+            del self[subnet]
+            self.touch(subnet)
+        except KeyError:
+            pass
+
+    def set_paths(self, subnet, entry, paths):
+        """
+            replace the equal-cost paths of the entry,
+            paths[0] becomes the primary path.
+        """
+        self.unindex_ports(subnet, entry)
+        entry.receive_port, entry.neighbor_port = paths[0]
+        entry.alternates = tuple(paths[1:])
+        self.index_ports(subnet, entry)
+        self.touch(subnet)
+
+    def touch(self, subnet):
+        """
+            record the change of subnet with a new version.
+        """
+        self.version += 1
+        self.journal.pop(subnet, None)
+        self.journal[subnet] = self.version
+        self.changed.add(subnet)
+        self.revision += 1
+
+    # override
+    def restore_entry(self, subnet, receive_port, neighbor_port, metric):
+        """
+            the restored route expires like a learned one
+            unless the neighbor advertises it again.
+        """
+        if subnet not in self:
+            self.update_entry(subnet, receive_port, neighbor_port, metric)
+
+    # override
+    def reachable(self, entry):
+        return entry.metric < METRIC_INFINITY
+
+    # override
+    def advertisement(self, port, full=False):
+        """
+            return the routes changed after the version acknowledged
+            by the neighbor on port, a removed subnet is advertised
+            as unreachable. the whole table is advertised to a new
+            neighbor, or if full is set.
+            split horizon with poison reverse: the routes learned
+            through port, by any of the equal-cost paths, are
+            advertised back with metric=16.
+            the subnets the neighbor withdrew while this switch has
+            another route are added, so the neighbor learns it again.
+        """
+        base_version = 0 if full else self.acked.get(port.port_no, 0)
+
+        routes = {}
+        for subnet in reversed(self.journal):
+            if self.journal[subnet] <= base_version:
+                break
+            routes[subnet] = self.advertised_metric(subnet, port)
+
+        for subnet in self.resend.pop(port.port_no, ()):
+            if subnet not in routes:
+                routes[subnet] = self.advertised_metric(subnet, port)
+
+        return Advertisement(base_version, self.version, routes)
+
+    def advertised_metric(self, subnet, port):
+        entry = self.get(subnet)
+        if entry is None:
+            return METRIC_INFINITY
+        elif entry.metric != 0 and any(receive_port.port_no == port.port_no
+                                       for receive_port, neighbor_port in entry.paths()):
+            return METRIC_INFINITY
+        return entry.metric
 
     # override
-    def update_by_neighbor(self, receive_port, neighbor_port, tbl):
+    def reset_neighbor(self, port_no):
+        """
+            called when the link on port_no is added or deleted,
+            the whole table will be advertised to the new neighbor.
+        """
+        self.acked.pop(port_no, None)
+        self.resend.pop(port_no, None)
+
+    # override
+    def acknowledge(self, port_no, version):
+        """
+            called when the neighbor on port_no applied the advertisement,
+            version=0 requests the whole table next time.
         """
-            (1) mark the expired entry as invalid entry.
-            (2) update self routing table by comparing with routing table
+        self.acked[port_no] = version
+
+    # override
+    def update_by_neighbor(self, receive_port, neighbor_port, adv):
+        """
+            update self routing table by comparing with the changes
             advertised by neighbors.
+            the route through the same neighbor is always replaced,
+            so a worse metric or a poisoned route takes effect instantly,
+            unless other equal-cost paths remain.
+            a neighbor advertising the same metric is added as
+            an alternate path, up to ECMP_MAX_PATHS.
+            the whole table (base_version=0) replaces all the routes
+            through the neighbor, the ones it does not list are withdrawn.
+            a subnet the neighbor withdraws in its changes is sent back
+            with the next changes if this switch has another route.
+            called only by the update worker of the switch,
+            so updates are serialized.
+            return the version to acknowledge, or 0 if changes were
+            missed and the whole table is required.
         """
-        if self.updating:
-            return
-        self.updating = True
-
-        self.mark_invalid_route()
-
-        for subnet, entry in tbl.items():
-            if subnet in self.keys():
-                if self[subnet].source == "CONNECTED" or self[subnet].metric == 0:
-                    self[subnet].last_update = time.time()
-                elif entry.metric + 1 < self[subnet].metric:
-                    self.update_entry(subnet, receive_port, neighbor_port, entry.metric + 1)
-                else:
-                    continue
-            else:
-                self.update_entry(subnet, receive_port, neighbor_port, entry.metric + 1)
-        
-        self.updating = False
+        key = (neighbor_port.dpid, neighbor_port.port_no)
+        self.neighbor_heard[key] = time.time()
+        missed = adv.base_version > self.neighbor_versions.get(key, 0)
+
+        routes = adv.routes
+        if adv.base_version == 0:
+            routes = dict(routes)
+            for subnet in self.port_routes.get(receive_port.port_no, ()):
+                if subnet not in routes and any(same_port(path[1], neighbor_port) for path in self[subnet].paths()):
+                    routes[subnet] = METRIC_INFINITY
+
+        for subnet, metric in routes.items():
+            metric = min(metric + 1, METRIC_INFINITY)
+            try:
+                r = self[subnet]
+            except KeyError:
+                if metric < METRIC_INFINITY:
+                    self.update_entry(subnet, receive_port, neighbor_port, metric)
+                continue
+
+            through_neighbor = any(same_port(path[1], neighbor_port) for path in r.paths())
+            if metric == METRIC_INFINITY and adv.base_version and r.metric < METRIC_INFINITY \
+                    and not through_neighbor:
+                # the neighbor lost the subnet, answer with this route
+                self.resend.setdefault(receive_port.port_no, set()).add(subnet)
+                self.changed.add(subnet)
+
+            if r.source == "CONNECTED":
+                continue
+            elif through_neighbor:
+                if metric == r.metric:
+                    if same_port(r.neighbor_port, neighbor_port):
+                        self.update_entry(subnet, receive_port, neighbor_port, metric)
+                elif metric > r.metric and r.alternates:
+                    self.set_paths(subnet, r, [path for path in r.paths() if not same_port(path[1], neighbor_port)])
+                elif metric < METRIC_INFINITY or r.metric < METRIC_INFINITY:
+                    self.update_entry(subnet, receive_port, neighbor_port, metric)
+            elif metric < r.metric:
+                self.update_entry(subnet, receive_port, neighbor_port, metric)
+            elif metric == r.metric < METRIC_INFINITY and len(r.alternates) + 1 < ECMP_MAX_PATHS:
+                self.set_paths(subnet, r, r.paths() + [(receive_port, neighbor_port)])
+
+        if missed:
+            self.neighbor_versions[key] = 0
+            return 0
 
+        self.neighbor_versions[key] = adv.version
+        return adv.version
+
+    # override
+    def invalidate_port(self, port_no, connected=False):
+        """
+            set metric to 16 for the routes through port_no
+            when the link is down, remove the connected routes
+            too if the port itself is deleted.
+            a route with other equal-cost paths only loses
+            the path through port_no.
+        """
+        for subnet in list(self.port_routes.get(port_no, ())):
+            entry = self[subnet]
+            if entry.source == "CONNECTED":
+                if connected:
+                    self.remove_entry(subnet)
+            elif entry.metric != METRIC_INFINITY:
+                paths = [path for path in entry.paths() if path[0].port_no != port_no]
+                if not paths:
+                    entry.metric = METRIC_INFINITY
+                    paths = entry.paths()[:1]
+                self.set_paths(subnet, entry, paths)
+
+    # override
     def mark_invalid_route(self):
         """
             set metric to 16 if the routing entry expired.
             metric=16 is regarded as disconnected.
+            a route is alive as long as the neighbor keeps advertising,
+            even if the route itself is unchanged.
+            connected routes are owned by gateway configuration
+            and never expire.
+            called every advertise_interval by the timer of the switch.
         """
         last_valid_time = time.time() - self.expire_time
 
         for subnet, entry in self.items():
-            if entry.last_update < last_valid_time:
-                entry.metric = 16
+            if entry.source == "CONNECTED" or entry.metric == METRIC_INFINITY:
+                continue
+
+            paths = entry.paths()
+            alive = [path for path in paths[1:] if self.heard(path[1]) >= last_valid_time]
+            if max(entry.last_update, self.heard(entry.neighbor_port)) >= last_valid_time:
+                alive.insert(0, paths[0])
+
+            if len(alive) == len(paths):
+                continue
+            if not alive:
+                entry.metric = METRIC_INFINITY
+                alive = paths[:1]
+            self.set_paths(subnet, entry, alive)
 
+    def heard(self, neighbor_port):
+        """
+            return the time of last advertisement from neighbor_port.
+        """
+        return self.neighbor_heard.get((neighbor_port.dpid, neighbor_port.port_no), 0)
+
+    # override
     def garbage_collect(self):
         """
             iterate the whole routing table and delete routing entries
             with metric=16.
+            called every gc_interval by the timer of the switch.
         """
         for subnet, entry in self.items():
-            if entry.metric == 16:
+            if entry.metric == METRIC_INFINITY:
                 logger.info('GC: route from dpid=%s to %s', dpid_to_str(self.dpid), str(subnet))
                 del self[subnet]
 
-        time.sleep(self.gc_interval)
+        # forget the removed subnets acknowledged by all the neighbors,
+        # a neighbor without acknowledged version gets the whole table
+        # which withdraws them anyway
+        min_acked = min(self.acked.values()) if self.acked else self.version
+        for subnet, version in self.journal.items():
+            if version > min_acked:
+                break
+            if subnet not in self:
+                del self.journal[subnet]
 
 class RIPRoutingEntry(rib.RoutingEntry):
+    __slots__ = ('source', 'alternates')
+
     def __init__(self, receive_port, neighbor_port, metric=0, source="RIP"):
         self.receive_port = receive_port
         self.neighbor_port = neighbor_port
@@ -111,6 +372,15 @@ class RIPRoutingEntry(rib.RoutingEntry):
         self.last_update = time.time()
         self.source = source
 
+        # equal-cost paths other than the primary one
+        # alternates = tuple of (receive_port, neighbor_port),
+        # the empty tuple is shared by all the single-path entries
+        self.alternates = ()
+
+    # override
+    def paths(self):
+        return [(self.receive_port, self.neighbor_port)] + list(self.alternates)
+
     def to_dict(self):
         r = {}
         if self.receive_port.port_no:
@@ -3,6 +3,9 @@ import datetime
 import os
 import logging
 import json
+import functools
+import itertools
+import hashlib
 from webob import Response
 from eventlet import patcher
 from eventlet import greenio
@@ -27,17 +30,113 @@ from ryu.lib import ofctl_v1_0
 from ryu.app.wsgi import ControllerBase, WSGIApplication, route
 import ryu.utils
 
-from switch import Switch, FLOW_IDLE_TIMEOUT, FLOW_HARD_TIMEOUT
+from switch import Switch, PROACTIVE_HOST_FLOW, LOG_SAMPLE_RATE
 from port import Port
 from gateway import Gateway
+from scheduler import TimerScheduler
+from fastpath import parse_packet, ARPTemplate
+from snapshot import save_snapshot, load_snapshot, SNAPSHOT_FILE, SNAPSHOT_INTERVAL
+from shard import ShardChannel, shard_config
+from metrics import REGISTRY, CONVERGENCE, CONTENT_TYPE, SampledLogger
 
 FORMAT = '%(name)s[%(levelname)s]%(message)s'
 logging.basicConfig(format=FORMAT)
 logger = logging.getLogger(__name__)
+sampled_logger = SampledLogger(logger, LOG_SAMPLE_RATE)
+
+PACKET_IN = REGISTRY.counter('routingflow_packet_in_total',
+                             'PacketIn messages received', ('type', ))
+PACKET_IN_TIME = REGISTRY.histogram('routingflow_packet_in_seconds',
+                                    'time to handle a PacketIn', ('type', ))
 
 routing_flow_instance_name = 'routing_flow_app'
 rest_body_ok = json.dumps({'msg': 'OK'})
 
+# size of the chunks of streaming JSON responses
+STREAM_CHUNK_SIZE = 65536
+
+# ETags are valid only within the same controller process
+ETAG_EPOCH = '%x' % int(time.time())
+
+def stream_json_list(items):
+    """
+        join serialized JSON items into a list and yield it in chunks,
+        the response is sent chunked without building the whole body.
+    """
+    chunk = ['[']
+    size = 1
+    for i, s in enumerate(items):
+        if i:
+            s = ',' + s
+        chunk.append(s)
+        size += len(s)
+        if size >= STREAM_CHUNK_SIZE:
+            yield ''.join(chunk)
+            chunk = []
+            size = 0
+    chunk.append(']')
+    yield ''.join(chunk)
+
+def json_list_response(req, items, serialized=False):
+    """
+        return a streaming response of the items paginated by
+        offset and limit in the query string.
+        set serialized if the items are JSON strings already.
+    """
+    try:
+        offset = int(req.GET.get('offset', 0))
+        limit = req.GET.get('limit')
+        limit = int(limit) if limit is not None else None
+        if offset < 0 or (limit is not None and limit < 0):
+            raise ValueError
+    except ValueError:
+        return Response(status=400)
+
+    stop = offset + limit if limit is not None else None
+    items = itertools.islice(items, offset, stop)
+    if not serialized:
+        items = itertools.imap(json.dumps, items)
+    return Response(content_type='application/json', app_iter=stream_json_list(items))
+
+def cached_response(req, version, build):
+    """
+        return 304 Not Modified if If-None-Match of the request
+        matches the ETag of version and the query string,
+        otherwise the response returned by build.
+    """
+    etag = '%s-%s' % (ETAG_EPOCH, hashlib.md5(repr((version, req.query_string))).hexdigest())
+    if etag in req.if_none_match:
+        return Response(status=304, etag=etag)
+
+    response = build()
+    if response.status_int == 200:
+        response.etag = etag
+    return response
+
+def subnet_filter(req):
+    """
+        return the subnet given by subnet in the query string,
+        or None if not given.
+    """
+    subnet = req.GET.get('subnet')
+    if subnet is None:
+        return None
+    return netaddr.IPNetwork(subnet)
+
+def parse_gateway(payload):
+    """
+        return the keyword arguments of Switch.update_gateway_with_prefixlen,
+        raise ValueError if any field is missing or invalid.
+    """
+    try:
+        gateway = {'ipv4': payload['ipv4'], 'ipv4_prefixlen': int(payload['ipv4_prefixlen']),
+                   'ipv6': payload['ipv6'], 'ipv6_prefixlen': int(payload['ipv6_prefixlen'])}
+        netaddr.IPNetwork('%s/%d' % (gateway['ipv4'], gateway['ipv4_prefixlen']))
+        netaddr.IPNetwork('%s/%d' % (gateway['ipv6'], gateway['ipv6_prefixlen']))
+    except (KeyError, TypeError, netaddr.AddrFormatError) as e:
+        raise ValueError(e)
+    return gateway
+
 class RoutingFlow(app_manager.RyuApp):
     def __init__(self, *args, **kwargs):
         super(RoutingFlow, self).__init__(*args, **kwargs)
@@ -45,10 +144,66 @@ class RoutingFlow(app_manager.RyuApp):
         # switches[dpid] = Switch
         self.switches = {}
 
+        # drive the timers of all the switches
+        self.scheduler = TimerScheduler()
+
+        # only the datapaths owned by this shard are handled,
+        # shard is None unless started as one of several controllers
+        self.shard = None
+        self.snapshot_file = SNAPSHOT_FILE
+        config = shard_config()
+        if config is not None:
+            self.shard = ShardChannel(config[0], config[1], self.switches)
+            if self.snapshot_file:
+                self.snapshot_file += '.%d' % config[0]
+
+        # snapshots[dpid] of the switches not connected yet since start
+        self.snapshots = {}
+        if self.snapshot_file:
+            self.snapshots = load_snapshot(self.snapshot_file)
+            self.scheduler.schedule(SNAPSHOT_INTERVAL, self.save_snapshot)
+
+        REGISTRY.gauge('routingflow_update_queue_depth',
+                       'routing updates waiting for the update worker', ('dpid', ),
+                       collect=lambda: [((dpid_lib.dpid_to_str(dpid), ), switch.queue.qsize())
+                                        for dpid, switch in self.switches.items()])
+        REGISTRY.gauge('routingflow_arp_buffer_depth',
+                       'packets buffered while resolving ARP', ('dpid', ),
+                       collect=lambda: [((dpid_lib.dpid_to_str(dpid), ), len(switch.msg_buffer))
+                                        for dpid, switch in self.switches.items()])
+        REGISTRY.gauge('routingflow_arp_entries',
+                       'entries in the ARP cache', ('dpid', ),
+                       collect=lambda: [((dpid_lib.dpid_to_str(dpid), ), len(switch.arp_table))
+                                        for dpid, switch in self.switches.items()])
+        REGISTRY.gauge('routingflow_routes',
+                       'entries in the routing table', ('dpid', ),
+                       collect=lambda: [((dpid_lib.dpid_to_str(dpid), ), len(switch.tbl))
+                                        for dpid, switch in self.switches.items()])
+
         # Register a restful controller for this module
         wsgi = kwargs['wsgi']
         wsgi.register(RoutingFlowRestController, {routing_flow_instance_name : self})
 
+    def save_snapshot(self):
+        """
+            save the state of all the switches for warm restart,
+            the switches not reconnected yet keep their old snapshot.
+        """
+        snapshots = dict(self.snapshots)
+        for dpid, switch in self.switches.items():
+            snapshots[dpid] = switch.snapshot()
+
+        try:
+            save_snapshot(self.snapshot_file, snapshots)
+        except (IOError, OSError) as e:
+            logger.warning('fail to save snapshot: %s', e)
+
+    def owns(self, dpid):
+        """
+            return True if the datapath is handled by this controller.
+        """
+        return self.shard is None or self.shard.owns(dpid)
+
     @set_ev_cls(topology.event.EventSwitchEnter)
     def switch_enter_handler(self, event):
         """
@@ -57,27 +212,44 @@ class RoutingFlow(app_manager.RyuApp):
             create a new Switch instance when KeyError occured.
         """
         dpid = event.switch.dp.id
+        if not self.owns(dpid):
+            return
+
         logger.info('switch enter (dpid=%s)', dpid_lib.dpid_to_str(dpid))
         try:
             s = self.switches[dpid]
         except KeyError:
-            s = Switch(event.switch.dp, self.switches)
+            s = Switch(event.switch.dp, self.switches, self.scheduler, self.shard)
             self.switches[dpid] = s
 
     @set_ev_cls(topology.event.EventSwitchLeave)
     def switch_leave_handler(self, event):
         """
             event handler triggered when switch leave.
-            delete the Switch object directly,
-            the broadcast thread will be killed by itself when
-            exception occured next time.
+            stop the timers and update worker,
+            delete the Switch object and withdraw the routes
+            through the links to it.
         """
         dpid = event.switch.dp.id
         logger.info('switch leave (dpid=%s)', dpid_lib.dpid_to_str(dpid))
         try:
-            del self.switches[dpid]
+            leaving_switch = self.switches.pop(dpid)
         except KeyError:
-            pass
+            if self.owns(dpid):
+                return
+            # switch of other shard, only the links to it are down here
+            leaving_switch = None
+            self.shard.forget(dpid)
+        else:
+            leaving_switch.stop()
+
+        # the links to the leaving switch are down
+        for switch in self.switches.values():
+            switch.neighbors.pop(leaving_switch, None)
+            switch.ports_changed()
+            for port_no, port in switch.ports.items():
+                if port.neighbor_switch_dpid == dpid:
+                    self.delete_link(port)
 
     @set_ev_cls(topology.event.EventPortAdd)
     def port_add_handler(self, event):
@@ -89,6 +261,7 @@ class RoutingFlow(app_manager.RyuApp):
         try:
             switch = self.switches[port.dpid]
             switch.ports[port.port_no] = port
+            switch.ports_changed()
             logger.info('port added, port_no=%s (dpid=%s)', portno_lib.port_no_to_str(port.port_no), dpid_lib.dpid_to_str(port.dpid))
         except:
             pass
@@ -97,20 +270,32 @@ class RoutingFlow(app_manager.RyuApp):
     def port_delete_handler(self, event):
         """
             event handler triggered when port deleted.
-            get Switch instance and delete specific Port object.
+            get Switch instance and delete specific Port object,
+            then withdraw the routes through it.
         """
         port = Port(event.port)
         logger.info('port deleted, port_no=%s (dpid=%s)', portno_lib.port_no_to_str(port.port_no), dpid_lib.dpid_to_str(port.dpid))
         try:
             switch = self.switches[port.dpid]
-            del switch.ports[port.port_no]
+            deleted_port = switch.ports.pop(port.port_no)
         except KeyError:
-            pass
+            return
+
+        switch.remove_arp_flows(deleted_port)
+        switch.sender.flush()
+        switch.link_down(port.port_no, port_deleted=True)
 
     def update_port_link(self, dpid, port):
         """
             Fulfill neighbor information for specific port.
         """
+        if dpid not in self.switches:
+            # the end of a link owned by other shard, a switch of this
+            # shard that has not connected yet is not remote
+            if not self.owns(dpid):
+                self.shard.remote_ports[(port.dpid, port.port_no)] = port
+            return
+
         switch = self.switches[dpid]
         try:
             p = switch.ports[port.port_no]
@@ -119,10 +304,16 @@ class RoutingFlow(app_manager.RyuApp):
         except KeyError:
             switch.ports[port.port_no] = port
 
-        neighbor_switch = self.switches[port.neighbor_switch_dpid]
-        switch.neighbors[neighbor_switch] = port.port_no
+        switch.tbl.reset_neighbor(port.port_no)
+        switch.add_to_queue(functools.partial(switch.restore_routes, switch.ports[port.port_no]))
+
+        neighbor_switch = self.switches.get(port.neighbor_switch_dpid)
+        if neighbor_switch is not None:
+            switch.neighbors[neighbor_switch] = port.port_no
+        switch.ports_changed()
+        CONVERGENCE.change()
 
-        logger.info('link connected: %s->%s', dpid_lib.dpid_to_str(switch.dp.id), dpid_lib.dpid_to_str(neighbor_switch.dp.id))
+        logger.info('link connected: %s->%s', dpid_lib.dpid_to_str(switch.dp.id), dpid_lib.dpid_to_str(port.neighbor_switch_dpid))
 
     @set_ev_cls(topology.event.EventLinkAdd)
     def link_add_handler(self, event):
@@ -139,8 +330,12 @@ class RoutingFlow(app_manager.RyuApp):
 
     def delete_link(self, port):
         """
-            Clear neighbor information for specific port.
+            Clear neighbor information for specific port
+            and withdraw the routes through it.
         """
+        if self.shard is not None:
+            self.shard.remote_ports.pop((port.dpid, port.port_no), None)
+
         try:
             switch = self.switches[port.dpid]
             p = switch.ports[port.port_no]
@@ -149,6 +344,7 @@ class RoutingFlow(app_manager.RyuApp):
 
         p.neighbor_switch_dpid = None
         p.neighbor_port_no = None
+        switch.link_down(port.port_no)
 
     @set_ev_cls(topology.event.EventLinkDelete)
     def link_delete_handler(self, event):
@@ -157,17 +353,15 @@ class RoutingFlow(app_manager.RyuApp):
             delete corresponding Port object then call delete_link
             to clear neighbor information.
         """
-        try:
-            switch1 = self.switches[event.link.src.dpid]
-            switch2 = self.switches[event.link.dst.dpid]
-            del switch1.neighbors[switch2]
-            del switch2.neighbors[switch1]
-        except KeyError:
-            return
+        switch1 = self.switches.get(event.link.src.dpid)
+        switch2 = self.switches.get(event.link.dst.dpid)
+        if switch1 and switch2:
+            switch1.neighbors.pop(switch2, None)
+            switch2.neighbors.pop(switch1, None)
 
         self.delete_link(event.link.src)
         self.delete_link(event.link.dst)
-        logger.info('link disconnected: %s->%s', dpid_lib.dpid_to_str(switch1.dp.id), dpid_lib.dpid_to_str(switch2.dp.id))
+        logger.info('link disconnected: %s->%s', dpid_lib.dpid_to_str(event.link.src.dpid), dpid_lib.dpid_to_str(event.link.dst.dpid))
 
     @set_ev_cls(ofp_event.EventOFPSwitchFeatures, [MAIN_DISPATCHER, CONFIG_DISPATCHER])
     def switch_feature_handler(self, event):
@@ -176,10 +370,13 @@ class RoutingFlow(app_manager.RyuApp):
             from switch.
         """
         dpid = event.msg.datapath_id
+        if not self.owns(dpid):
+            return
+
         try:
             switch = self.switches[dpid]
         except KeyError:
-            self.switches[dpid] = Switch(event.msg.datapath, self.switches)
+            self.switches[dpid] = Switch(event.msg.datapath, self.switches, self.scheduler, self.shard)
             switch = self.switches[dpid]
 
         for port_no, port in event.msg.ports.iteritems():
@@ -192,20 +389,19 @@ class RoutingFlow(app_manager.RyuApp):
             if port_no == ofproto_v1_0.OFPP_LOCAL:
                 switch.name = port.name.rstrip('\x00')
 
-    def find_packet(self, pkt, target):
-        """
-            try to extract the packet and find for specific
-            protocol.
-        """
-        for packet in pkt.protocols:
-            try:
-                if packet.protocol_name == target:
-                    return packet
-            except AttributeError:
-                pass
-        return None
+        switch.ports_changed()
+
+        # keep the traffic discarded by the controller off it
+        switch.deploy_filter_flows()
+        switch.sender.flush()
+
+        # warm restart with the snapshot saved before
+        try:
+            switch.restore(self.snapshots.pop(dpid))
+        except KeyError:
+            pass
 
-    def handle_arp_request(self, msg, pkt, arp_pkt):
+    def handle_arp_request(self, msg, header):
         """
             called when receiving ARP request from hosts.
             when a host send a request first time,
@@ -214,235 +410,271 @@ class RoutingFlow(app_manager.RyuApp):
         """
         switch = self.switches[msg.datapath.id]
         in_port_no = msg.in_port
-        req_dst_ip = arp_pkt.dst_ip
-        req_src_ip = arp_pkt.src_ip
+        req_dst_ip = header.dst_ip
+        req_src_ip = header.src_ip
         port = switch.ports[in_port_no]
 
-        logger.info('receive ARP request: who has %s? tell %s (dpid=%s)', str(req_dst_ip), str(req_src_ip), dpid_lib.dpid_to_str(msg.datapath.id))
+        sampled_logger.debug('receive ARP request: who has %s? tell %s (dpid=%s)', str(req_dst_ip), str(req_src_ip), dpid_lib.dpid_to_str(msg.datapath.id))
 
         # handle ARP request for gateway
         if port.gateway and port.gateway.ipv4 != netaddr.IPAddress(req_dst_ip):
-            logger.warning('cannot reply ARP, please check gateway configuration. (dpid=%s)', dpid_lib.dpid_to_str(msg.datapath.id))
+            sampled_logger.warning('cannot reply ARP, please check gateway configuration. (dpid=%s)', dpid_lib.dpid_to_str(msg.datapath.id))
             return
 
+        # the requester is a host in the subnet of gateway
+        if port.gateway and switch.find_outport_by_ip(req_src_ip) == in_port_no:
+            self.update_arp_entry(switch, header, in_port_no)
+
         datapath = msg.datapath
-        reply_src_mac = str(port.hw_addr)
-        ether_layer = self.find_packet(pkt, 'ethernet')
-
-        # pack a ARP reply packet
-        e = ethernet.ethernet(dst = ether_layer.src, src = reply_src_mac,
-                                ethertype = ether.ETH_TYPE_ARP)
-        a = arp.arp(hwtype = arp.ARP_HW_TYPE_ETHERNET,
-                    proto = ether.ETH_TYPE_IP,
-                    hlen = 6, plen = 4, opcode = arp.ARP_REPLY,
-                    src_mac = reply_src_mac, src_ip = req_dst_ip,
-                    dst_mac = arp_pkt.src_mac, dst_ip = req_src_ip)
-        p = packet.Packet()
-        p.add_protocol(e)
-        p.add_protocol(a)
-        p.serialize()
-
-        datapath.send_packet_out(in_port = ofproto_v1_0.OFPP_NONE,
-                actions = [datapath.ofproto_parser.OFPActionOutput(in_port_no)],
-                data = p.data)
-
-        logger.info('ARP replied: %s - %s', reply_src_mac, req_dst_ip)
-
-    def handle_arp_reply(self, msg, pkt, arp_pkt):
+
+        # patch the requester into the ARP reply template of the gateway,
+        # a port without gateway answers for any address
+        template = port.arp_template
+        if template is None:
+            template = ARPTemplate(port.hw_addr.packed, req_dst_ip)
+        data = template.reply(header.data[6:12], header.sha, req_src_ip)
+
+        out = datapath.ofproto_parser.OFPPacketOut(
+            datapath = datapath, buffer_id = datapath.ofproto.OFP_NO_BUFFER,
+            in_port = ofproto_v1_0.OFPP_NONE,
+            actions = [datapath.ofproto_parser.OFPActionOutput(in_port_no)],
+            data = data)
+        switch.sender.send(out)
+
+        sampled_logger.debug('ARP replied: %s - %s', port.hw_addr, req_dst_ip)
+
+    def handle_arp_reply(self, msg, header):
         """
             called when receiving ARP reply from hosts.
             the host will send their MAC address back to switch.
             (1) save the MAC address information in ARP table.
-            (2) try to resend the packet in the buffer.
-            (3) remove the sent packet from the buffer queue.
+            (2) resend the packets buffered for this host only.
         """
         switch = self.switches[msg.datapath.id]
         in_port_no = msg.in_port
         gateway = switch.ports[in_port_no].gateway
-        replied_buffer = []
 
-        logger.info('receive ARP reply: from %s (dpid=%s)', str(arp_pkt.src_ip), dpid_lib.dpid_to_str(msg.datapath.id))
+        sampled_logger.debug('receive ARP reply: from %s (dpid=%s)', header.src_ip, dpid_lib.dpid_to_str(msg.datapath.id))
 
-        if gateway and gateway.ipv4 == netaddr.IPAddress(arp_pkt.dst_ip):
-            self.update_arp_entry(switch, pkt)
+        if gateway and gateway.ipv4 == netaddr.IPAddress(header.dst_ip):
+            self.update_arp_entry(switch, header, in_port_no)
             # try to resend the buffered packets
-            for i in xrange(len(switch.msg_buffer)):
-                msg, pkt, outport_no = switch.msg_buffer[i]
-                if self.deliver_to_host(msg, pkt, outport_no):
-                    replied_buffer.append(i)
+            for buffered_msg, buffered_header in switch.msg_buffer.release(in_port_no, netaddr.IPAddress(header.src_ip)):
+                self.deliver_to_host(buffered_msg, buffered_header, in_port_no)
 
-            replied_buffer.sort(reverse = True)
-            for i in replied_buffer:
-                switch.msg_buffer.pop(i)
-
-    def update_arp_entry(self, switch, packet):
+    def update_arp_entry(self, switch, header, in_port_no):
         """
             update MAC address information in ARP table.
+            install the host flow immediately in proactive mode.
         """
-        ether_layer = self.find_packet(packet, 'ethernet')
-        
-        ip_layer = self.find_packet(packet, 'ipv4')
-        if ip_layer is None:
-            ip_layer = self.find_packet(packet, 'arp')
-            ip_layer.src = ip_layer.src_ip
+        eth_src = header.eth_src
+
+        sampled_logger.debug('update ARP entry: %s - %s (dpid=%s)', eth_src, header.src_ip, dpid_lib.dpid_to_str(switch.dp.id))
+        switch.arp_table.update(header.src_ip, eth_src)
 
-        logger.info('update ARP entry: %s - %s (dpid=%s)', ether_layer.src, ip_layer.src, dpid_lib.dpid_to_str(switch.dp.id))
-        switch.ip_to_mac[netaddr.IPAddress(ip_layer.src)] = (netaddr.EUI(ether_layer.src), time.time())
+        if PROACTIVE_HOST_FLOW:
+            switch.deploy_host_flow(netaddr.IPAddress(header.src_ip), netaddr.EUI(eth_src), in_port_no)
 
-    def handle_arp(self, msg, pkt, arp_pkt):
+    def handle_arp(self, msg, header):
         """
             called when receiving ARP packet,
             inspect the opcode then call corresponding methods.
         """
-        if arp_pkt.opcode == arp.ARP_REQUEST:
-            self.handle_arp_request(msg, pkt, arp_pkt)
-        elif arp_pkt.opcode == arp.ARP_REPLY:
-            self.handle_arp_reply(msg, pkt, arp_pkt)
+        if header.opcode == arp.ARP_REQUEST:
+            self.handle_arp_request(msg, header)
+        elif header.opcode == arp.ARP_REPLY:
+            self.handle_arp_reply(msg, header)
         else:
             return
 
-    def send_arp_request(self, datapath, outport_no, dst_ip):
-        """
-            pack and send ARP request for specific IP address.
-        """
-        src_mac_addr = str(self.switches[datapath.id].ports[outport_no].hw_addr)
-        src_ip = str(self.switches[datapath.id].ports[outport_no].gateway.ipv4)
-        dst_ip = str(dst_ip)
-        p = packet.Packet()
-        e = ethernet.ethernet(dst = mac.BROADCAST_STR,
-            src = src_mac_addr, ethertype = ether.ETH_TYPE_ARP)
-        p.add_protocol(e)
-        a = arp.arp_ip(opcode = arp.ARP_REQUEST, src_mac = src_mac_addr,
-                src_ip = src_ip, dst_mac = mac.DONTCARE_STR,
-                dst_ip = dst_ip)
-        p.add_protocol(a)
-        p.serialize()
-
-        datapath.send_packet_out(in_port = ofproto_v1_0.OFPP_NONE,
-            actions = [datapath.ofproto_parser.OFPActionOutput(outport_no)],
-            data = p.data)
-
-        logger.info('ARP request sent: who has %s? tell %s (dpid=%s)', dst_ip, src_ip, dpid_lib.dpid_to_str(datapath.id))
-
-    def handle_ip(self, msg, pkt, protocol_pkt):
+    def handle_ip(self, msg, header):
         """
-            handler for IP packet (currently not support ipv6)
-            (1) drop non-ipv4 packet.
-            (2) drop broadcast packet to 255.255.255.255
-            (3) try to deliver packet to the host if output port matched.
+            handler for IPv4 packet
+            (1) drop broadcast packet to 255.255.255.255
+            (2) try to deliver packet to the host if output port matched.
         """
-        if isinstance(protocol_pkt, ipv4.ipv4) == False:
-            logger.warning('cannot find ipv4 packet to process')
-            return
-
         src_switch = self.switches[msg.datapath.id]
 
-        ip_layer = self.find_packet(pkt, 'ipv4')
-
-        if str(ip_layer.dst) == '255.255.255.255':
+        if header.dst_ip == '255.255.255.255':
             return
 
-        outport_no = src_switch.find_outport_by_ip(ip_layer.dst)
+        outport_no = src_switch.find_outport_by_ip(header.dst_ip)
         if outport_no:
-            self.deliver_to_host(msg, pkt, outport_no)
+            self.deliver_to_host(msg, header, outport_no)
         else:
-            logger.warning('cannot find output port for %s (dpid=%s)', str(ip_layer.dst), dpid_lib.dpid_to_str(msg.datapath.id))
+            sampled_logger.warning('cannot find output port for %s (dpid=%s)', header.dst_ip, dpid_lib.dpid_to_str(msg.datapath.id))
 
-    def deliver_to_host(self, msg, pkt, outport_no):
+    def deliver_to_host(self, msg, header, outport_no):
         """
             deliver packet to host if the switch owns that subnet.
             (1) find ARP entry for destination IP address.
-                if failed, send ARP request and buffer the packet
-            (2) create a FlowMod packet.
-            (3) send FlowMod and PacketOut.
+                if failed, buffer the packet and send ARP request
+                unless one is already outstanding.
+            (2) create a FlowMod packet for the host.
+            (3) queue FlowMod and PacketOut, packet_in_handler
+                flushes them.
         """
-        ip_layer = self.find_packet(pkt, 'ipv4')
         dp = msg.datapath
         switch = self.switches[dp.id]
-        ipDestAddr = netaddr.IPAddress(ip_layer.dst)
+        ipDestAddr = netaddr.IPAddress(header.dst_ip)
 
-        logger.info('final switch arrived, try to deliver to %s (dpid=%s)', str(ipDestAddr), dpid_lib.dpid_to_str(msg.datapath.id))
+        sampled_logger.debug('final switch arrived, try to deliver to %s (dpid=%s)', str(ipDestAddr), dpid_lib.dpid_to_str(msg.datapath.id))
 
-        try:
-            mac_addr = switch.ip_to_mac[ipDestAddr][0]
-        except KeyError:
-            logger.info('no ARP entry for %s, packet buffered', str(ipDestAddr))
-            self.send_arp_request(msg.datapath, outport_no, ipDestAddr)
-            switch.msg_buffer.append((msg, pkt, outport_no))
+        mac_addr = switch.arp_table.lookup(ipDestAddr)
+        if mac_addr is None:
+            if switch.msg_buffer.add(outport_no, ipDestAddr, (msg, header)):
+                sampled_logger.debug('no ARP entry for %s, packet buffered', str(ipDestAddr))
+            else:
+                sampled_logger.warning('ARP buffer full, packet to %s dropped (dpid=%s)', str(ipDestAddr), dpid_lib.dpid_to_str(dp.id))
+            if switch.msg_buffer.request_due(outport_no, ipDestAddr):
+                switch.send_arp_request(outport_no, ipDestAddr)
             return False
 
-        # match by destination IP address
-        match = ofctl_v1_0.to_match(dp, {'nw_dst': str(ipDestAddr), 'dl_type': '2048', 'nw_proto': '1'})
-        
-        # rewrite source MAC address with gateway's MAC address
-        # rewrite destination MAC address with host's MAC address
-        # set output port
-        actions = []
-        actions.append(dp.ofproto_parser.OFPActionSetDlSrc(switch.ports[outport_no].hw_addr.packed))
-        actions.append(dp.ofproto_parser.OFPActionSetDlDst(mac_addr.packed))
-        actions.append(dp.ofproto_parser.OFPActionOutput(outport_no))
-
-        mod = dp.ofproto_parser.OFPFlowMod(
-                    datapath = dp, match = match,
-                    priority = 1, cookie = 0, actions = actions,
-                    idle_timeout = FLOW_IDLE_TIMEOUT,
-                    hard_timeout = FLOW_HARD_TIMEOUT,
-                    command = dp.ofproto.OFPFC_MODIFY)
+        actions = switch.deploy_host_flow(ipDestAddr, mac_addr, outport_no)
+
+        if msg.buffer_id == dp.ofproto.OFP_NO_BUFFER:
+            data = msg.data
+        else:
+            data = None
 
         out = dp.ofproto_parser.OFPPacketOut(
             datapath = dp, buffer_id = msg.buffer_id,
-            in_port = msg.in_port, actions = actions)
+            in_port = msg.in_port, actions = actions, data = data)
 
-        dp.send_msg(mod)
-        dp.send_msg(out)
+        switch.sender.send(out)
 
-        logger.info('FlowMod and PacketOut sent, packet delivered to %s', str(ipDestAddr))
+        sampled_logger.debug('FlowMod and PacketOut queued, packet delivered to %s', str(ipDestAddr))
         return True
 
     @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
     def packet_in_handler(self, event):
         """
             event handler triggered when receiving PacketIn from switch,
-            extract the packet and call corresponding method.
-        """
-        data = event.msg.data
-        pkt = packet.Packet(data)
-
-        for p in pkt.protocols:
-            if isinstance(p, arp.arp):
-                self.handle_arp(event.msg, pkt, p)
-            elif isinstance(p, ipv4.ipv4):
-                self.handle_ip(event.msg, pkt, p)
-            elif isinstance(p, ipv6.ipv6):
-                # logger.warning('ipv6 is currently not supported.')
-                pass
-            else:
-                pass
+            read the headers from raw data and call corresponding method.
+            the messages queued by the handlers are sent in one write.
+            ipv6 is currently not supported.
+        """
+        # every controller receives the PacketIns of sharded datapaths
+        if event.msg.datapath.id not in self.switches:
+            return
+
+        time_stamp = time.time()
+        header = parse_packet(event.msg.data)
+        if header is None:
+            PACKET_IN.inc('truncated')
+            return
+
+        if header.ethertype == ether.ETH_TYPE_ARP:
+            packet_type = 'arp'
+            self.handle_arp(event.msg, header)
+        elif header.ethertype == ether.ETH_TYPE_IP:
+            packet_type = 'ipv4'
+            self.handle_ip(event.msg, header)
+        elif header.ethertype == ether.ETH_TYPE_IPV6:
+            packet_type = 'ipv6'
+        else:
+            packet_type = 'other'
+
+        self.switches[event.msg.datapath.id].sender.flush()
+        PACKET_IN.inc(packet_type)
+        PACKET_IN_TIME.observe(time.time() - time_stamp, packet_type)
+
+    @set_ev_cls(ofp_event.EventOFPFlowStatsReply, MAIN_DISPATCHER)
+    def flow_stats_reply_handler(self, event):
+        """
+            event handler triggered when receiving the flow stats
+            requested for warm restart.
+        """
+        try:
+            switch = self.switches[event.msg.datapath.id]
+        except KeyError:
+            return
+
+        switch.restore_flows(event.msg.body, more=bool(event.msg.flags & ofproto_v1_0.OFPSF_REPLY_MORE))
+
+    @set_ev_cls(ofp_event.EventOFPBarrierReply, MAIN_DISPATCHER)
+    def barrier_reply_handler(self, event):
+        """
+            event handler triggered when the switch finished
+            processing a batch of messages.
+        """
+        try:
+            switch = self.switches[event.msg.datapath.id]
+        except KeyError:
+            return
+
+        switch.sender.barrier_reply(event.msg.xid)
 
 class RoutingFlowRestController(ControllerBase):
     def __init__(self, req, link, data, **config):
         super(RoutingFlowRestController, self).__init__(req, link, data, **config)
         self.routing_flow_app = data[routing_flow_instance_name]
 
+    # get metrics in Prometheus text format
+    # GET /routingflow/metrics
+    @route('routingflow', '/routingflow/metrics', methods=['GET'])
+    def get_metrics(self, req, **kwargs):
+        return Response(content_type=CONTENT_TYPE, charset='utf-8', body=REGISTRY.render())
+
     # get all switches
-    # GET /routingflow/switch
+    # GET /routingflow/switch?offset={offset}&limit={limit}
     @route('routingflow', '/routingflow/switch', methods=['GET'])
     def get_all_switch(self, req, **kwargs):
-        body = json.dumps([switch.to_dict() for (dpid, switch) in self.routing_flow_app.switches.items()])
-        return Response(content_type='application/json', body=body)
+        switches = sorted(self.routing_flow_app.switches.items())
+        version = [(dpid, switch.view_version('switch')) for (dpid, switch) in switches]
+        return cached_response(req, version, lambda: json_list_response(
+            req, (switch.get_view('switch') for (dpid, switch) in switches), serialized=True))
 
     # get single switch
     # GET /routingflow/switch/{dpid}
     @route('routingflow', '/routingflow/switch/{dpid}', methods=['GET'], requirements={'dpid': dpid_lib.DPID_PATTERN})
     def get_switch(self, req, **kwargs):
-        body = json.dumps(self.routing_flow_app.switches[dpid_lib.str_to_dpid(kwargs['dpid'])].to_dict())
-        return Response(content_type='application/json', body=body)
+        return self.switch_view_response(req, kwargs['dpid'], 'switch')
+
+    def switch_view_response(self, req, dpid, name, items=None):
+        """
+            return the cached view of the switch, or stream
+            the items if given for filtered or paginated requests.
+        """
+        try:
+            switch = self.routing_flow_app.switches[dpid_lib.str_to_dpid(dpid)]
+        except KeyError:
+            return Response(status=404)
+
+        def build():
+            if req.query_string and items is not None:
+                try:
+                    return json_list_response(req, items(switch))
+                except netaddr.AddrFormatError:
+                    return Response(status=400)
+            return Response(content_type='application/json', body=switch.get_view(name))
+
+        return cached_response(req, switch.view_version(name), build)
 
     # get arp table of switch
-    # GET /routingflow/switch/{dpid}/arp
+    # GET /routingflow/switch/{dpid}/arp?subnet={subnet}&offset={offset}&limit={limit}
     @route('routingflow', '/routingflow/switch/{dpid}/arp', methods=['GET'], requirements={'dpid': dpid_lib.DPID_PATTERN})
     def get_switch_arp(self, req, **kwargs):
-        body = json.dumps(self.routing_flow_app.switches[dpid_lib.str_to_dpid(kwargs['dpid'])].get_arp_list())
+        return self.switch_view_response(req, kwargs['dpid'], 'arp',
+                                         lambda switch: switch.iter_arp_list(subnet_filter(req)))
+
+    # get routing table of switch
+    # GET /routingflow/switch/{dpid}/route?subnet={subnet}&source={source}&offset={offset}&limit={limit}
+    @route('routingflow', '/routingflow/switch/{dpid}/route', methods=['GET'], requirements={'dpid': dpid_lib.DPID_PATTERN})
+    def get_switch_route(self, req, **kwargs):
+        return self.switch_view_response(req, kwargs['dpid'], 'route',
+                                         lambda switch: switch.iter_routing_table(subnet_filter(req), req.GET.get('source')))
+
+    # get ARP cache statistics of switch
+    # GET /routingflow/switch/{dpid}/arp/stats
+    @route('routingflow', '/routingflow/switch/{dpid}/arp/stats', methods=['GET'], requirements={'dpid': dpid_lib.DPID_PATTERN})
+    def get_switch_arp_stats(self, req, **kwargs):
+        try:
+            switch = self.routing_flow_app.switches[dpid_lib.str_to_dpid(kwargs['dpid'])]
+        except KeyError:
+            return Response(status=404)
+
+        body = json.dumps(switch.get_arp_stats())
         return Response(content_type='application/json', body=body)
 
     # add or update ARP entry of switch
@@ -454,8 +686,24 @@ class RoutingFlowRestController(ControllerBase):
         except:
             return Response(status=404)
 
+        # a single entry or a list of entries
         payload = json.loads(req.body)
-        switch.ip_to_mac[netaddr.IPAddress(payload['ip'])] = (payload['hw_addr'], time.time())
+        if not isinstance(payload, list):
+            payload = [payload]
+
+        try:
+            entries = [(netaddr.IPAddress(item['ip']), netaddr.EUI(item['hw_addr'])) for item in payload]
+        except (KeyError, TypeError, netaddr.AddrFormatError):
+            return Response(status=400)
+
+        for ip, hw_addr in entries:
+            switch.arp_table.update(ip, hw_addr)
+            outport_no = switch.find_outport_by_ip(ip)
+            if PROACTIVE_HOST_FLOW and outport_no:
+                switch.deploy_host_flow(ip, hw_addr, outport_no)
+
+        # all the host flows in one write
+        switch.sender.flush()
 
         return Response(status=200, body=rest_body_ok)
 
@@ -463,8 +711,7 @@ class RoutingFlowRestController(ControllerBase):
     # GET /routingflow/switch/{dpid}/port
     @route('routingflow', '/routingflow/switch/{dpid}/port', methods=['GET'], requirements={'dpid': dpid_lib.DPID_PATTERN})
     def get_switch_port(self, req, **kwargs):
-        body = json.dumps([port.to_dict() for (port_no, port) in self.routing_flow_app.switches[dpid_lib.str_to_dpid(kwargs['dpid'])].ports.items()])
-        return Response(content_type='application/json', body=body)
+        return self.switch_view_response(req, kwargs['dpid'], 'port')
 
     # update gateway info of switch
     # PUT /routingflow/switch/{dpid}/port/{portno}/gateway
@@ -481,3 +728,51 @@ class RoutingFlowRestController(ControllerBase):
                                 ipv6=payload['ipv6'], ipv6_prefixlen=int(payload['ipv6_prefixlen']), port_no=portno_lib.str_to_port_no(kwargs['portno']))
             
         return Response(status=200, body=rest_body_ok)
+
+    # update gateways of multiple ports of switch
+    # PUT /routingflow/switch/{dpid}/gateway
+    @route('routingflow', '/routingflow/switch/{dpid}/gateway', methods=['PUT'], requirements={'dpid': dpid_lib.DPID_PATTERN})
+    def put_switch_gateways(self, req, **kwargs):
+        try:
+            switch = self.routing_flow_app.switches[dpid_lib.str_to_dpid(kwargs['dpid'])]
+        except:
+            return Response(status=404)
+
+        try:
+            gateways = []
+            for item in json.loads(req.body):
+                gateway = parse_gateway(item)
+                gateway['port_no'] = portno_lib.str_to_port_no(item['port_no'])
+                if gateway['port_no'] not in switch.ports:
+                    return Response(status=404)
+                gateways.append(gateway)
+        except (KeyError, TypeError, ValueError):
+            return Response(status=400)
+
+        switch.update_gateways(gateways)
+        return Response(status=200, body=rest_body_ok)
+
+    # update gateways of multiple switches
+    # PUT /routingflow/gateway?dry_run=1 only validates the request
+    @route('routingflow', '/routingflow/gateway', methods=['PUT'])
+    def put_gateways(self, req, **kwargs):
+        switches = self.routing_flow_app.switches
+
+        # gateways[Switch] = list of gateway
+        gateways = {}
+        try:
+            for item in json.loads(req.body):
+                gateway = parse_gateway(item)
+                gateway['port_no'] = portno_lib.str_to_port_no(item['port_no'])
+                switch = switches.get(dpid_lib.str_to_dpid(item['dpid']))
+                if switch is None or gateway['port_no'] not in switch.ports:
+                    return Response(status=404)
+                gateways.setdefault(switch, []).append(gateway)
+        except (KeyError, TypeError, ValueError):
+            return Response(status=400)
+
+        if req.GET.get('dry_run'):
+            return Response(status=200, body=rest_body_ok)
+        for switch, switch_gateways in gateways.items():
+            switch.update_gateways(switch_gateways)
+        return Response(status=200, body=rest_body_ok)
@@ -0,0 +1,93 @@
+import heapq
+import itertools
+import random
+import time
+import logging
+
+from ryu.lib import hub
+
+logger = logging.getLogger(__name__)
+
+class Timer(object):
+    def __init__(self, interval, callback, args=(), jitter=0, periodic=True):
+        self.interval = interval
+        self.callback = callback
+        self.args = args
+        self.jitter = jitter
+        self.periodic = periodic
+        self.cancelled = False
+
+    def next_interval(self):
+        """
+            return the interval randomized by jitter,
+            prevent the timers with the same interval firing in the same time.
+        """
+        if self.jitter:
+            return max(0, self.interval + random.uniform(-self.jitter, self.jitter))
+        return self.interval
+
+    def cancel(self):
+        """
+            the cancelled timer will be discarded by the scheduler
+            when its deadline is reached.
+        """
+        self.cancelled = True
+
+class TimerScheduler(object):
+    """
+        a single green thread driving the timers of all the switches.
+        timers are kept in a heap ordered by deadline, the thread sleeps
+        until the earliest deadline or a new earlier timer is scheduled.
+    """
+    def __init__(self):
+        # heap of (deadline, sequence, Timer)
+        self.heap = []
+        self.sequence = itertools.count()
+        self.event = hub.Event()
+        self.thread = hub.spawn(self.run)
+
+    def schedule(self, interval, callback, *args, **kwargs):
+        """
+            create a timer calling callback(*args) every interval seconds,
+            pass periodic=False for one-shot timer.
+        """
+        timer = Timer(interval, callback, args,
+                      jitter=kwargs.get('jitter', 0),
+                      periodic=kwargs.get('periodic', True))
+        self.push(timer, time.time() + timer.next_interval())
+        return timer
+
+    def push(self, timer, deadline):
+        heapq.heappush(self.heap, (deadline, next(self.sequence), timer))
+        if self.heap[0][2] is timer:
+            self.event.set()
+
+    def run(self):
+        """
+            infinite loop to fire the expired timers.
+        """
+        while True:
+            now = time.time()
+            while self.heap and self.heap[0][0] <= now:
+                deadline, seq, timer = heapq.heappop(self.heap)
+                if timer.cancelled:
+                    continue
+
+                try:
+                    timer.callback(*timer.args)
+                except Exception:
+                    logger.exception('timer callback %s failed', timer.callback)
+
+                if timer.periodic and not timer.cancelled:
+                    heapq.heappush(self.heap, (now + timer.next_interval(), next(self.sequence), timer))
+
+            if self.heap:
+                timeout = max(0, self.heap[0][0] - time.time())
+            else:
+                timeout = None
+
+            self.event.clear()
+            self.event.wait(timeout=timeout)
+
+    def __len__(self):
+        return len(self.heap)
@@ -0,0 +1,97 @@
+import time
+import logging
+
+from ryu.lib.dpid import dpid_to_str
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+MESSAGES_SENT = REGISTRY.counter('routingflow_messages_sent_total',
+                                 'OpenFlow messages sent to datapaths', ('dpid', 'type'))
+INSTALL_TIME = REGISTRY.histogram('routingflow_batch_install_seconds',
+                                  'time from sending a batch to its barrier reply')
+
+class BatchSender(object):
+    """
+        per-datapath send queue.
+        the queued messages are serialized into a single buffer
+        and written to the datapath at once, an OFPBarrierRequest
+        can be appended to know when the whole batch is installed.
+    """
+    def __init__(self, dp):
+        self.dp = dp
+        self.dpid_label = dpid_to_str(dp.id)
+
+        # messages waiting for the next flush
+        self.pending = []
+
+        # barriers[xid] = (time_stamp, message_count)
+        self.barriers = {}
+
+        self.stats = {'batches': 0,
+                      'messages': 0,
+                      'barriers': 0}
+
+    def send(self, msg):
+        """
+            queue the message until flush is called.
+        """
+        self.pending.append(msg)
+
+        if msg.cls_msg_type == self.dp.ofproto.OFPT_FLOW_MOD:
+            MESSAGES_SENT.inc(self.dpid_label, 'flow_mod')
+        elif msg.cls_msg_type == self.dp.ofproto.OFPT_PACKET_OUT:
+            MESSAGES_SENT.inc(self.dpid_label, 'packet_out')
+        else:
+            MESSAGES_SENT.inc(self.dpid_label, 'other')
+
+    def flush(self, barrier=False):
+        """
+            serialize the queued messages into one buffer and send it,
+            return xid of the appended barrier or None.
+        """
+        if not self.pending:
+            return None
+
+        msgs = self.pending
+        self.pending = []
+
+        xid = None
+        if barrier:
+            barrier_msg = self.dp.ofproto_parser.OFPBarrierRequest(self.dp)
+            msgs.append(barrier_msg)
+
+        buf = bytearray()
+        for msg in msgs:
+            if msg.xid is None:
+                self.dp.set_xid(msg)
+            msg.serialize()
+            buf += msg.buf
+
+        if barrier:
+            xid = barrier_msg.xid
+            self.barriers[xid] = (time.time(), len(msgs) - 1)
+            self.stats['barriers'] += 1
+
+        self.dp.send(buf)
+        self.stats['batches'] += 1
+        self.stats['messages'] += len(msgs)
+        return xid
+
+    def barrier_reply(self, xid):
+        """
+            called when receiving OFPBarrierReply,
+            all the messages sent before the barrier are processed.
+        """
+        try:
+            time_stamp, count = self.barriers.pop(xid)
+        except KeyError:
+            return
+
+        elapsed = time.time() - time_stamp
+        INSTALL_TIME.observe(elapsed)
+        logger.info('batch of %d messages installed in %.3fs (dpid=%s)', count, elapsed, self.dpid_label)
+
+    def __len__(self):
+        return len(self.pending)
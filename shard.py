@@ -0,0 +1,207 @@
+import os
+import zlib
+import errno
+import socket
+import struct
+import logging
+import cPickle as pickle
+
+from ryu.lib import hub
+from ryu.lib.dpid import dpid_to_str
+
+logger = logging.getLogger(__name__)
+
+# run one controller per shard with ROUTINGFLOW_SHARD=<index>/<count>
+# in its environment, every switch connects to all of them and is
+# handled only by the shard owning its dpid
+SHARD_ENV = 'ROUTINGFLOW_SHARD'
+
+# Unix socket of each shard for the routing updates between shards
+SHARD_SOCKET = '/tmp/routingflow-shard-%d.sock'
+
+_frame_header = struct.Struct('!I')
+_dpid = struct.Struct('!Q')
+
+def shard_of(dpid, count):
+    """
+        return the index of the shard owning the datapath.
+    """
+    return (zlib.crc32(_dpid.pack(dpid)) & 0xffffffff) % count
+
+def shard_config():
+    """
+        return (index, count) of this controller from the environment,
+        or None if the datapaths are not sharded.
+    """
+    value = os.environ.get(SHARD_ENV)
+    if not value:
+        return None
+
+    try:
+        index, count = [int(v) for v in value.split('/')]
+    except ValueError:
+        raise ValueError('%s must be <index>/<count>, not %r' % (SHARD_ENV, value))
+    if not 0 <= index < count:
+        raise ValueError('shard index %d out of range of %d shards' % (index, count))
+
+    if count == 1:
+        return None
+    return index, count
+
+def recv_exactly(sock, size):
+    """
+        return size bytes read from the socket,
+        or an empty string if the peer closed the connection.
+    """
+    chunks = []
+    while size:
+        data = sock.recv(size)
+        if not data:
+            return ''
+        chunks.append(data)
+        size -= len(data)
+    return ''.join(chunks)
+
+class ShardChannel(object):
+    """
+        carry the advertisements and acknowledgements between the
+        switches owned by different shards.
+        a frame is the length followed by a pickled tuple:
+        ('adv', dpid, port_no, Advertisement) sent to the shard of the neighbor,
+        ('ack', dpid, port_no, version) sent back to the shard of the advertiser.
+        the port of the other end is known by the link discovery of
+        every shard, so only its dpid and port_no are sent.
+        a message is dropped if the peer shard is down, the routing
+        protocol sends the unacknowledged changes again.
+    """
+    def __init__(self, index, count, switches, path=SHARD_SOCKET):
+        self.index = index
+        self.count = count
+        self.path = path
+
+        # switches[dpid] = Switch owned by this shard
+        # reference to routing.py
+        self.switches = switches
+
+        # remote_ports[(dpid, port_no)] = Port of the other shard's switch
+        # on a link to this shard
+        self.remote_ports = {}
+
+        # outboxes[shard index] = queue of frames to that shard
+        self.outboxes = {}
+
+        self.stats = {'sent': 0,
+                      'received': 0,
+                      'dropped': 0}
+
+        self.server = self.listen(self.path % index)
+        self.thread = hub.spawn(self.serve)
+
+    def listen(self, path):
+        try:
+            os.unlink(path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+        # pickles are loaded from the socket, keep it private to the user
+        umask = os.umask(0o077)
+        try:
+            server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            server.bind(path)
+        finally:
+            os.umask(umask)
+        server.listen(self.count)
+        logger.info('shard %d/%d listening on %s', self.index, self.count, path)
+        return server
+
+    def owns(self, dpid):
+        return shard_of(dpid, self.count) == self.index
+
+    def advertise(self, port, adv):
+        """
+            send the advertisement on port to the neighbor owned by other shard.
+        """
+        self.send(port.neighbor_switch_dpid, ('adv', port.dpid, port.port_no, adv))
+
+    def acknowledge(self, port, version):
+        """
+            acknowledge the advertisement received from port of other shard.
+        """
+        self.send(port.dpid, ('ack', port.dpid, port.port_no, version))
+
+    def send(self, dpid, msg):
+        shard = shard_of(dpid, self.count)
+        try:
+            outbox = self.outboxes[shard]
+        except KeyError:
+            outbox = self.outboxes[shard] = hub.Queue()
+            hub.spawn(self.writer, shard, outbox)
+
+        payload = pickle.dumps(msg, pickle.HIGHEST_PROTOCOL)
+        outbox.put(_frame_header.pack(len(payload)) + payload)
+
+    def writer(self, shard, outbox):
+        """
+            long-lived loop writing the frames to a shard in order,
+            reconnect on the next frame after a failure.
+        """
+        sock = None
+        while True:
+            frame = outbox.get()
+            try:
+                if sock is None:
+                    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                    sock.connect(self.path % shard)
+                sock.sendall(frame)
+                self.stats['sent'] += 1
+            except socket.error as e:
+                logger.warning('fail to send to shard %d: %s', shard, e)
+                self.stats['dropped'] += 1
+                if sock is not None:
+                    sock.close()
+                    sock = None
+
+    def serve(self):
+        while True:
+            conn, addr = self.server.accept()
+            hub.spawn(self.receive, conn)
+
+    def receive(self, conn):
+        try:
+            while True:
+                header = recv_exactly(conn, _frame_header.size)
+                if not header:
+                    break
+                (length, ) = _frame_header.unpack(header)
+                payload = recv_exactly(conn, length)
+                if not payload:
+                    break
+                self.stats['received'] += 1
+                self.dispatch(pickle.loads(payload))
+        except socket.error as e:
+            logger.warning('connection from other shard lost: %s', e)
+        finally:
+            conn.close()
+
+    def dispatch(self, msg):
+        kind, dpid, port_no = msg[:3]
+        if kind == 'adv':
+            port = self.remote_ports.get((dpid, port_no))
+            if port is None:
+                logger.debug('advertisement from unknown port %s:%d dropped', dpid_to_str(dpid), port_no)
+                return
+            switch = self.switches.get(port.neighbor_switch_dpid)
+            if switch is not None:
+                switch.add_to_queue((port, msg[3]))
+        elif kind == 'ack':
+            switch = self.switches.get(dpid)
+            if switch is not None:
+                switch.tbl.acknowledge(port_no, msg[3])
+
+    def forget(self, dpid):
+        """
+            drop the remote ports of a datapath leaving the network.
+        """
+        for key in [key for key in self.remote_ports if key[0] == dpid]:
+            del self.remote_ports[key]
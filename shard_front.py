@@ -0,0 +1,203 @@
+"""
+    front process aggregating the REST interface of sharded controllers.
+
+    python shard_front.py --port 8080 http://127.0.0.1:8081 http://127.0.0.1:8082
+
+    the controllers are given in the order of their shard index,
+    the requests of a switch are forwarded to the shard owning it.
+"""
+import re
+import json
+import hashlib
+import urllib2
+import logging
+import argparse
+from collections import OrderedDict
+from wsgiref.simple_server import make_server
+
+from webob import Request, Response
+
+from ryu.lib import dpid as dpid_lib
+
+from metrics import CONTENT_TYPE
+from shard import shard_of
+
+logger = logging.getLogger(__name__)
+
+FORWARD_TIMEOUT = 10
+
+_switch_path = re.compile(r'^/routingflow/switch/(%s)(/.*)?$' % dpid_lib.DPID_PATTERN)
+
+def paginate(req, items):
+    try:
+        offset = int(req.GET.get('offset', 0))
+        limit = req.GET.get('limit')
+        limit = int(limit) if limit is not None else None
+    except ValueError:
+        return None
+    if offset < 0 or (limit is not None and limit < 0):
+        return None
+    if limit is None:
+        return items[offset:]
+    return items[offset:offset + limit]
+
+def label_sample(line, shard):
+    """
+        add shard label to a sample line of Prometheus text format.
+    """
+    name, sep, rest = line.partition('{')
+    if sep:
+        return '%s{shard="%d",%s' % (name, shard, rest)
+    name, sep, rest = line.partition(' ')
+    return '%s{shard="%d"} %s' % (name, shard, rest)
+
+class ShardFront(object):
+    def __init__(self, urls):
+        self.urls = urls
+
+    def forward(self, shard, req, path_qs=None, body=None, conditional=True):
+        """
+            return (status, headers, body) of the request sent to a shard.
+            If-None-Match is not forwarded unless conditional, the ETag
+            of a shard is not the one of a merged response.
+        """
+        url = self.urls[shard] + (path_qs or req.path_qs)
+        forwarded = urllib2.Request(url, data=body if body is not None else (req.body or None))
+        forwarded.get_method = lambda: req.method
+        names = ('Content-Type', 'If-None-Match') if conditional else ('Content-Type', )
+        for name in names:
+            if name in req.headers:
+                forwarded.add_header(name, req.headers[name])
+
+        try:
+            resp = urllib2.urlopen(forwarded, timeout=FORWARD_TIMEOUT)
+        except urllib2.HTTPError as e:
+            resp = e
+        except urllib2.URLError as e:
+            logger.warning('shard %d unreachable: %s', shard, e)
+            return 502, {}, ''
+
+        headers = dict((name, resp.info()[name]) for name in ('Content-Type', 'ETag') if name in resp.info())
+        return resp.getcode(), headers, resp.read()
+
+    def response(self, status, headers, body):
+        resp = Response(status=status, body=body)
+        for name, value in headers.items():
+            resp.headers[name] = value
+        return resp
+
+    def get_all_switch(self, req):
+        """
+            merge the switches of all the shards, the ETag is
+            computed from the merged body.
+        """
+        switches = []
+        for shard in range(len(self.urls)):
+            status, headers, body = self.forward(shard, req, path_qs='/routingflow/switch', conditional=False)
+            if status != 200:
+                return Response(status=status)
+            switches.extend(json.loads(body))
+        switches.sort(key=lambda s: s['dpid'])
+
+        switches = paginate(req, switches)
+        if switches is None:
+            return Response(status=400)
+
+        body = json.dumps(switches)
+        etag = hashlib.md5(body).hexdigest()
+        if etag in req.if_none_match:
+            return Response(status=304, etag=etag)
+        return Response(content_type='application/json', body=body, etag=etag)
+
+    def put_gateways(self, req):
+        # items[shard] = gateways of the switches owned by the shard
+        items = {}
+        try:
+            for item in json.loads(req.body):
+                shard = shard_of(dpid_lib.str_to_dpid(item['dpid']), len(self.urls))
+                items.setdefault(shard, []).append(item)
+        except (KeyError, TypeError, ValueError):
+            return Response(status=400)
+
+        # every shard validates its part before any of them applies it
+        for shard, shard_items in sorted(items.items()):
+            result = self.forward(shard, req, path_qs=req.path + '?dry_run=1', body=json.dumps(shard_items))
+            if result[0] != 200:
+                return self.response(*result)
+
+        # a shard failing now leaves the others applied,
+        # report the dpids of each outcome
+        applied = []
+        failed = []
+        for shard, shard_items in sorted(items.items()):
+            dpids = sorted(set(item['dpid'] for item in shard_items))
+            result = self.forward(shard, req, body=json.dumps(shard_items))
+            if result[0] == 200:
+                applied.extend(dpids)
+            else:
+                failed.extend(dpids)
+
+        if failed:
+            return Response(status=207, content_type='application/json',
+                            body=json.dumps({'applied': applied, 'failed': failed}))
+        return Response(status=200, body=json.dumps({'msg': 'OK'}))
+
+    def get_metrics(self, req):
+        """
+            merge the metrics of all the shards, labelled by shard.
+        """
+        # families[name] = (header lines, sample lines)
+        families = OrderedDict()
+        for shard in range(len(self.urls)):
+            status, headers, body = self.forward(shard, req, conditional=False)
+            if status != 200:
+                continue
+            family = None
+            for line in body.splitlines():
+                if line.startswith('# HELP ') or line.startswith('# TYPE '):
+                    name = line.split(' ', 3)[2]
+                    family = families.setdefault(name, ([], []))
+                    if line not in family[0]:
+                        family[0].append(line)
+                elif line and family is not None:
+                    family[1].append(label_sample(line, shard))
+
+        lines = []
+        for header, samples in families.values():
+            lines.extend(header)
+            lines.extend(samples)
+        return Response(content_type=CONTENT_TYPE, charset='utf-8', body='\n'.join(lines) + '\n')
+
+    def __call__(self, environ, start_response):
+        req = Request(environ)
+
+        if req.path == '/routingflow/switch' and req.method == 'GET':
+            resp = self.get_all_switch(req)
+        elif req.path == '/routingflow/gateway' and req.method == 'PUT':
+            resp = self.put_gateways(req)
+        elif req.path == '/routingflow/metrics' and req.method == 'GET':
+            resp = self.get_metrics(req)
+        else:
+            m = _switch_path.match(req.path)
+            if m is None:
+                resp = Response(status=404)
+            else:
+                shard = shard_of(dpid_lib.str_to_dpid(m.group(1)), len(self.urls))
+                resp = self.response(*self.forward(shard, req))
+
+        return resp(environ, start_response)
+
+def main():
+    parser = argparse.ArgumentParser(description='REST front of sharded RoutingFlow controllers')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('urls', nargs='+', help='REST URL of each shard in the order of shard index')
+    options = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    server = make_server(options.host, options.port, ShardFront([url.rstrip('/') for url in options.urls]))
+    logger.info('forwarding to %d shards on port %d', len(options.urls), options.port)
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
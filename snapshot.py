@@ -0,0 +1,52 @@
+import os
+import time
+import logging
+import cPickle as pickle
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT_VERSION = 1
+
+# set SNAPSHOT_FILE to None to disable warm restart
+SNAPSHOT_FILE = 'routingflow.snapshot'
+SNAPSHOT_INTERVAL = 30
+
+def save_snapshot(path, snapshots):
+    """
+        write snapshots[dpid] to path.
+        the state is a tree of tuples, integers and strings
+        returned by Switch.snapshot, pickled with the binary protocol.
+        the file is replaced atomically, a crash during writing
+        keeps the previous snapshot.
+    """
+    data = {'format': SNAPSHOT_FORMAT_VERSION,
+            'time': time.time(),
+            'switches': snapshots}
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp_path, path)
+
+def load_snapshot(path):
+    """
+        return snapshots[dpid] saved by save_snapshot,
+        or an empty dictionary if the file is missing or unreadable.
+    """
+    try:
+        with open(path, 'rb') as f:
+            data = pickle.load(f)
+    except IOError:
+        return {}
+    except Exception as e:
+        logger.warning('ignore broken snapshot %s: %s', path, e)
+        return {}
+
+    if data.get('format') != SNAPSHOT_FORMAT_VERSION:
+        logger.warning('ignore snapshot %s of unknown format', path)
+        return {}
+
+    logger.info('snapshot of %d switches loaded, saved %ds ago', len(data['switches']), time.time() - data['time'])
+    return data['switches']
@@ -2,7 +2,9 @@ import netaddr
 import logging
 import time
 import datetime
-from threading import Thread
+import functools
+import zlib
+import json
 
 from ryu.topology import switches
 from ryu.topology.switches import Port as Port_type
@@ -11,18 +13,78 @@ from ryu.lib.port_no import port_no_to_str
 from ryu.lib import hub
 from ryu.ofproto.ofproto_v1_0_parser import OFPPhyPort
 from ryu.lib import ofctl_v1_0
+from ryu.lib import mac
+from ryu.ofproto import ofproto_v1_0, ether
 
-from rip import RIPRoutingTable as RoutingTable
-from rip import RIPRoutingEntry as RoutingEntry
+from rip import RIPRoutingTable
+from linkstate import LinkStateRoutingTable
 from gateway import Gateway
+from arp_buffer import ARPPendingBuffer
+from arp_cache import ARPCache
+from sender import BatchSender
+from aggregate import aggregate_routes
+from fastpath import ARPTemplate
+from base.lpm import IPV4_MAX_PREFIXLEN
+from metrics import REGISTRY, CONVERGENCE, SampledLogger
 
 logger = logging.getLogger(__name__)
 
+# per-packet messages are logged once in LOG_SAMPLE_RATE times
+LOG_SAMPLE_RATE = 100
+sampled_logger = SampledLogger(logger, LOG_SAMPLE_RATE)
+
+UPDATE_TIME = REGISTRY.histogram('routingflow_update_batch_seconds',
+                                 'time to process a batch of queued routing updates')
+
 FLOW_IDLE_TIMEOUT = 60
-FLOW_HARD_TIMEOUT = 600
+
+# routing protocol run by all the switches, a key of ROUTING_PROTOCOLS
+ROUTING_PROTOCOL = 'rip'
+ROUTING_PROTOCOLS = {'rip': RIPRoutingTable,
+                     'linkstate': LinkStateRoutingTable}
+
+# routing flow priority is ROUTING_FLOW_PRIORITY + prefixlen * 2
+# to emulate longest prefix match, the source-specific flows of a
+# multipath route are one above, host flows are above all of them
+ROUTING_FLOW_PRIORITY = 1
+HOST_FLOW_PRIORITY = ROUTING_FLOW_PRIORITY + IPV4_MAX_PREFIXLEN * 2 + 2
+
+# the sources of a multipath route are split into
+# 2 ** MULTIPATH_SOURCE_BITS buckets, each hashed to one of the paths
+MULTIPATH_SOURCE_BITS = 2
+
+# drop IPv6 and IPv4 broadcast, which the controller discards anyway,
+# and send up only the ARP for the gateway address of a port.
+# the filter flows are below the routing flows, so only the packets
+# missing all of them are dropped
+FILTER_FLOWS = True
+FILTER_FLOW_PRIORITY = 0
+ARP_FLOW_PRIORITY = FILTER_FLOW_PRIORITY + 1
+
+# install host flows when ARP entries are learned or refreshed,
+# instead of waiting for the first IPv4 PacketIn
+PROACTIVE_HOST_FLOW = True
+
+# merge adjacent subnets with the same next hop into one flow entry,
+# a supernet may contain routes of other next hops with longer
+# prefixes, so the routing flows are always modified strictly
+ROUTE_AGGREGATION = True
+ADVERTISE_JITTER = 5
+
+# every FULL_ADVERTISE_EVERY-th periodic advertisement carries the
+# whole routing table instead of the changes since the acknowledged
+# version, so a lost or ignored change is repaired eventually
+FULL_ADVERTISE_EVERY = 3
+TRIGGERED_UPDATE_INTERVAL = 2
+ARP_BUFFER_EXPIRE_INTERVAL = 1
+ARP_TABLE_CHECK_INTERVAL = 5
+
+# routing flow entries are kept during warm restart until
+# the routes are learned again or this time passed
+GRACEFUL_RESTART_TIME = 60
 
 class Switch(switches.Switch):
-    def __init__(self, dp, s):
+    def __init__(self, dp, s, scheduler, shard=None):
         super(Switch, self).__init__(dp)
 
         self.name = None
@@ -30,6 +92,17 @@ class Switch(switches.Switch):
         # switches[dpid] = Switch
         # reference to routing.py
         self.switches = s
+
+        # TimerScheduler shared by all the switches
+        self.scheduler = scheduler
+        self.timers = []
+
+        # ShardChannel to the neighbors owned by other controllers,
+        # None if all the switches are in this controller
+        self.shard = shard
+        self.triggered_timer = None
+        self.last_triggered_update = 0
+        self.periodic_advertisements = 0
         
         # neigbors[Switch] = port_no
         self.neighbors = {}
@@ -39,115 +112,432 @@ class Switch(switches.Switch):
         self.ports = {}
 
         # ARP table
-        # ip_to_mac[ip_addr] = (mac_addr, time_stamp)
-        self.ip_to_mac = {}
+        # in proactive mode the traffic of hosts never reaches the
+        # controller, so all the entries are refreshed before expiry
+        self.arp_table = ARPCache(refresh_all=PROACTIVE_HOST_FLOW,
+                                  evict_callback=self.remove_host_flow)
 
         # temporarily store packets without ARP entry
-        self.msg_buffer = []
+        self.msg_buffer = ARPPendingBuffer()
 
         self.queue = hub.Queue()
-        self.tbl = RoutingTable(self.dp.id)
+        self.tbl = ROUTING_PROTOCOLS[ROUTING_PROTOCOL](self.dp.id)
+
+        # queue FlowMods and PacketOuts to send them in one write
+        self.sender = BatchSender(self.dp)
+
+        # shadow of routing flow entries installed on the datapath
+        # installed_flows[(subnet, src_subnet)] = (out_port_no, src_hw_addr, dst_hw_addr)
+        # src_subnet is None for the flow matching any source
+        self.installed_flows = {}
+
+        # snapshot being restored on warm restart
+        # restored_hosts[ip_addr] = hw_addr of host flows on the datapath
+        self.restoring = None
+        self.restored_hosts = {}
+        self.graceful_until = 0
+
+        # serialized REST views
+        # view_cache[name] = (version, json)
+        # port_revision is increased when ports, neighbors or gateways change
+        self.view_cache = {}
+        self.port_revision = 0
 
         self.init_thread()
 
     def init_thread(self):
         """
-            create a thread for routing table advertising.
+            register timers for routing table advertising,
+            route expiration and garbage collection,
+            and create a worker to process the routing information
+            advertised by neighbors.
+        """
+        logger.info('advertise timer start with interval %ds (dpid=%s)', self.tbl.advertise_interval, dpid_to_str(self.dp.id))
+        self.timers.append(self.scheduler.schedule(self.tbl.advertise_interval, self.periodic_advertise,
+                                                   jitter=ADVERTISE_JITTER))
+        self.timers.append(self.scheduler.schedule(self.tbl.advertise_interval, self.add_to_queue,
+                                                   self.tbl.mark_invalid_route, jitter=ADVERTISE_JITTER))
+        self.timers.append(self.scheduler.schedule(self.tbl.gc_interval, self.add_to_queue,
+                                                   self.tbl.garbage_collect, jitter=ADVERTISE_JITTER))
+        self.timers.append(self.scheduler.schedule(ARP_BUFFER_EXPIRE_INTERVAL, self.expire_arp_buffer))
+        self.timers.append(self.scheduler.schedule(ARP_TABLE_CHECK_INTERVAL, self.refresh_arp_table))
+
+        self.worker = hub.spawn(self.update_worker)
+
+    def advertise(self, full=False):
+        """
+            advertise the routing table to all the neighbors.
+            trigger neighbor swtich to update routing information instantly.
+            each neighbor receives only the routes changed after
+            the version it acknowledged, or the whole table if full.
         """
-        logger.info('broadcast thread start with interval %ds (dpid=%s)', self.tbl.advertise_interval, dpid_to_str(self.dp.id))
-        broadcast_thread = Thread(target=self.broadcast_thread)
-        broadcast_thread.setDaemon(True)
-        broadcast_thread.start()
+        logger.info('broadcast routing table (dpid=%s)', dpid_to_str(self.dp.id))
+        self.tbl.pop_changes()
 
-    def broadcast_thread(self):
+        for port_no, port in self.ports.items():
+            if port.neighbor_switch_dpid:
+                try:
+                    neighbor = self.switches[port.neighbor_switch_dpid]
+                except KeyError:
+                    if self.shard is not None and not self.shard.owns(port.neighbor_switch_dpid):
+                        self.shard.advertise(port, self.tbl.advertisement(port, full))
+                    continue
+                neighbor.add_to_queue((port, self.tbl.advertisement(port, full)))
+
+    def periodic_advertise(self):
+        """
+            called every advertise_interval by the timer,
+            the whole table is sent once in FULL_ADVERTISE_EVERY times,
+            the versions acknowledged by the neighbors are kept.
+        """
+        self.periodic_advertisements += 1
+        self.advertise(full=self.periodic_advertisements % FULL_ADVERTISE_EVERY == 0)
+
+    def triggered_update(self):
         """
-            infinite loop to advertise the routing table to
-            all the neighbors. trigger neighbor swtich to update
-            routing information instantly.
+            advertise the changed routes to all the neighbors
+            without waiting for the periodic advertisement.
+            rate-limited to once every TRIGGERED_UPDATE_INTERVAL seconds,
+            the changes in the meantime are sent together.
+        """
+        if self.triggered_timer is not None or not self.tbl.changed:
+            return
+
+        wait = self.last_triggered_update + TRIGGERED_UPDATE_INTERVAL - time.time()
+        if wait > 0:
+            self.triggered_timer = self.scheduler.schedule(wait, self.send_triggered_update, periodic=False)
+        else:
+            self.send_triggered_update()
+
+    def send_triggered_update(self):
+        self.triggered_timer = None
+        if not self.tbl.changed:
+            return
+
+        logger.info('triggered update of %d routes (dpid=%s)', len(self.tbl.changed), dpid_to_str(self.dp.id))
+        self.last_triggered_update = time.time()
+        self.advertise()
+
+    def update_worker(self):
+        """
+            long-lived loop to process the queued routing information.
+            wait for the first advertisement, then drain the queue
+            so that a burst of advertisements is handled as one batch.
         """
         while True:
-            try:
-                logger.info('broadcast routing table (dpid=%s)', dpid_to_str(self.dp.id))
-                for port_no, port in self.ports.items():
-                    if port.neighbor_switch_dpid:
-                        self.switches[port.neighbor_switch_dpid].add_to_queue((port, self.tbl))
-                        self.switches[port.neighbor_switch_dpid].trigger_update()
-                time.sleep(self.tbl.advertise_interval)
-            except:
-                logger.info('broadcast thread of dpid=%s is killed', dpid_to_str(self.dp.id))
+            msg = self.queue.get()
+            if msg is None:
                 break
 
-    def process_queued_msg(self):
+            batch = [msg]
+            while not self.queue.empty():
+                msg = self.queue.get()
+                if msg is None:
+                    self.process_queued_msg(batch)
+                    return
+                batch.append(msg)
+
+            time_stamp = time.time()
+            self.process_queued_msg(batch)
+            UPDATE_TIME.observe(time.time() - time_stamp)
+
+        logger.info('update worker of dpid=%s is stopped', dpid_to_str(self.dp.id))
+
+    def process_queued_msg(self, batch):
         """
-            try to process all the queued routing information.
+            merge the advertisements from the same neighbor port
+            into one, update the routing table and
+            deploy it once for the whole batch.
+            callable messages are jobs queued by timers
+            (expiration, garbage collection), run after the updates.
+            a failure is logged and skips only its own step.
         """
+        latest = {}
+        jobs = []
+        for msg in batch:
+            if callable(msg):
+                if msg not in jobs:
+                    jobs.append(msg)
+            else:
+                # advertisements carry only the changes,
+                # so the later advertisement is merged into the former
+                port, adv = msg
+                key = (port.dpid, port.port_no)
+                if key in latest:
+                    adv = latest[key][1].merge(adv)
+                latest[key] = (port, adv)
+
+        for port, adv in latest.values():
+            # the link may be deleted after the advertisement is queued
+            if port.neighbor_port_no not in self.ports:
+                logger.debug('advertisement from deleted link %s:%s dropped (dpid=%s)', dpid_to_str(port.dpid),
+                             port_no_to_str(port.port_no), dpid_to_str(self.dp.id))
+                continue
+            try:
+                reveived_port = self.ports[port.neighbor_port_no]
+                version = self.tbl.update_by_neighbor(reveived_port, port, adv)
+                if port.dpid in self.switches:
+                    self.switches[port.dpid].tbl.acknowledge(port.port_no, version)
+                elif self.shard is not None:
+                    self.shard.acknowledge(port, version)
+            except Exception:
+                logger.exception('fail to process advertisement from %s:%s (dpid=%s)', dpid_to_str(port.dpid),
+                                 port_no_to_str(port.port_no), dpid_to_str(self.dp.id))
+
+        for job in jobs:
+            try:
+                job()
+            except Exception:
+                logger.exception('fail to run routing job (dpid=%s)', dpid_to_str(self.dp.id))
+
         try:
-            while not self.queue.empty():
-                port, tbl = self.queue.get()
-                reveived_port = self.switches[port.neighbor_switch_dpid].ports[port.neighbor_port_no]
-                self.tbl.update_by_neighbor(reveived_port, port, tbl)
             self.deploy_routing_table()
-        except:
-            pass
+        except Exception:
+            logger.exception('fail to deploy routing table (dpid=%s)', dpid_to_str(self.dp.id))
+
+        try:
+            self.triggered_update()
+        except Exception:
+            logger.exception('fail to send triggered update (dpid=%s)', dpid_to_str(self.dp.id))
+
+    def link_down(self, port_no, port_deleted=False):
+        """
+            withdraw the routes through port_no immediately
+            when the link or port is down.
+            the update worker deletes their flow entries
+            and sends triggered update.
+        """
+        self.tbl.reset_neighbor(port_no)
+        self.ports_changed()
+        CONVERGENCE.change()
+        self.add_to_queue(functools.partial(self.tbl.invalidate_port, port_no, port_deleted))
 
     def add_to_queue(self, msg):
         """
-            a interface to add a object into queue.
+            a interface to add a object into queue,
+            the update worker will be woken up to process it.
         """
         if not self.queue.full():
             self.queue.put(msg)
 
-    def trigger_update(self):
+    def stop(self):
         """
-            create a thread to update the routing table.
+            cancel the timers and stop the update worker
+            when the switch leaves.
         """
-        update_thread = Thread(target=self.process_queued_msg)
-        update_thread.setDaemon(True)
-        update_thread.start()
+        for timer in self.timers:
+            timer.cancel()
+        self.timers = []
+        if self.triggered_timer is not None:
+            self.triggered_timer.cancel()
+        self.queue.put(None)
 
     def get_arp_list(self):
         """
             return ARP table as a list of dictionary.
         """
-        arp_list = []
-        for ip, value in self.ip_to_mac.items():
-            arp_list.append({'ip': str(ip),
-                             'hw_addr': str(value[0]),
-                             'last_update': datetime.datetime.fromtimestamp(value[1]).strftime('%Y-%m-%d %H:%M:%S')})
+        return self.arp_table.to_list()
+
+    def iter_arp_list(self, within=None):
+        """
+            yield ARP entries as dictionary ordered by IP address,
+            only the ones inside subnet within if given.
+        """
+        return self.arp_table.iter_list(within)
 
-        return arp_list
+    def get_arp_stats(self):
+        """
+            return ARP cache and pending buffer counters.
+        """
+        d = self.arp_table.get_stats()
+        d['buffer'] = dict(self.msg_buffer.stats)
+        d['buffer']['packets'] = len(self.msg_buffer)
+        return d
+
+    def refresh_arp_table(self):
+        """
+            evict the expired ARP entries and send unicast ARP request
+            to the hosts in use before their entries expire.
+        """
+        for ip, hw_addr in self.arp_table.expire():
+            outport_no = self.find_outport_by_ip(ip)
+            if outport_no:
+                self.send_arp_request(outport_no, ip, hw_addr)
+
+        self.sender.flush()
+
+    def expire_arp_buffer(self):
+        """
+            drop the expired packets waiting for ARP replies
+            and send ARP request again to the unresolved hosts.
+        """
+        for outport_no, ip in self.msg_buffer.expire():
+            port = self.ports.get(outport_no)
+            if port is not None and port.arp_template is not None:
+                self.send_arp_request(outport_no, ip)
+
+        self.sender.flush()
+
+    def send_arp_request(self, outport_no, dst_ip, dst_mac=None):
+        """
+            pack and send ARP request for specific IP address,
+            broadcast unless the MAC address is given.
+        """
+        port = self.ports[outport_no]
+        if dst_mac is not None:
+            dst_mac = dst_mac.packed
+        data = port.arp_template.request(dst_ip, dst_mac)
+
+        # queued, the caller flushes
+        out = self.dp.ofproto_parser.OFPPacketOut(
+            datapath = self.dp, buffer_id = self.dp.ofproto.OFP_NO_BUFFER,
+            in_port = ofproto_v1_0.OFPP_NONE,
+            actions = [self.dp.ofproto_parser.OFPActionOutput(outport_no)],
+            data = data)
+        self.sender.send(out)
+
+        sampled_logger.debug('ARP request sent: who has %s? tell %s (dpid=%s)', dst_ip, port.gateway.ipv4, dpid_to_str(self.dp.id))
 
     def get_routing_table(self):
         """
             return routing table as a list of dictionary.
         """
-        routing_tbl = []
-        for subnet, entry in self.tbl.items():
-            d = entry.to_dict()
-            d['subnet'] = str(subnet)
-            routing_tbl.append(d)
+        return [d for (subnet, source, d) in self.tbl.current().routes]
 
-        return routing_tbl
+    def iter_routing_table(self, within=None, source=None):
+        """
+            return an iterator of routing entries as dictionary ordered by subnet,
+            only the subnets inside subnet within and learned from
+            source if given.
+            the routes are read from one version of the routing table,
+            the changes while iterating are not seen.
+        """
+        routes = self.tbl.current().routes
+        return (d for (subnet, route_source, d) in routes
+                if (within is None or subnet in within) and (source is None or route_source == source))
 
     def deploy_routing_table(self):
         """
-            deploy all the routing entry in the routing table.
+            deploy the difference between the routing table and
+            the flow entries already installed on the datapath.
+            (1) send FlowMod for added or changed routes.
+            (2) delete flow entries of withdrawn routes.
+            all the FlowMods are sent in one batch followed by a barrier.
+            with ROUTE_AGGREGATION the routes are merged into supernets
+            before comparing with the installed flow entries.
         """
+        # routes[subnet] = tuple of flow signatures
+        # ports[flow signature] = (receive_port, neighbor_port)
+        routes = {}
+        ports = {}
         for subnet, entry in self.tbl.items():
-            if entry.neighbor_port:
-                self.deploy_flow_entry(subnet=subnet, outport=entry.receive_port, dstport=entry.neighbor_port)
+            if entry.neighbor_port and self.tbl.reachable(entry):
+                signatures = []
+                for receive_port, neighbor_port in entry.paths():
+                    signature = self.flow_signature(receive_port, neighbor_port)
+                    ports[signature] = (receive_port, neighbor_port)
+                    signatures.append(signature)
+                routes[subnet] = tuple(sorted(signatures))
+
+        if ROUTE_AGGREGATION:
+            routes = aggregate_routes(routes)
+
+        # flows[(subnet, src_subnet)] = flow signature
+        flows = {}
+        sources = None
+        for subnet, signatures in routes.items():
+            if len(signatures) == 1:
+                flows[(subnet, None)] = signatures[0]
+            else:
+                if sources is None:
+                    sources = self.multipath_sources()
+                flows.update(self.multipath_flows(subnet, signatures, sources))
+
+        changed = False
+        for key, signature in flows.items():
+            if self.installed_flows.get(key) != signature:
+                outport, dstport = ports[signature]
+                self.deploy_flow_entry(subnet=key[0], outport=outport, dstport=dstport, src=key[1])
+                changed = True
+
+        # keep the flow entries during warm restart
+        if time.time() >= self.graceful_until:
+            for key in self.installed_flows.keys():
+                if key not in flows:
+                    self.remove_flow_entry(*key)
+                    changed = True
+
+        if changed:
+            CONVERGENCE.flows_changed()
+        self.sender.flush(barrier=True)
+
+    def multipath_sources(self):
+        """
+            return the source buckets of multipath routes, the prefix
+            spanning all the known subnets split into
+            2 ** MULTIPATH_SOURCE_BITS prefixes of equal length.
+            OpenFlow 1.0 only wildcards the low bits of nw_src,
+            so the buckets are the high bits after the spanning prefix.
+        """
+        subnets = [subnet.cidr for subnet in self.tbl.keys()]
+        if not subnets:
+            return []
+        elif len(subnets) == 1:
+            spanning = subnets[0]
+        else:
+            spanning = netaddr.spanning_cidr(subnets).cidr
+
+        prefixlen = min(spanning.prefixlen + MULTIPATH_SOURCE_BITS, IPV4_MAX_PREFIXLEN)
+        return list(spanning.subnet(prefixlen))
 
-    def deploy_flow_entry(self, subnet, outport, dstport):
+    def multipath_flows(self, subnet, signatures, sources):
+        """
+            OpenFlow 1.0 has no select group, so the traffic to a
+            multipath route is spread by source, each bucket of
+            sources is hashed to one of the paths.
+            rendezvous hashing is used, removing a path only moves
+            the sources hashed to it.
+            the buckets never overlap, so they share one priority, and
+            a bucket on the same path as the other sources is left to
+            the flow entry of src_subnet=None.
+            return flows[(subnet, src_subnet)] = flow signature,
+            at most 2 ** MULTIPATH_SOURCE_BITS + 1 flow entries.
+        """
+        def pick(src):
+            return max(signatures, key=lambda signature: zlib.crc32('%s %s' % (src, signature)))
+
+        default = pick(None)
+        flows = {(subnet, None): default}
+        for src in sources:
+            signature = pick(src)
+            if signature != default:
+                flows[(subnet, src)] = signature
+        return flows
+
+    def flow_signature(self, outport, dstport):
+        """
+            return the fields of a routing flow entry which
+            require a FlowMod when changed.
+        """
+        return (outport.port_no, outport.hw_addr, dstport.hw_addr)
+
+    def deploy_flow_entry(self, subnet, outport, dstport, src=None):
         """
             translate the routing information into flow entry format
-            and send FlowMod.
+            and queue FlowMod, src limits the flow entry to a source
+            subnet for multipath routes.
+            routing flow entries are permanent, they are removed
+            explicitly by remove_flow_entry when the route is withdrawn.
+            OFPFC_MODIFY_STRICT only touches the entry of the same match
+            and priority, or adds it, a non-strict one would rewrite
+            all the more specific entries inside subnet too.
         """
         if outport is None:
             logger.warning('fail to deploy flow entry, cant find output port for %s', str(subnet))
             return
 
         # match by destination IP address
-        match = ofctl_v1_0.to_match(self.dp, {'nw_dst': str(subnet), 'dl_type': '2048', 'nw_proto': '1'})
+        match = self.routing_flow_match(subnet, src)
         
         # rewrite source MAC address with gateway's MAC address
         # rewrite destination MAC address with host's MAC address
@@ -159,39 +549,192 @@ class Switch(switches.Switch):
 
         mod = self.dp.ofproto_parser.OFPFlowMod(
                     datapath = self.dp, match = match,
-                    priority = 1, cookie = 0, actions = actions,
-                    idle_timeout = FLOW_IDLE_TIMEOUT,
-                    hard_timeout = FLOW_HARD_TIMEOUT,
-                    command = self.dp.ofproto.OFPFC_MODIFY)
+                    priority = self.routing_flow_priority(subnet, src), cookie = 0, actions = actions,
+                    idle_timeout = 0, hard_timeout = 0,
+                    command = self.dp.ofproto.OFPFC_MODIFY_STRICT)
+
+        # queue FlowMod
+        self.sender.send(mod)
+        self.installed_flows[(subnet, src)] = self.flow_signature(outport, dstport)
+
+    def remove_flow_entry(self, subnet, src=None):
+        """
+            delete the flow entry of withdrawn route by
+            sending FlowMod with OFPFC_DELETE_STRICT.
+        """
+        mod = self.dp.ofproto_parser.OFPFlowMod(
+                    datapath = self.dp, match = self.routing_flow_match(subnet, src),
+                    priority = self.routing_flow_priority(subnet, src), cookie = 0, actions = [],
+                    command = self.dp.ofproto.OFPFC_DELETE_STRICT)
+
+        self.sender.send(mod)
+        del self.installed_flows[(subnet, src)]
+        logger.info('flow entry for %s removed (dpid=%s)', str(subnet), dpid_to_str(self.dp.id))
+
+    def routing_flow_match(self, subnet, src=None):
+        match = {'nw_dst': str(subnet.cidr), 'dl_type': '2048'}
+        if src is not None:
+            match['nw_src'] = str(src.cidr)
+        return ofctl_v1_0.to_match(self.dp, match)
+
+    def routing_flow_priority(self, subnet, src=None):
+        if src is None:
+            return ROUTING_FLOW_PRIORITY + subnet.prefixlen * 2
+        return ROUTING_FLOW_PRIORITY + subnet.prefixlen * 2 + 1
+
+    def deploy_host_flow(self, ip, hw_addr, outport_no):
+        """
+            queue FlowMod forwarding all IPv4 traffic to the host,
+            the flow entry expires together with the ARP entry.
+            return the actions of the flow entry.
+        """
+        # rewrite source MAC address with gateway's MAC address
+        # rewrite destination MAC address with host's MAC address
+        # set output port
+        actions = []
+        actions.append(self.dp.ofproto_parser.OFPActionSetDlSrc(self.ports[outport_no].hw_addr.packed))
+        actions.append(self.dp.ofproto_parser.OFPActionSetDlDst(hw_addr.packed))
+        actions.append(self.dp.ofproto_parser.OFPActionOutput(outport_no))
+
+        if PROACTIVE_HOST_FLOW:
+            idle_timeout = 0
+        else:
+            idle_timeout = FLOW_IDLE_TIMEOUT
+
+        # OFPFC_ADD replaces the existing entry and resets its timeouts
+        mod = self.dp.ofproto_parser.OFPFlowMod(
+                    datapath = self.dp, match = self.routing_flow_match(netaddr.IPNetwork(ip)),
+                    priority = HOST_FLOW_PRIORITY, cookie = 0, actions = actions,
+                    idle_timeout = idle_timeout,
+                    hard_timeout = self.arp_table.lifetime(ip),
+                    command = self.dp.ofproto.OFPFC_ADD)
+
+        self.sender.send(mod)
+        return actions
 
-        # send FlowMod
-        self.dp.send_msg(mod)
+    def remove_host_flow(self, ip, hw_addr):
+        """
+            delete the flow entry of host evicted from ARP table.
+        """
+        mod = self.dp.ofproto_parser.OFPFlowMod(
+                    datapath = self.dp, match = self.routing_flow_match(netaddr.IPNetwork(ip)),
+                    priority = HOST_FLOW_PRIORITY, cookie = 0, actions = [],
+                    command = self.dp.ofproto.OFPFC_DELETE_STRICT)
+
+        self.sender.send(mod)
+
+    def filter_flow_mod(self, match, priority, actions, command):
+        return self.dp.ofproto_parser.OFPFlowMod(
+                    datapath = self.dp, match = ofctl_v1_0.to_match(self.dp, match),
+                    priority = priority, cookie = 0, actions = actions,
+                    idle_timeout = 0, hard_timeout = 0, command = command)
+
+    def deploy_filter_flows(self):
+        """
+            queue the filter flows of the datapath and the ARP flows
+            of all the gateway ports, called when the switch joins.
+        """
+        if not FILTER_FLOWS:
+            return
+
+        for match in ({'dl_type': str(ether.ETH_TYPE_IPV6)},
+                      {'dl_type': str(ether.ETH_TYPE_IP), 'nw_dst': '255.255.255.255'}):
+            self.sender.send(self.filter_flow_mod(match, FILTER_FLOW_PRIORITY, [], self.dp.ofproto.OFPFC_ADD))
+
+        for port_no, port in self.ports.items():
+            if port.gateway is not None:
+                self.deploy_arp_flows(port)
+
+    def deploy_arp_flows(self, port, old_ipv4=None):
+        """
+            queue the ARP flows of a gateway port, the ARP packets
+            for the gateway address are sent to the controller
+            and the others are dropped.
+            the flow of old_ipv4 is deleted if the address changed.
+        """
+        if not FILTER_FLOWS:
+            return
+
+        ofproto = self.dp.ofproto
+        arp_match = {'in_port': port.port_no, 'dl_type': str(ether.ETH_TYPE_ARP)}
+
+        if old_ipv4 is not None and old_ipv4 != port.gateway.ipv4:
+            self.sender.send(self.filter_flow_mod(dict(arp_match, nw_dst=str(old_ipv4)),
+                                                  ARP_FLOW_PRIORITY, [], ofproto.OFPFC_DELETE_STRICT))
+
+        actions = [self.dp.ofproto_parser.OFPActionOutput(ofproto.OFPP_CONTROLLER, ofproto.OFP_DEFAULT_MISS_SEND_LEN)]
+        self.sender.send(self.filter_flow_mod(arp_match, FILTER_FLOW_PRIORITY, [], ofproto.OFPFC_ADD))
+        self.sender.send(self.filter_flow_mod(dict(arp_match, nw_dst=str(port.gateway.ipv4)),
+                                              ARP_FLOW_PRIORITY, actions, ofproto.OFPFC_ADD))
+
+    def remove_arp_flows(self, port):
+        """
+            queue the deletion of the ARP flows of a deleted port.
+        """
+        if not FILTER_FLOWS or port.gateway is None:
+            return
+
+        ofproto = self.dp.ofproto
+        arp_match = {'in_port': port.port_no, 'dl_type': str(ether.ETH_TYPE_ARP)}
+        self.sender.send(self.filter_flow_mod(dict(arp_match, nw_dst=str(port.gateway.ipv4)),
+                                              ARP_FLOW_PRIORITY, [], ofproto.OFPFC_DELETE_STRICT))
+        self.sender.send(self.filter_flow_mod(arp_match, FILTER_FLOW_PRIORITY, [], ofproto.OFPFC_DELETE_STRICT))
 
     def find_outport_by_subnet(self, subnet):
         """
             return port_no by subent.
         """
-        for port_no, port in self.ports.items():
-            if port.gateway and port.gateway.ipv4_subnet == subnet:
-                return port_no
+        try:
+            entry = self.tbl[subnet]
+        except KeyError:
+            return None
+
+        if entry.source == "CONNECTED":
+            return entry.receive_port.port_no
         return None
 
     def find_outport_by_ip(self, dst_ip):
         """
-            return port_no by match the destination IP address with
-            the subnets.
+            return port_no by longest prefix match of the destination
+            IP address, only the directly connected subnets have
+            output port to hosts, so a learned route inside one
+            does not hide it.
         """
-        for port_no, port in self.ports.items():
-            if port.gateway and dst_ip in port.gateway.ipv4_subnet:
-                return port_no
-        return None
+        r = self.tbl.lookup(dst_ip, lambda entry: entry.source == "CONNECTED")
+        if r is None:
+            return None
+
+        subnet, entry = r
+        return entry.receive_port.port_no
 
     def update_gateway_with_prefixlen(self, ipv4='', ipv4_prefixlen=0, 
                                 ipv6='', ipv6_prefixlen=0, port_no=''):
         """
             update the gateway information for Port object.
         """
+        self.set_gateway(ipv4=ipv4, ipv4_prefixlen=ipv4_prefixlen,
+                         ipv6=ipv6, ipv6_prefixlen=ipv6_prefixlen, port_no=port_no)
+        self.sender.flush()
+        self.triggered_update()
+
+    def update_gateways(self, gateways):
+        """
+            update a list of gateways given as keyword arguments of
+            update_gateway_with_prefixlen, the changes are advertised once.
+        """
+        for gateway in gateways:
+            self.set_gateway(**gateway)
+        self.sender.flush()
+        self.triggered_update()
+
+    def set_gateway(self, ipv4='', ipv4_prefixlen=0,
+                    ipv6='', ipv6_prefixlen=0, port_no=''):
         port = self.ports[port_no]
+        old_ipv4 = None
+
+        if port.gateway is not None:
+            old_ipv4 = port.gateway.ipv4
+            self.tbl.remove_entry(port.gateway.ipv4_subnet)
 
         if port.gateway is None:
             port.gateway = Gateway(name=port.name, port_no=port.port_no,
@@ -205,7 +748,222 @@ class Switch(switches.Switch):
             port.gateway.ipv6_subnet = netaddr.IPNetwork(ipv6 + '/' + str(ipv6_prefixlen))
             port.gateway.port_no = port.port_no
 
+        # the ARP packets of the gateway are patched from these templates
+        port.arp_template = ARPTemplate(port.hw_addr.packed, port.gateway.ipv4)
+        self.deploy_arp_flows(port, old_ipv4)
+
         self.tbl.update_entry(subnet=port.gateway.ipv4_subnet, receive_port=port, metric=0, source="CONNECTED")
+        self.ports_changed()
+        CONVERGENCE.change()
+
+    def snapshot(self):
+        """
+            return gateways, ARP entries and learned routes
+            as plain tuples for warm restart.
+        """
+        gateways = []
+        for port_no, port in self.ports.items():
+            if port.gateway:
+                gateways.append((port_no, str(port.gateway.ipv4), port.gateway.ipv4_subnet.prefixlen,
+                                 str(port.gateway.ipv6), port.gateway.ipv6_subnet.prefixlen))
+
+        arp = [(int(ip), int(entry.hw_addr), entry.last_update)
+               for ip, entry in self.arp_table.entries.items()]
+
+        routes = []
+        for subnet, entry in self.tbl.items():
+            if entry.neighbor_port and self.tbl.reachable(entry):
+                routes.append((int(subnet.network), subnet.prefixlen, entry.metric, entry.receive_port.port_no,
+                               entry.neighbor_port.dpid, entry.neighbor_port.port_no))
+
+        return {'gateways': gateways, 'arp': arp, 'routes': routes}
+
+    def restore(self, data):
+        """
+            warm restart from the snapshot of previous controller.
+            (1) configure the gateways again.
+            (2) request flow stats, the ARP entries are restored
+                when the reply arrives by restore_flows.
+            (3) the learned routes are restored when the links
+                are up again by restore_routes.
+            routing flow entries are not removed in GRACEFUL_RESTART_TIME,
+            the routes not learned again are withdrawn after that.
+        """
+        logger.info('warm restart with %d gateways, %d ARP entries and %d routes (dpid=%s)',
+                    len(data['gateways']), len(data['arp']), len(data['routes']), dpid_to_str(self.dp.id))
+        self.restoring = data
+        self.restored_hosts = {}
+        self.graceful_until = time.time() + GRACEFUL_RESTART_TIME
+        self.timers.append(self.scheduler.schedule(GRACEFUL_RESTART_TIME, self.add_to_queue,
+                                                   self.end_graceful_restart, periodic=False))
+
+        self.update_gateways([{'ipv4': ipv4, 'ipv4_prefixlen': ipv4_prefixlen,
+                               'ipv6': ipv6, 'ipv6_prefixlen': ipv6_prefixlen, 'port_no': port_no}
+                              for port_no, ipv4, ipv4_prefixlen, ipv6, ipv6_prefixlen in data['gateways']
+                              if port_no in self.ports])
+
+        parser = self.dp.ofproto_parser
+        self.dp.send_msg(parser.OFPFlowStatsRequest(self.dp, 0, parser.OFPMatch(), 0xff, self.dp.ofproto.OFPP_NONE))
+
+    def restore_flows(self, stats_list, more=False):
+        """
+            called with the flow stats requested by restore.
+            the routing flow entries already on the datapath are
+            regarded as installed, so deploy_routing_table only sends
+            FlowMods for the missing or changed ones.
+            after the last reply the ARP entries are restored,
+            host flows are deployed only if missing.
+        """
+        if self.restoring is None:
+            return
+
+        ofproto = self.dp.ofproto
+        for stats in stats_list:
+            match = stats.match
+            if match.dl_type != ether.ETH_TYPE_IP:
+                continue
+
+            actions = dict((action.type, action) for action in stats.actions)
+            try:
+                signature = (actions[ofproto.OFPAT_OUTPUT].port,
+                             netaddr.EUI(mac.haddr_to_str(actions[ofproto.OFPAT_SET_DL_SRC].dl_addr)),
+                             netaddr.EUI(mac.haddr_to_str(actions[ofproto.OFPAT_SET_DL_DST].dl_addr)))
+            except KeyError:
+                continue
+
+            subnet = self.match_subnet(match.nw_dst, match.wildcards,
+                                       ofproto.OFPFW_NW_DST_MASK, ofproto.OFPFW_NW_DST_SHIFT)
+            src = self.match_subnet(match.nw_src, match.wildcards,
+                                    ofproto.OFPFW_NW_SRC_MASK, ofproto.OFPFW_NW_SRC_SHIFT)
+            if subnet is None:
+                continue
+
+            if stats.priority == HOST_FLOW_PRIORITY:
+                if subnet.prefixlen == IPV4_MAX_PREFIXLEN and src is None:
+                    self.restored_hosts[subnet.ip] = signature[2]
+            elif stats.priority == self.routing_flow_priority(subnet, src):
+                self.installed_flows.setdefault((subnet, src), signature)
+
+        if more:
+            return
+
+        now = time.time()
+        for ip, hw_addr, last_update in self.restoring['arp']:
+            ip = netaddr.IPAddress(ip)
+            hw_addr = netaddr.EUI(hw_addr)
+            if last_update + self.arp_table.ttl <= now or ip in self.arp_table:
+                continue
+
+            self.arp_table.update(ip, hw_addr, last_update)
+            outport_no = self.find_outport_by_ip(ip)
+            if PROACTIVE_HOST_FLOW and outport_no and self.restored_hosts.get(ip) != hw_addr:
+                self.deploy_host_flow(ip, hw_addr, outport_no)
+
+        self.sender.flush()
+        logger.info('%d routing flows and %d host flows found on datapath (dpid=%s)',
+                    len(self.installed_flows), len(self.restored_hosts), dpid_to_str(self.dp.id))
+        self.restored_hosts = {}
+
+    def match_subnet(self, nw_addr, wildcards, mask, shift):
+        """
+            return the subnet matched by an OpenFlow 1.0 match field,
+            or None if the field is fully wildcarded.
+        """
+        wildcard_bits = (wildcards & mask) >> shift
+        if wildcard_bits >= IPV4_MAX_PREFIXLEN:
+            return None
+        return netaddr.IPNetwork((nw_addr, IPV4_MAX_PREFIXLEN - wildcard_bits))
+
+    def restore_routes(self, port):
+        """
+            restore the learned routes through port from the snapshot
+            when the link to the neighbor is up again.
+            called by the update worker, the routes are deployed after.
+        """
+        if self.restoring is None:
+            return
+
+        neighbor_port = self.neighbor_port(port)
+        if neighbor_port is None:
+            return
+
+        remaining = []
+        for route in self.restoring['routes']:
+            network, prefixlen, metric, port_no, neighbor_dpid, neighbor_port_no = route
+            if port_no == port.port_no and neighbor_dpid == neighbor_port.dpid \
+                    and neighbor_port_no == neighbor_port.port_no:
+                self.tbl.restore_entry(netaddr.IPNetwork((network, prefixlen)), port, neighbor_port, metric)
+            else:
+                remaining.append(route)
+        self.restoring['routes'] = remaining
+
+    def neighbor_port(self, port):
+        """
+            return the Port of the neighbor on the other end of port,
+            which may be owned by other shard, or None if unknown.
+        """
+        try:
+            return self.switches[port.neighbor_switch_dpid].ports[port.neighbor_port_no]
+        except KeyError:
+            if self.shard is None:
+                return None
+            return self.shard.remote_ports.get((port.neighbor_switch_dpid, port.neighbor_port_no))
+
+    def end_graceful_restart(self):
+        """
+            stop keeping the flow entries of warm restart,
+            the routes not learned again are withdrawn by the next deploy.
+        """
+        logger.info('warm restart finished, %d routes not restored (dpid=%s)',
+                    len(self.restoring['routes']) if self.restoring else 0, dpid_to_str(self.dp.id))
+        self.restoring = None
+        self.graceful_until = 0
+
+    def ports_changed(self):
+        """
+            called when ports, neighbors or gateways are modified.
+        """
+        self.port_revision += 1
+
+    def view_version(self, name):
+        """
+            return the version of a REST view, which changes whenever
+            the content of the view may change.
+            name is one of 'switch', 'arp', 'port' and 'route'.
+        """
+        if name == 'arp':
+            return (self.arp_table.revision, )
+        elif name == 'port':
+            return (self.port_revision, )
+        elif name == 'route':
+            return (self.tbl.revision, )
+        return (self.port_revision, self.arp_table.revision, self.tbl.revision)
+
+    def get_view(self, name):
+        """
+            return the JSON of a REST view,
+            serialized only once for each version.
+        """
+        version = self.view_version(name)
+        try:
+            cached_version, body = self.view_cache[name]
+            if cached_version == version:
+                return body
+        except KeyError:
+            pass
+
+        if name == 'arp':
+            view = list(self.iter_arp_list())
+        elif name == 'port':
+            view = [port.to_dict() for (port_no, port) in sorted(self.ports.items())]
+        elif name == 'route':
+            view = list(self.iter_routing_table())
+        else:
+            view = self.to_dict()
+
+        body = json.dumps(view)
+        self.view_cache[name] = (version, body)
+        return body
 
     def to_dict(self):
         return {'dpid': dpid_to_str(self.dp.id),
@@ -0,0 +1,166 @@
+"""
+    offline benchmark of RoutingFlow on a simulated fabric,
+    no mininet, OVS or root privilege is required.
+
+    python test/benchmark.py --topology fat-tree --size 4
+    python test/benchmark.py --topology random --size 100 --fail-links 3 --json
+"""
+from ryu.lib import hub
+hub.patch(thread=False)
+
+import gc
+import sys
+import json
+import time
+import random
+import logging
+import resource
+import argparse
+import threading
+
+import greenlet
+from ryu.ofproto import ofproto_v1_0
+
+# fabric_sim puts the repository on sys.path
+import fabric_sim
+import switch
+
+# samples of threads are taken with this interval
+SAMPLE_INTERVAL = 0.1
+
+class PeakSampler(object):
+    """
+        record the peak number of native threads and green threads.
+    """
+    def __init__(self):
+        self.threads = 0
+        self.green_threads = 0
+        self.thread = hub.spawn(self.run)
+
+    def sample(self):
+        self.threads = max(self.threads, threading.active_count())
+        green_threads = sum(1 for o in gc.get_objects()
+                            if isinstance(o, greenlet.greenlet) and not o.dead)
+        self.green_threads = max(self.green_threads, green_threads)
+
+    def run(self):
+        while True:
+            self.sample()
+            hub.sleep(SAMPLE_INTERVAL)
+
+def flow_mods(fabric):
+    return fabric.message_counts()[ofproto_v1_0.OFPT_FLOW_MOD]
+
+def converge(fabric, timeout, result, prefix):
+    flow_mods_before = flow_mods(fabric)
+    elapsed = fabric.wait_converged(timeout)
+    result[prefix + '_seconds'] = elapsed
+    result[prefix + '_flow_mods'] = flow_mods(fabric) - flow_mods_before
+    if elapsed is None:
+        logging.error('%s did not converge in %ds', prefix, timeout)
+
+def packet_in_throughput(fabric, hosts, packets, result):
+    """
+        (1) every host resolves its gateway by ARP request.
+        (2) IPv4 packets to the hosts arrive at their edge switch.
+    """
+    arp_packets = []
+    ipv4_packets = []
+    for dpid in fabric.subnets:
+        for index in range(hosts):
+            port_no, ip, hw_addr, gateway = fabric.host(dpid, 10 + index)
+            arp_packets.append((dpid, port_no, fabric_sim.arp_request(hw_addr, ip, gateway)))
+            in_port = fabric.port_nos[dpid][0]
+            ipv4_packets.append((dpid, in_port, fabric_sim.ipv4_packet(
+                fabric_sim.hw_addr(3, dpid), fabric_sim.hw_addr(1, dpid, in_port), '192.0.2.1', ip)))
+
+    for name, workload, count in (('arp', arp_packets, len(arp_packets)), ('ipv4', ipv4_packets, packets)):
+        if not workload:
+            continue
+        start = time.time()
+        for i in xrange(count):
+            fabric.packet_in(*workload[i % len(workload)])
+        elapsed = time.time() - start
+        result['packet_in_%s' % name] = count
+        result['packet_in_%s_per_second' % name] = count / elapsed if elapsed else None
+        hub.sleep(0)
+
+def run(topology, options):
+    result = {'topology': topology.name,
+              'protocol': switch.ROUTING_PROTOCOL,
+              'switches': len(topology.dpids),
+              'links': len(topology.links),
+              'subnets': len(topology.edges)}
+
+    sampler = PeakSampler()
+    fabric = fabric_sim.Fabric(topology)
+
+    start = time.time()
+    fabric.start()
+    result['start_seconds'] = time.time() - start
+    converge(fabric, options.timeout, result, 'convergence')
+
+    rand = random.Random(options.seed)
+    for i in range(options.fail_links):
+        if not fabric.links:
+            break
+        fabric.fail_link(*rand.choice(sorted(fabric.links)))
+        converge(fabric, options.timeout, result, 'link_failure_%d' % (i + 1))
+
+    packet_in_throughput(fabric, options.hosts, options.packets, result)
+
+    counts = fabric.message_counts()
+    result['flow_mods'] = counts[ofproto_v1_0.OFPT_FLOW_MOD]
+    result['packet_outs'] = counts[ofproto_v1_0.OFPT_PACKET_OUT]
+    result['barriers'] = counts[ofproto_v1_0.OFPT_BARRIER_REQUEST]
+    result['bytes_sent'] = sum(dp.bytes_sent for dp in fabric.datapaths.values())
+
+    sampler.sample()
+    result['peak_threads'] = sampler.threads
+    result['peak_green_threads'] = sampler.green_threads
+    # ru_maxrss is in kilobytes on Linux
+    result['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    fabric.stop()
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark RoutingFlow on a simulated fabric')
+    parser.add_argument('--topology', choices=sorted(fabric_sim.TOPOLOGIES), default='fat-tree')
+    parser.add_argument('--size', type=int, default=4,
+                        help='switches of line, ring and random, k of fat-tree')
+    parser.add_argument('--degree', type=int, default=3, help='links per switch of random graph')
+    parser.add_argument('--protocol', choices=sorted(switch.ROUTING_PROTOCOLS), default=switch.ROUTING_PROTOCOL)
+    parser.add_argument('--triggered-interval', type=float, default=switch.TRIGGERED_UPDATE_INTERVAL,
+                        help='override TRIGGERED_UPDATE_INTERVAL of switch.py')
+    parser.add_argument('--fail-links', type=int, default=0, help='links failed one by one after convergence')
+    parser.add_argument('--hosts', type=int, default=4, help='hosts per subnet')
+    parser.add_argument('--packets', type=int, default=10000, help='IPv4 PacketIns to handle')
+    parser.add_argument('--timeout', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help='print the result as JSON')
+    parser.add_argument('--log-level', default='WARNING')
+    options = parser.parse_args()
+
+    logging.getLogger().setLevel(options.log_level)
+    switch.ROUTING_PROTOCOL = options.protocol
+    switch.TRIGGERED_UPDATE_INTERVAL = options.triggered_interval
+
+    if options.topology == 'random':
+        topology = fabric_sim.random_graph(options.size, options.degree, options.seed)
+    else:
+        topology = fabric_sim.TOPOLOGIES[options.topology](options.size)
+
+    result = run(topology, options)
+
+    if options.json:
+        print json.dumps(result, indent=2, sort_keys=True)
+    else:
+        for key in sorted(result):
+            print '%-32s %s' % (key, result[key])
+
+    failed = any(key.endswith('_seconds') and result[key] is None for key in result)
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,412 @@
+import os
+import sys
+import time
+import struct
+import random
+import collections
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import netaddr
+from ryu.lib import hub
+from ryu.lib import mac
+from ryu.lib.packet import (packet, ethernet, arp, ipv4)
+from ryu.ofproto import ofproto_v1_0, ofproto_v1_0_parser, ether
+from ryu.controller import ofp_event
+from ryu.topology import event, switches
+
+import routing
+
+# ports of a switch are numbered from 1 in the order of links,
+# the host port of an edge switch follows its fabric ports
+FIRST_PORT_NO = 1
+
+# fabric switches are polled with this interval while waiting
+# for convergence
+POLL_INTERVAL = 0.01
+
+# dpids: list of datapath ids
+# links: list of (dpid, dpid)
+# edges: list of dpids with a host subnet
+Topology = collections.namedtuple('Topology', ['name', 'dpids', 'links', 'edges'])
+
+def line(n):
+    dpids = range(1, n + 1)
+    return Topology('line-%d' % n, dpids, zip(dpids, dpids[1:]), dpids)
+
+def ring(n):
+    dpids = range(1, n + 1)
+    return Topology('ring-%d' % n, dpids, zip(dpids, dpids[1:] + dpids[:1]), dpids)
+
+def fat_tree(k):
+    """
+        k-ary fat-tree of (k/2)^2 core switches and k pods of
+        k/2 aggregation and k/2 edge switches, hosts are under
+        the edge switches.
+    """
+    if k % 2:
+        raise ValueError('k of fat-tree must be even')
+    half = k // 2
+    dpid = iter(xrange(1, 5 * k * k // 4 + 1))
+    cores = [next(dpid) for i in range(half * half)]
+    links = []
+    edges = []
+    aggregations = []
+    for pod in range(k):
+        pod_aggregations = [next(dpid) for i in range(half)]
+        pod_edges = [next(dpid) for i in range(half)]
+        for i, aggregation in enumerate(pod_aggregations):
+            for core in cores[i * half:(i + 1) * half]:
+                links.append((core, aggregation))
+            for edge in pod_edges:
+                links.append((aggregation, edge))
+        aggregations.extend(pod_aggregations)
+        edges.extend(pod_edges)
+    return Topology('fat-tree-%d' % k, cores + aggregations + edges, links, edges)
+
+def random_graph(n, degree=3, seed=None):
+    """
+        connected random graph of n switches with about
+        degree links per switch, every switch has hosts.
+    """
+    rand = random.Random(seed)
+    dpids = range(1, n + 1)
+
+    # random spanning tree keeps the graph connected
+    links = set()
+    for i in range(1, n):
+        links.add((dpids[rand.randrange(i)], dpids[i]))
+
+    max_links = n * (n - 1) // 2
+    while len(links) < min(n * degree // 2, max_links):
+        a, b = rand.sample(dpids, 2)
+        if (b, a) not in links:
+            links.add((a, b))
+    return Topology('random-%d' % n, dpids, sorted(links), dpids)
+
+TOPOLOGIES = {'line': line,
+              'ring': ring,
+              'fat-tree': fat_tree,
+              'random': random_graph}
+
+def hw_addr(kind, index, port_no=0):
+    return '02:%02x:%02x:%02x:%02x:%02x' % (kind, (index >> 16) & 0xff, (index >> 8) & 0xff,
+                                            index & 0xff, port_no & 0xff)
+
+def match_prefix(addr, wildcards, shift):
+    """
+        return the IPNetwork matched by a nw_src or nw_dst field
+        of OFPMatch, or None if fully wildcarded.
+    """
+    bits = (wildcards >> shift) & ((1 << 6) - 1)
+    if bits >= 32:
+        return None
+    return netaddr.IPNetwork('%s/%d' % (netaddr.IPAddress(addr), 32 - bits)).cidr
+
+class FlowTable(object):
+    """
+        OpenFlow 1.0 flow table of a FakeDatapath, modelling the
+        fields matched by RoutingFlow.
+        a match is (in_port, dl_type, nw_proto, nw_src, nw_dst),
+        None for a wildcarded field, nw_src and nw_dst are IPNetwork.
+        flows[(match, priority)] = list of actions
+    """
+    def __init__(self):
+        self.flows = {}
+
+    @staticmethod
+    def parse_match(m):
+        w = m.wildcards
+        return (None if w & ofproto_v1_0.OFPFW_IN_PORT else m.in_port,
+                None if w & ofproto_v1_0.OFPFW_DL_TYPE else m.dl_type,
+                None if w & ofproto_v1_0.OFPFW_NW_PROTO else m.nw_proto,
+                match_prefix(m.nw_src, w, ofproto_v1_0.OFPFW_NW_SRC_SHIFT),
+                match_prefix(m.nw_dst, w, ofproto_v1_0.OFPFW_NW_DST_SHIFT))
+
+    @staticmethod
+    def covers(general, specific):
+        """
+            return True if the match specific is equal to
+            or more specific than the match general.
+        """
+        for g, s in zip(general, specific):
+            if g is None:
+                continue
+            if isinstance(g, netaddr.IPNetwork):
+                if s is None or s.prefixlen < g.prefixlen or s not in g:
+                    return False
+            elif g != s:
+                return False
+        return True
+
+    def flow_mod(self, buf, offset, length):
+        match = self.parse_match(ofproto_v1_0_parser.OFPMatch.parse(buf, offset + ofproto_v1_0.OFP_HEADER_SIZE))
+        (cookie, command, idle_timeout, hard_timeout, priority,
+         buffer_id, out_port, flags) = struct.unpack_from(
+            ofproto_v1_0.OFP_FLOW_MOD_PACK_STR0, buf,
+            offset + ofproto_v1_0.OFP_HEADER_SIZE + ofproto_v1_0.OFP_MATCH_SIZE)
+
+        actions = []
+        action_offset = offset + ofproto_v1_0.OFP_FLOW_MOD_SIZE
+        while action_offset < offset + length:
+            action = ofproto_v1_0_parser.OFPAction.parser(buf, action_offset)
+            actions.append(action)
+            action_offset += action.len
+
+        key = (match, priority)
+        if command == ofproto_v1_0.OFPFC_ADD:
+            self.flows[key] = actions
+        elif command == ofproto_v1_0.OFPFC_MODIFY_STRICT:
+            self.flows[key] = actions
+        elif command == ofproto_v1_0.OFPFC_MODIFY:
+            # every entry equal to or more specific than match at any
+            # priority, added only if there is none
+            modified = [k for k in self.flows if self.covers(match, k[0])]
+            for k in modified:
+                self.flows[k] = actions
+            if not modified:
+                self.flows[key] = actions
+        elif command == ofproto_v1_0.OFPFC_DELETE_STRICT:
+            self.flows.pop(key, None)
+        elif command == ofproto_v1_0.OFPFC_DELETE:
+            for k in [k for k in self.flows if self.covers(match, k[0])]:
+                del self.flows[k]
+
+    def lookup(self, in_port, dl_type, nw_proto, nw_src, nw_dst):
+        """
+            return the actions of the highest priority entry
+            matching the packet, or None on table miss.
+        """
+        packet = (in_port, dl_type, nw_proto,
+                  netaddr.IPNetwork('%s/32' % nw_src), netaddr.IPNetwork('%s/32' % nw_dst))
+        best = None
+        for (match, priority), actions in self.flows.items():
+            if self.covers(match, packet) and (best is None or priority > best[0]):
+                best = (priority, actions)
+        return best[1] if best is not None else None
+
+    def output(self, *packet):
+        """
+            return the output port of the packet, or None on table miss.
+        """
+        actions = self.lookup(*packet)
+        if actions is None:
+            return None
+        for action in actions:
+            if action.type == ofproto_v1_0.OFPAT_OUTPUT:
+                return action.port
+
+class FakeDatapath(object):
+    """
+        in-process stand-in of ryu Datapath.
+        the messages are serialized as usual and counted by type
+        instead of being written to a socket, a barrier request
+        is answered as soon as the sender yields.
+        FlowMods are applied to a FlowTable.
+    """
+    def __init__(self, dpid, barrier_callback=None):
+        self.id = dpid
+        self.ofproto = ofproto_v1_0
+        self.ofproto_parser = ofproto_v1_0_parser
+        self.xid = 0
+        self.barrier_callback = barrier_callback
+        self.flow_table = FlowTable()
+
+        # counts[message type] = number of messages sent
+        self.counts = collections.Counter()
+        self.bytes_sent = 0
+
+    def set_xid(self, msg):
+        self.xid = (self.xid + 1) & 0xffffffff
+        msg.set_xid(self.xid)
+        return self.xid
+
+    def send(self, buf):
+        buf = bytes(buf)
+        self.bytes_sent += len(buf)
+        offset = 0
+        while offset < len(buf):
+            version, msg_type, length, xid = struct.unpack_from(ofproto_v1_0.OFP_HEADER_PACK_STR, buf, offset)
+            self.counts[msg_type] += 1
+            if msg_type == ofproto_v1_0.OFPT_FLOW_MOD:
+                self.flow_table.flow_mod(buf, offset, length)
+            elif msg_type == ofproto_v1_0.OFPT_BARRIER_REQUEST and self.barrier_callback:
+                hub.spawn(self.barrier_callback, self.id, xid)
+            offset += length
+
+    def send_msg(self, msg):
+        if msg.xid is None:
+            self.set_xid(msg)
+        msg.serialize()
+        self.send(msg.buf)
+
+    def send_packet_out(self, buffer_id=0xffffffff, in_port=None, actions=None, data=None):
+        self.send_msg(self.ofproto_parser.OFPPacketOut(self, buffer_id, in_port, actions, data))
+
+class FakeWSGI(object):
+    def register(self, controller, data=None):
+        pass
+
+class Fabric(object):
+    """
+        a topology driven through the event handlers of RoutingFlow
+        with a FakeDatapath per switch, in the order ryu emits them:
+        switch features, switch enter, links, then the gateways.
+    """
+    def __init__(self, topology):
+        self.topology = topology
+
+        # no snapshot is read or written by the simulator
+        routing.SNAPSHOT_FILE = None
+        self.app = routing.RoutingFlow(wsgi=FakeWSGI())
+
+        # datapaths[dpid] = FakeDatapath
+        # port_nos[dpid] = list of port_no, the last one of an edge is the host port
+        # subnets[dpid] = (host port_no, gateway IPNetwork)
+        # links[(dpid, dpid)] = (port_no, port_no)
+        self.datapaths = {}
+        self.port_nos = {}
+        self.subnets = {}
+        self.links = {}
+
+        for dpid in topology.dpids:
+            self.datapaths[dpid] = FakeDatapath(dpid, self.barrier_reply)
+            self.port_nos[dpid] = []
+
+        for a, b in topology.links:
+            self.links[(a, b)] = (self.add_port(a), self.add_port(b))
+
+        for i, dpid in enumerate(topology.edges):
+            self.subnets[dpid] = (self.add_port(dpid), netaddr.IPNetwork('10.%d.%d.1/24' % ((i >> 8) & 0xff, i & 0xff)))
+
+    def add_port(self, dpid):
+        port_no = FIRST_PORT_NO + len(self.port_nos[dpid])
+        self.port_nos[dpid].append(port_no)
+        return port_no
+
+    def phy_port(self, dpid, port_no):
+        return ofproto_v1_0_parser.OFPPhyPort(port_no, hw_addr(1, dpid, port_no), 's%d-eth%d' % (dpid, port_no),
+                                              0, 0, 0, 0, 0, 0)
+
+    def topology_port(self, dpid, port_no):
+        return switches.Port(dpid, ofproto_v1_0, self.phy_port(dpid, port_no))
+
+    def topology_link(self, a, b):
+        a_port_no, b_port_no = self.links[(a, b)]
+        return switches.Link(self.topology_port(a, a_port_no), self.topology_port(b, b_port_no))
+
+    def start(self):
+        for dpid in self.topology.dpids:
+            dp = self.datapaths[dpid]
+            features = ofproto_v1_0_parser.OFPSwitchFeatures(dp)
+            features.datapath_id = dpid
+            features.ports = dict((port_no, self.phy_port(dpid, port_no)) for port_no in self.port_nos[dpid])
+            self.app.switch_feature_handler(ofp_event.EventOFPSwitchFeatures(features))
+            self.app.switch_enter_handler(event.EventSwitchEnter(switches.Switch(dp)))
+
+        for a, b in self.topology.links:
+            self.app.link_add_handler(event.EventLinkAdd(self.topology_link(a, b)))
+
+        for dpid, (port_no, subnet) in self.subnets.items():
+            self.app.switches[dpid].update_gateway_with_prefixlen(
+                ipv4=str(subnet.ip), ipv4_prefixlen=subnet.prefixlen,
+                ipv6='2001:db8:%x::1' % dpid, ipv6_prefixlen=64, port_no=port_no)
+
+    def stop(self):
+        for dpid in self.app.switches.keys():
+            self.app.switch_leave_handler(event.EventSwitchLeave(switches.Switch(self.datapaths[dpid])))
+
+    def fail_link(self, a, b):
+        self.app.link_delete_handler(event.EventLinkDelete(self.topology_link(a, b)))
+        del self.links[(a, b)]
+
+    def barrier_reply(self, dpid, xid):
+        try:
+            self.app.switches[dpid].sender.barrier_reply(xid)
+        except KeyError:
+            pass
+
+    def components(self):
+        """
+            return component[dpid] = smallest dpid connected to it
+            over the remaining links.
+        """
+        neighbors = collections.defaultdict(list)
+        for a, b in self.links:
+            neighbors[a].append(b)
+            neighbors[b].append(a)
+
+        component = {}
+        for dpid in sorted(self.topology.dpids):
+            if dpid in component:
+                continue
+            stack = [dpid]
+            component[dpid] = dpid
+            while stack:
+                for neighbor in neighbors[stack.pop()]:
+                    if neighbor not in component:
+                        component[neighbor] = dpid
+                        stack.append(neighbor)
+        return component
+
+    def converged(self):
+        """
+            return True when every switch is idle and has a route
+            to each subnet reachable over the remaining links.
+        """
+        component = self.components()
+        for dpid, switch in self.app.switches.items():
+            if switch.queue.qsize() or switch.triggered_timer is not None or len(switch.sender):
+                return False
+            for edge, (port_no, subnet) in self.subnets.items():
+                if component[edge] != component[dpid]:
+                    continue
+                entry = switch.tbl.get(subnet.cidr)
+                if entry is None or not switch.tbl.reachable(entry):
+                    return False
+        return True
+
+    def wait_converged(self, timeout):
+        """
+            return the seconds until converged, or None on timeout.
+        """
+        start = time.time()
+        while time.time() - start < timeout:
+            if self.converged():
+                return time.time() - start
+            hub.sleep(POLL_INTERVAL)
+        return None
+
+    def message_counts(self):
+        counts = collections.Counter()
+        for dp in self.datapaths.values():
+            counts.update(dp.counts)
+        return counts
+
+    def host(self, dpid, index=10):
+        """
+            return (port_no, ip, hw_addr, gateway ip) of a host under the edge switch.
+        """
+        port_no, subnet = self.subnets[dpid]
+        return port_no, str(subnet.network + index), hw_addr(2, dpid, index), str(subnet.ip)
+
+    def packet_in(self, dpid, in_port, data):
+        dp = self.datapaths[dpid]
+        msg = ofproto_v1_0_parser.OFPPacketIn(dp, buffer_id=ofproto_v1_0.OFP_NO_BUFFER, total_len=len(data),
+                                              in_port=in_port, reason=ofproto_v1_0.OFPR_NO_MATCH, data=data)
+        self.app.packet_in_handler(ofp_event.EventOFPPacketIn(msg))
+
+def arp_request(src_mac, src_ip, dst_ip):
+    p = packet.Packet()
+    p.add_protocol(ethernet.ethernet(dst=mac.BROADCAST_STR, src=src_mac, ethertype=ether.ETH_TYPE_ARP))
+    p.add_protocol(arp.arp_ip(opcode=arp.ARP_REQUEST, src_mac=src_mac, src_ip=src_ip,
+                              dst_mac=mac.DONTCARE_STR, dst_ip=dst_ip))
+    p.serialize()
+    return bytes(p.data)
+
+def ipv4_packet(src_mac, dst_mac, src_ip, dst_ip):
+    p = packet.Packet()
+    p.add_protocol(ethernet.ethernet(dst=dst_mac, src=src_mac, ethertype=ether.ETH_TYPE_IP))
+    p.add_protocol(ipv4.ipv4(src=src_ip, dst=dst_ip, proto=17))
+    p.serialize()
+    return bytes(p.data)
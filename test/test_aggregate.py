@@ -0,0 +1,82 @@
+import os
+import sys
+import random
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import netaddr
+
+from base.lpm import PrefixTable
+from aggregate import aggregate_routes
+
+def prefix_table(routes):
+    table = PrefixTable()
+    for subnet, next_hop in routes.items():
+        table.insert(subnet, next_hop)
+    return table
+
+def next_hop(table, ip):
+    result = table.lookup(ip)
+    return result[1] if result is not None else None
+
+class AggregateRoutesTest(unittest.TestCase):
+    def setUp(self):
+        self.rand = random.Random(0)
+
+    def random_routes(self, count, next_hops):
+        routes = {}
+        for i in range(count):
+            prefixlen = self.rand.choice([22, 23, 24, 24, 24, 25, 26])
+            ip = netaddr.IPAddress('10.0.0.0') + (self.rand.randrange(64) << 8)
+            routes[netaddr.IPNetwork('%s/%d' % (ip, prefixlen)).cidr] = self.rand.choice(next_hops)
+        return routes
+
+    def assertSameLookup(self, routes, aggregated):
+        original = prefix_table(routes)
+        merged = prefix_table(aggregated)
+        for i in range(0, 1 << 14, 7):
+            ip = netaddr.IPAddress('10.0.0.0') + i
+            self.assertEqual(next_hop(merged, ip), next_hop(original, ip), 'lookup of %s changed' % ip)
+
+    def test_same_lookup_as_routes(self):
+        for trial in range(20):
+            routes = self.random_routes(40, ['a', 'b', 'c'])
+            aggregated = aggregate_routes(routes)
+            self.assertTrue(len(aggregated) <= len(routes))
+            self.assertSameLookup(routes, aggregated)
+
+    def test_adjacent_subnets_merged(self):
+        routes = {
+            netaddr.IPNetwork('10.0.0.0/24'): 'a',
+            netaddr.IPNetwork('10.0.1.0/24'): 'a',
+            netaddr.IPNetwork('10.0.2.0/24'): 'b',
+        }
+        self.assertEqual(aggregate_routes(routes), {
+            netaddr.IPNetwork('10.0.0.0/23'): 'a',
+            netaddr.IPNetwork('10.0.2.0/24'): 'b',
+        })
+
+    def test_shorter_prefix_inside_supernet_keeps_components(self):
+        # 10.0.0.0/25 of another next hop loses to the /26 routes but
+        # would win against a /24 supernet
+        routes = {
+            netaddr.IPNetwork('10.0.0.0/26'): 'a',
+            netaddr.IPNetwork('10.0.0.64/26'): 'a',
+            netaddr.IPNetwork('10.0.0.128/25'): 'a',
+            netaddr.IPNetwork('10.0.0.0/25'): 'b',
+        }
+        aggregated = aggregate_routes(routes)
+        self.assertNotIn(netaddr.IPNetwork('10.0.0.0/24'), aggregated)
+        self.assertSameLookup(routes, aggregated)
+
+    def test_withdrawal_splits_supernet(self):
+        routes = dict((netaddr.IPNetwork('10.0.%d.0/24' % i), 'a') for i in range(4))
+        self.assertEqual(list(aggregate_routes(routes)), [netaddr.IPNetwork('10.0.0.0/22')])
+        del routes[netaddr.IPNetwork('10.0.3.0/24')]
+        aggregated = aggregate_routes(routes)
+        self.assertEqual(sorted(aggregated), [netaddr.IPNetwork('10.0.0.0/23'), netaddr.IPNetwork('10.0.2.0/24')])
+        self.assertSameLookup(routes, aggregated)
+
+if __name__ == '__main__':
+    unittest.main()
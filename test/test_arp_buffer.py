@@ -0,0 +1,55 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import netaddr
+
+import arp_buffer
+from arp_buffer import ARPPendingBuffer
+
+IP = netaddr.IPAddress('10.0.0.1')
+OTHER_IP = netaddr.IPAddress('10.0.0.2')
+
+class ARPPendingBufferTest(unittest.TestCase):
+    def setUp(self):
+        self.buffer = ARPPendingBuffer(max_packets_per_host=2, max_packets=2)
+
+    def retry_all(self):
+        for host in self.buffer.hosts.values():
+            host.next_request = 0
+
+    def test_request_when_buffer_full(self):
+        self.assertTrue(self.buffer.add(1, IP, 'a'))
+        self.assertTrue(self.buffer.add(1, IP, 'b'))
+        self.assertFalse(self.buffer.add(1, OTHER_IP, 'c'))
+        self.assertTrue(self.buffer.request_due(1, OTHER_IP))
+        self.assertFalse(self.buffer.request_due(1, OTHER_IP))
+
+    def test_release_only_waiting_host(self):
+        self.buffer.add(1, IP, 'a')
+        self.buffer.add(1, OTHER_IP, 'b')
+        self.assertEqual(self.buffer.release(1, IP), ['a'])
+        self.assertEqual(len(self.buffer), 1)
+
+    def test_retry_without_new_packets(self):
+        self.buffer.add(1, IP, 'a')
+        self.assertTrue(self.buffer.request_due(1, IP))
+        self.assertEqual(self.buffer.expire(), [])
+        self.retry_all()
+        self.assertEqual(self.buffer.expire(), [(1, IP)])
+
+    def test_unresolved_host_forgotten(self):
+        self.buffer.add(1, OTHER_IP, 'a')
+        self.buffer.ttl = -1
+        for i in range(arp_buffer.ARP_MAX_REQUESTS):
+            self.retry_all()
+            self.assertEqual(self.buffer.expire(), [(1, OTHER_IP)])
+        self.retry_all()
+        self.assertEqual(self.buffer.expire(), [])
+        self.assertEqual(self.buffer.hosts, {})
+        self.assertEqual(len(self.buffer), 0)
+
+if __name__ == '__main__':
+    unittest.main()
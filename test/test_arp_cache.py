@@ -0,0 +1,57 @@
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import netaddr
+
+from arp_cache import ARPCache
+
+IP = netaddr.IPAddress('10.0.0.1')
+HW_ADDR = '02:00:00:00:00:01'
+
+class ARPCacheRefreshTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = ARPCache(ttl=300, refresh_before=30)
+
+    def age(self, seconds):
+        self.cache.entries[IP].last_update -= seconds
+
+    def test_used_entry_refreshed_every_time(self):
+        # the traffic of an active flow never looks up the entry again
+        self.cache.update(IP, HW_ADDR)
+        self.assertEqual(self.cache.lookup(IP), netaddr.EUI(HW_ADDR))
+        for i in range(2):
+            self.age(280)
+            self.assertEqual(self.cache.expire(), [(IP, netaddr.EUI(HW_ADDR))])
+            # the reply of the refresh request
+            self.cache.update(IP, HW_ADDR)
+            self.assertFalse(self.cache.entries[IP].refreshing)
+        self.assertEqual(self.cache.stats['refreshes'], 2)
+
+    def test_refresh_requested_once(self):
+        self.cache.update(IP, HW_ADDR)
+        self.cache.lookup(IP)
+        self.age(280)
+        self.assertEqual(len(self.cache.expire()), 1)
+        self.assertEqual(self.cache.expire(), [])
+
+    def test_unused_entry_not_refreshed(self):
+        self.cache.update(IP, HW_ADDR)
+        self.age(280)
+        self.assertEqual(self.cache.expire(), [])
+
+    def test_update_keeps_last_used(self):
+        self.cache.update(IP, HW_ADDR)
+        self.cache.lookup(IP)
+        last_used = self.cache.entries[IP].last_used
+        self.cache.update(IP, '02:00:00:00:00:02')
+        entry = self.cache.entries[IP]
+        self.assertEqual(entry.last_used, last_used)
+        self.assertEqual(entry.hw_addr, netaddr.EUI('02:00:00:00:00:02'))
+        self.assertTrue(entry.last_update >= last_used)
+
+if __name__ == '__main__':
+    unittest.main()
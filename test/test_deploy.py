@@ -0,0 +1,57 @@
+from ryu.lib import hub
+hub.patch(thread=False)
+
+import unittest
+
+from ryu.lib.packet import ether_types
+from ryu.ofproto import ofproto_v1_0
+
+# fabric_sim puts the repository on sys.path
+import fabric_sim
+import switch
+
+CONVERGE_TIMEOUT = 60
+
+class IncrementalDeployTest(unittest.TestCase):
+    def setUp(self):
+        self.triggered_interval = switch.TRIGGERED_UPDATE_INTERVAL
+        switch.TRIGGERED_UPDATE_INTERVAL = 0.1
+        self.fabric = fabric_sim.Fabric(fabric_sim.ring(6))
+        self.fabric.start()
+        self.assertIsNotNone(self.fabric.wait_converged(CONVERGE_TIMEOUT))
+
+    def tearDown(self):
+        self.fabric.stop()
+        switch.TRIGGERED_UPDATE_INTERVAL = self.triggered_interval
+
+    def routing_flows(self, dpid):
+        """
+            return the (match, priority) of the routing flow entries on the datapath.
+        """
+        return set(key for key in self.fabric.datapaths[dpid].flow_table.flows
+                   if key[0][1] == ether_types.ETH_TYPE_IP
+                   and switch.ROUTING_FLOW_PRIORITY < key[1] < switch.HOST_FLOW_PRIORITY)
+
+    def installed_flows(self, sw):
+        return set(((None, ether_types.ETH_TYPE_IP, None, src.cidr if src is not None else None, subnet.cidr),
+                    sw.routing_flow_priority(subnet, src)) for subnet, src in sw.installed_flows)
+
+    def test_redeploy_sends_no_flow_mod(self):
+        flow_mods = self.fabric.message_counts()[ofproto_v1_0.OFPT_FLOW_MOD]
+        for sw in self.fabric.app.switches.values():
+            sw.deploy_routing_table()
+        self.assertEqual(self.fabric.message_counts()[ofproto_v1_0.OFPT_FLOW_MOD], flow_mods)
+
+    def test_withdrawn_routes_deleted(self):
+        for dpid, sw in self.fabric.app.switches.items():
+            self.assertEqual(self.routing_flows(dpid), self.installed_flows(sw))
+
+        self.fabric.fail_link(1, 2)
+        self.assertIsNotNone(self.fabric.wait_converged(CONVERGE_TIMEOUT))
+
+        # every withdrawn route is deleted strictly, no stale entry is left
+        for dpid, sw in self.fabric.app.switches.items():
+            self.assertEqual(self.routing_flows(dpid), self.installed_flows(sw))
+
+if __name__ == '__main__':
+    unittest.main()
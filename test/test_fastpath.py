@@ -0,0 +1,111 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ryu.lib import addrconv
+from ryu.lib.packet import packet, ethernet, vlan, arp, ipv4, ipv6, tcp, udp
+from ryu.ofproto import ether, inet
+
+from fastpath import parse_packet, ARPTemplate, ARP_REQUEST, ARP_REPLY
+
+HOST_MAC = '00:00:00:00:01:01'
+GATEWAY_MAC = '00:00:00:00:00:01'
+
+def serialize(*protocols):
+    pkt = packet.Packet()
+    for protocol in protocols:
+        pkt.add_protocol(protocol)
+    pkt.serialize()
+    return str(pkt.data)
+
+class ParsePacketTest(unittest.TestCase):
+    def assertSameAsRyu(self, data):
+        header = parse_packet(data)
+        pkt = packet.Packet(data)
+        eth = pkt.get_protocol(ethernet.ethernet)
+        self.assertEqual(header.eth_dst, eth.dst)
+        self.assertEqual(header.eth_src, eth.src)
+
+        vlan_tag = pkt.get_protocol(vlan.vlan)
+        self.assertEqual(header.ethertype, vlan_tag.ethertype if vlan_tag else eth.ethertype)
+
+        arp_pkt = pkt.get_protocol(arp.arp)
+        ip_pkt = pkt.get_protocol(ipv4.ipv4)
+        if arp_pkt is not None:
+            self.assertEqual(header.opcode, arp_pkt.opcode)
+            self.assertEqual(header.src_mac, arp_pkt.src_mac)
+            self.assertEqual(header.src_ip, arp_pkt.src_ip)
+            self.assertEqual(header.dst_ip, arp_pkt.dst_ip)
+        elif ip_pkt is not None:
+            self.assertEqual(header.src_ip, ip_pkt.src)
+            self.assertEqual(header.dst_ip, ip_pkt.dst)
+        else:
+            self.assertIsNone(header.src_ip)
+            self.assertIsNone(header.dst_ip)
+        return header
+
+    def test_arp(self):
+        data = serialize(ethernet.ethernet('ff:ff:ff:ff:ff:ff', HOST_MAC, ether.ETH_TYPE_ARP),
+                         arp.arp_ip(arp.ARP_REQUEST, HOST_MAC, '10.0.1.2', '00:00:00:00:00:00', '10.0.1.1'))
+        self.assertEqual(self.assertSameAsRyu(data).opcode, ARP_REQUEST)
+
+    def test_ipv4(self):
+        data = serialize(ethernet.ethernet(GATEWAY_MAC, HOST_MAC, ether.ETH_TYPE_IP),
+                         ipv4.ipv4(src='10.0.1.2', dst='10.0.2.2', proto=inet.IPPROTO_TCP),
+                         tcp.tcp(src_port=1234, dst_port=80))
+        self.assertEqual(self.assertSameAsRyu(data).dst_ip, '10.0.2.2')
+
+    def test_vlan_tagged(self):
+        data = serialize(ethernet.ethernet(GATEWAY_MAC, HOST_MAC, ether.ETH_TYPE_8021Q),
+                         vlan.vlan(vid=10, ethertype=ether.ETH_TYPE_IP),
+                         ipv4.ipv4(src='10.0.1.2', dst='10.0.2.2', proto=inet.IPPROTO_UDP),
+                         udp.udp(src_port=1234, dst_port=53))
+        self.assertEqual(self.assertSameAsRyu(data).ethertype, ether.ETH_TYPE_IP)
+
+    def test_ipv6_has_no_addresses(self):
+        data = serialize(ethernet.ethernet(GATEWAY_MAC, HOST_MAC, ether.ETH_TYPE_IPV6),
+                         ipv6.ipv6(src='fe80::1', dst='fe80::2', nxt=inet.IPPROTO_UDP),
+                         udp.udp(src_port=1234, dst_port=53))
+        self.assertEqual(self.assertSameAsRyu(data).ethertype, ether.ETH_TYPE_IPV6)
+
+    def test_truncated(self):
+        arp_data = serialize(ethernet.ethernet('ff:ff:ff:ff:ff:ff', HOST_MAC, ether.ETH_TYPE_ARP),
+                             arp.arp_ip(arp.ARP_REQUEST, HOST_MAC, '10.0.1.2', '00:00:00:00:00:00', '10.0.1.1'))
+        ip_data = serialize(ethernet.ethernet(GATEWAY_MAC, HOST_MAC, ether.ETH_TYPE_IP),
+                            ipv4.ipv4(src='10.0.1.2', dst='10.0.2.2'))
+        self.assertIsNone(parse_packet(arp_data[:13]))
+        self.assertIsNone(parse_packet(arp_data[:41]))
+        self.assertIsNone(parse_packet(ip_data[:33]))
+        self.assertIsNotNone(parse_packet(arp_data[:42]))
+        self.assertIsNotNone(parse_packet(ip_data[:34]))
+
+class ARPTemplateTest(unittest.TestCase):
+    def setUp(self):
+        self.template = ARPTemplate(addrconv.mac.text_to_bin(GATEWAY_MAC), '10.0.1.1')
+
+    def test_request(self):
+        pkt = packet.Packet(str(self.template.request('10.0.1.2')))
+        eth = pkt.get_protocol(ethernet.ethernet)
+        arp_pkt = pkt.get_protocol(arp.arp)
+        self.assertEqual(eth.dst, 'ff:ff:ff:ff:ff:ff')
+        self.assertEqual(eth.src, GATEWAY_MAC)
+        self.assertEqual((arp_pkt.opcode, arp_pkt.src_mac, arp_pkt.src_ip, arp_pkt.dst_ip),
+                         (ARP_REQUEST, GATEWAY_MAC, '10.0.1.1', '10.0.1.2'))
+
+        pkt = packet.Packet(str(self.template.request('10.0.1.2', addrconv.mac.text_to_bin(HOST_MAC))))
+        self.assertEqual(pkt.get_protocol(ethernet.ethernet).dst, HOST_MAC)
+
+    def test_reply(self):
+        host_mac = addrconv.mac.text_to_bin(HOST_MAC)
+        data = str(self.template.reply(host_mac, host_mac, '10.0.1.2'))
+        pkt = packet.Packet(data)
+        arp_pkt = pkt.get_protocol(arp.arp)
+        self.assertEqual(pkt.get_protocol(ethernet.ethernet).dst, HOST_MAC)
+        self.assertEqual((arp_pkt.opcode, arp_pkt.src_mac, arp_pkt.src_ip, arp_pkt.dst_mac, arp_pkt.dst_ip),
+                         (ARP_REPLY, GATEWAY_MAC, '10.0.1.1', HOST_MAC, '10.0.1.2'))
+        self.assertEqual(parse_packet(data).opcode, ARP_REPLY)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+import os
+import sys
+import heapq
+import random
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import netaddr
+
+from linkstate import LinkStateRoutingTable
+
+# port number of the gateway on every switch
+GATEWAY_PORT = 100
+
+class FakePort(object):
+    """
+        only dpid, port_no and the neighbor are used by the routing table.
+    """
+    def __init__(self, dpid, port_no, neighbor_switch_dpid=None):
+        self.dpid = dpid
+        self.port_no = port_no
+        self.neighbor_switch_dpid = neighbor_switch_dpid
+
+def full_spf(tbl):
+    """
+        Dijkstra over the whole graph of tbl from scratch.
+    """
+    dist = {tbl.dpid: 0}
+    heap = [(0, tbl.dpid)]
+    while heap:
+        d, u = heapq.heappop(heap)
+        if d > dist[u]:
+            continue
+        for v, cost in tbl.edges.get(u, {}).items():
+            if d + cost < dist.get(v, float('inf')):
+                dist[v] = d + cost
+                heapq.heappush(heap, (d + cost, v))
+    return dist
+
+class Fabric(object):
+    """
+        link-state tables of switches 1..size exchanging advertisements
+        directly, each switch owns subnet 10.<dpid>.0.0/16.
+        links = list of (dpid1, port_no1, dpid2, port_no2)
+    """
+    def __init__(self, size, links):
+        self.tbls = dict((dpid, LinkStateRoutingTable(dpid)) for dpid in range(1, size + 1))
+        self.links = []
+        self.ports = {}
+        self.port_count = dict((dpid, 0) for dpid in self.tbls)
+        for dpid, tbl in self.tbls.items():
+            tbl.update_entry(self.subnet(dpid), FakePort(dpid, GATEWAY_PORT), source="CONNECTED")
+        for dpid1, dpid2 in links:
+            self.add_link(dpid1, dpid2)
+
+    def subnet(self, dpid):
+        return netaddr.IPNetwork('10.%d.0.0/16' % dpid)
+
+    def add_link(self, dpid1, dpid2):
+        self.port_count[dpid1] += 1
+        self.port_count[dpid2] += 1
+        link = (dpid1, self.port_count[dpid1], dpid2, self.port_count[dpid2])
+        self.ports[link[:2]] = FakePort(dpid1, link[1], dpid2)
+        self.ports[link[2:]] = FakePort(dpid2, link[3], dpid1)
+        self.links.append(link)
+
+    def remove_link(self, link):
+        self.links.remove(link)
+        self.tbls[link[0]].invalidate_port(link[1])
+        self.tbls[link[2]].invalidate_port(link[3])
+
+    def flood(self):
+        for i in range(len(self.tbls) + 2):
+            for dpid1, port_no1, dpid2, port_no2 in self.links:
+                for src, src_port, dst, dst_port in ((dpid1, port_no1, dpid2, port_no2),
+                                                     (dpid2, port_no2, dpid1, port_no1)):
+                    adv = self.tbls[src].advertisement(self.ports[(src, src_port)])
+                    version = self.tbls[dst].update_by_neighbor(self.ports[(dst, dst_port)],
+                                                                self.ports[(src, src_port)], adv)
+                    self.tbls[src].acknowledge(src_port, version)
+
+class IncrementalSPFTest(unittest.TestCase):
+    def setUp(self):
+        self.rand = random.Random(1)
+
+    def assertSameAsFullSPF(self, fabric):
+        for dpid, tbl in fabric.tbls.items():
+            dist = full_spf(tbl)
+            self.assertEqual(tbl.dist, dist)
+            for node, d in dist.items():
+                if node == dpid:
+                    continue
+                # the first hop is a neighbor one link closer to node
+                neighbor = tbl.adjacencies[tbl.first_hop[node]][1].dpid
+                self.assertEqual(fabric.tbls[neighbor].dist[node], d - 1)
+            for node, node_tbl in fabric.tbls.items():
+                subnet = fabric.subnet(node)
+                if node == dpid:
+                    self.assertEqual(tbl[subnet].source, "CONNECTED")
+                elif node in dist:
+                    self.assertEqual(tbl[subnet].metric, dist[node])
+                else:
+                    self.assertNotIn(subnet, tbl)
+
+    def random_fabric(self, size, extra_links):
+        links = [(dpid, self.rand.randint(1, dpid - 1)) for dpid in range(2, size + 1)]
+        for i in range(extra_links):
+            links.append(tuple(self.rand.sample(range(1, size + 1), 2)))
+        return Fabric(size, links)
+
+    def test_ring(self):
+        fabric = Fabric(4, [(1, 2), (2, 3), (3, 4), (4, 1), (1, 3)])
+        fabric.flood()
+        self.assertSameAsFullSPF(fabric)
+        self.assertEqual(fabric.tbls[1][fabric.subnet(3)].metric, 1)
+
+        fabric.remove_link(fabric.links[-1])
+        fabric.flood()
+        self.assertSameAsFullSPF(fabric)
+        self.assertEqual(fabric.tbls[1][fabric.subnet(3)].metric, 2)
+
+    def test_random_link_failures(self):
+        fabric = self.random_fabric(30, 20)
+        fabric.flood()
+        self.assertSameAsFullSPF(fabric)
+        for i in range(10):
+            fabric.remove_link(self.rand.choice(fabric.links))
+            fabric.flood()
+            self.assertSameAsFullSPF(fabric)
+
+    def test_random_link_additions(self):
+        fabric = self.random_fabric(30, 0)
+        fabric.flood()
+        self.assertSameAsFullSPF(fabric)
+        for i in range(10):
+            fabric.add_link(*self.rand.sample(range(1, 31), 2))
+            fabric.flood()
+            self.assertSameAsFullSPF(fabric)
+
+    def test_partition(self):
+        fabric = self.random_fabric(20, 10)
+        fabric.flood()
+        for link in [link for link in fabric.links if 5 in (link[0], link[2])]:
+            fabric.remove_link(link)
+        fabric.flood()
+        self.assertSameAsFullSPF(fabric)
+        self.assertEqual(len(fabric.tbls[5]), 1)
+
+        for tbl in fabric.tbls.values():
+            tbl.garbage_collect()
+        self.assertEqual(len(fabric.tbls[5].lsdb), 1)
+        self.assertNotIn(5, fabric.tbls[1].lsdb)
+
+if __name__ == '__main__':
+    unittest.main()
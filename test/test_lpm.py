@@ -0,0 +1,73 @@
+import os
+import sys
+import random
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import netaddr
+
+from base.lpm import PrefixTable
+
+def linear_lookup(subnets, ip, accept=None):
+    """
+        longest prefix match by scanning all the subnets.
+    """
+    best = None
+    for subnet, value in subnets.items():
+        if ip in subnet and (accept is None or accept(value)):
+            if best is None or subnet.prefixlen > best[0].prefixlen:
+                best = (subnet, value)
+    return best
+
+class PrefixTableTest(unittest.TestCase):
+    def setUp(self):
+        self.rand = random.Random(0)
+
+    def random_subnet(self):
+        prefixlen = self.rand.choice([8, 16, 20, 24, 25, 30, 32])
+        ip = netaddr.IPAddress('10.0.0.0') + self.rand.randrange(1 << 16)
+        return netaddr.IPNetwork('%s/%d' % (ip, prefixlen)).cidr
+
+    def test_same_as_linear_scan(self):
+        table = PrefixTable()
+        subnets = {}
+        for i in range(500):
+            subnet = self.random_subnet()
+            if subnets and self.rand.random() < 0.2:
+                subnet = self.rand.choice(list(subnets))
+                table.remove(subnet)
+                del subnets[subnet]
+                continue
+            table.insert(subnet, i)
+            subnets[subnet] = i
+
+        for i in range(2000):
+            ip = netaddr.IPAddress('10.0.0.0') + self.rand.randrange(1 << 16)
+            self.assertEqual(table.lookup(ip), linear_lookup(subnets, ip))
+            accept = lambda value: value % 2 == 0
+            self.assertEqual(table.lookup(ip, accept), linear_lookup(subnets, ip, accept))
+        self.assertEqual(len(table), len(subnets))
+
+    def test_accept_skips_longer_prefix(self):
+        table = PrefixTable()
+        connected = netaddr.IPNetwork('10.0.1.0/24')
+        learned = netaddr.IPNetwork('10.0.1.128/25')
+        table.insert(connected, 'CONNECTED')
+        table.insert(learned, 'RIP')
+        ip = netaddr.IPAddress('10.0.1.200')
+        self.assertEqual(table.lookup(ip), (learned, 'RIP'))
+        self.assertEqual(table.lookup(ip, lambda source: source == 'CONNECTED'), (connected, 'CONNECTED'))
+        self.assertIsNone(table.lookup(netaddr.IPAddress('10.0.2.1')))
+
+    def test_remove_last_of_prefixlen(self):
+        table = PrefixTable()
+        subnet = netaddr.IPNetwork('10.0.0.0/16')
+        table.insert(subnet, 1)
+        table.remove(subnet)
+        table.remove(subnet)
+        self.assertEqual(table.prefixlens, [])
+        self.assertIsNone(table.lookup(netaddr.IPAddress('10.0.0.1')))
+
+if __name__ == '__main__':
+    unittest.main()
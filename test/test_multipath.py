@@ -0,0 +1,75 @@
+from ryu.lib import hub
+hub.patch(thread=False)
+
+import unittest
+
+import netaddr
+from ryu.lib.packet import ether_types
+
+# fabric_sim puts the repository on sys.path
+import fabric_sim
+import switch
+
+CONVERGE_TIMEOUT = 60
+
+# source outside all the subnets, matched by the catch-all flow only
+OUTSIDE_SOURCE = '192.0.2.1'
+
+class MultipathFlowTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.triggered_interval = switch.TRIGGERED_UPDATE_INTERVAL
+        switch.TRIGGERED_UPDATE_INTERVAL = 0.1
+        cls.fabric = fabric_sim.Fabric(fabric_sim.fat_tree(4))
+        cls.fabric.start()
+        assert cls.fabric.wait_converged(CONVERGE_TIMEOUT) is not None
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.fabric.stop()
+        switch.TRIGGERED_UPDATE_INTERVAL = cls.triggered_interval
+
+    def flow_match(self, subnet, src):
+        return (None, ether_types.ETH_TYPE_IP, None, src.cidr if src is not None else None, subnet.cidr)
+
+    def test_installed_flows_on_datapath(self):
+        for dpid, sw in self.fabric.app.switches.items():
+            flows = self.fabric.datapaths[dpid].flow_table.flows
+            for (subnet, src), signature in sw.installed_flows.items():
+                actions = flows.get((self.flow_match(subnet, src), sw.routing_flow_priority(subnet, src)))
+                self.assertIsNotNone(actions, 'flow of %s from %s missing on %d' % (subnet, src, dpid))
+                self.assertEqual([a.port for a in actions if hasattr(a, 'max_len')], [signature[0]])
+
+    def test_sources_spread_over_paths(self):
+        spread = 0
+        for dpid, sw in self.fabric.app.switches.items():
+            table = self.fabric.datapaths[dpid].flow_table
+            for (subnet, src), signature in sw.installed_flows.items():
+                if src is None:
+                    continue
+                dst = subnet.network + 10
+                default = sw.installed_flows[(subnet, None)]
+                self.assertNotEqual(signature, default)
+                self.assertEqual(table.output(None, ether_types.ETH_TYPE_IP, None, src.network + 1, dst), signature[0])
+                self.assertEqual(table.output(None, ether_types.ETH_TYPE_IP, None, OUTSIDE_SOURCE, dst), default[0])
+                spread += 1
+        self.assertTrue(spread > 0)
+
+    def test_flows_per_multipath_route(self):
+        buckets = 2 ** switch.MULTIPATH_SOURCE_BITS
+        for dpid, sw in self.fabric.app.switches.items():
+            per_route = {}
+            for subnet, src in sw.installed_flows:
+                per_route[subnet] = per_route.get(subnet, 0) + 1
+            for subnet, count in per_route.items():
+                self.assertTrue(count <= buckets + 1)
+
+    def test_buckets_equal_length(self):
+        for dpid, sw in self.fabric.app.switches.items():
+            sources = sw.multipath_sources()
+            self.assertEqual(len(sources), 2 ** switch.MULTIPATH_SOURCE_BITS)
+            self.assertEqual(len(set(src.prefixlen for src in sources)), 1)
+            self.assertEqual(netaddr.cidr_merge(sources), [netaddr.spanning_cidr([s.cidr for s in sw.tbl.keys()])])
+
+if __name__ == '__main__':
+    unittest.main()
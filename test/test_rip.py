@@ -0,0 +1,129 @@
+import os
+import sys
+import unittest
+from collections import namedtuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import netaddr
+
+from base.rib import Advertisement
+from rip import RIPRoutingTable, METRIC_INFINITY
+
+# only dpid and port_no of a Port are used by the routing table
+FakePort = namedtuple('FakePort', ['dpid', 'port_no'])
+
+SUBNET_A = netaddr.IPNetwork('10.0.1.0/24')
+SUBNET_B = netaddr.IPNetwork('10.0.2.0/24')
+SUBNET_C = netaddr.IPNetwork('10.0.3.0/24')
+
+class RIPAdvertisementTest(unittest.TestCase):
+    """
+        switch 1 is connected to switch 2 through port 1
+        and to switch 3 through port 2.
+    """
+    def setUp(self):
+        self.tbl = RIPRoutingTable(1)
+        self.port1 = FakePort(1, 1)
+        self.port2 = FakePort(1, 2)
+        self.neighbor2 = FakePort(2, 1)
+        self.neighbor3 = FakePort(3, 1)
+        self.tbl.update_entry(SUBNET_A, FakePort(1, 3), None, 0, "CONNECTED")
+
+    def exchange(self, port):
+        """
+            advertise to the neighbor on port and acknowledge it.
+        """
+        adv = self.tbl.advertisement(port)
+        self.tbl.acknowledge(port.port_no, adv.version)
+        return adv
+
+    def test_new_neighbor_gets_whole_table(self):
+        self.tbl.update_entry(SUBNET_B, self.port2, self.neighbor3, 1)
+        adv = self.tbl.advertisement(self.port1)
+        self.assertEqual(adv.base_version, 0)
+        self.assertEqual(adv.routes, {SUBNET_A: 0, SUBNET_B: 1})
+
+    def test_delta_after_acknowledge(self):
+        self.exchange(self.port1)
+        self.assertEqual(self.tbl.advertisement(self.port1).routes, {})
+
+        self.tbl.update_entry(SUBNET_B, self.port2, self.neighbor3, 1)
+        adv = self.exchange(self.port1)
+        self.assertEqual(adv.routes, {SUBNET_B: 1})
+
+        # unchanged refresh publishes nothing
+        revision = self.tbl.revision
+        self.tbl.update_entry(SUBNET_B, self.port2, self.neighbor3, 1)
+        self.assertEqual(self.tbl.revision, revision)
+        self.assertEqual(self.tbl.advertisement(self.port1).routes, {})
+
+    def test_poison_reverse(self):
+        self.tbl.update_entry(SUBNET_B, self.port1, self.neighbor2, 1)
+        self.assertEqual(self.tbl.advertisement(self.port1).routes[SUBNET_B], METRIC_INFINITY)
+        self.assertEqual(self.tbl.advertisement(self.port2).routes[SUBNET_B], 1)
+
+    def test_full_advertisement_keeps_acknowledged_version(self):
+        self.tbl.update_entry(SUBNET_B, self.port2, self.neighbor3, 1)
+        version = self.exchange(self.port1).version
+        adv = self.tbl.advertisement(self.port1, full=True)
+        self.assertEqual(adv.base_version, 0)
+        self.assertEqual(adv.routes, {SUBNET_A: 0, SUBNET_B: 1})
+        self.assertEqual(self.tbl.acked[self.port1.port_no], version)
+
+    def test_tombstone_pruned_after_all_acknowledged(self):
+        self.tbl.update_entry(SUBNET_B, self.port2, self.neighbor3, 1)
+        self.exchange(self.port1)
+        self.exchange(self.port2)
+
+        self.tbl.remove_entry(SUBNET_B)
+        self.assertEqual(self.exchange(self.port1).routes, {SUBNET_B: METRIC_INFINITY})
+
+        # port 2 has not acknowledged the removal yet
+        self.tbl.garbage_collect()
+        self.assertIn(SUBNET_B, self.tbl.journal)
+        self.assertEqual(self.tbl.advertisement(self.port2).routes, {SUBNET_B: METRIC_INFINITY})
+
+        self.exchange(self.port2)
+        self.tbl.garbage_collect()
+        self.assertNotIn(SUBNET_B, self.tbl.journal)
+        self.assertIn(SUBNET_A, self.tbl.journal)
+
+    def test_missed_changes_request_whole_table(self):
+        adv = Advertisement(0, 3, {SUBNET_B: 1})
+        self.assertEqual(self.tbl.update_by_neighbor(self.port1, self.neighbor2, adv), 3)
+        self.assertEqual(self.tbl[SUBNET_B].metric, 2)
+
+        # changes in (3, 5] are lost
+        adv = Advertisement(5, 6, {SUBNET_C: 1})
+        self.assertEqual(self.tbl.update_by_neighbor(self.port1, self.neighbor2, adv), 0)
+
+    def test_whole_table_withdraws_unlisted_routes(self):
+        adv = Advertisement(0, 2, {SUBNET_B: 1, SUBNET_C: 1})
+        self.tbl.update_by_neighbor(self.port1, self.neighbor2, adv)
+        self.assertEqual(self.tbl[SUBNET_C].metric, 2)
+
+        # the withdrawal of SUBNET_C was pruned on the neighbor
+        adv = Advertisement(0, 7, {SUBNET_B: 1})
+        self.assertEqual(self.tbl.update_by_neighbor(self.port1, self.neighbor2, adv), 7)
+        self.assertEqual(self.tbl[SUBNET_B].metric, 2)
+        self.assertEqual(self.tbl[SUBNET_C].metric, METRIC_INFINITY)
+        self.assertEqual(self.tbl[SUBNET_A].metric, 0)
+
+    def test_withdrawn_subnet_resent_to_neighbor(self):
+        self.tbl.update_by_neighbor(self.port2, self.neighbor3, Advertisement(0, 1, {SUBNET_B: 1}))
+        self.tbl.update_by_neighbor(self.port1, self.neighbor2, Advertisement(0, 1, {SUBNET_B: 2}))
+        self.assertEqual(self.tbl[SUBNET_B].paths(), [(self.port2, self.neighbor3)])
+        self.exchange(self.port1)
+        version = self.tbl.version
+
+        # switch 2 lost its route, switch 1 still has the one through switch 3
+        self.tbl.update_by_neighbor(self.port1, self.neighbor2, Advertisement(1, 2, {SUBNET_B: METRIC_INFINITY}))
+        self.assertEqual(self.tbl[SUBNET_B].metric, 2)
+        self.assertEqual(self.tbl.version, version)
+        self.assertIn(SUBNET_B, self.tbl.pop_changes())
+        self.assertEqual(self.exchange(self.port1).routes, {SUBNET_B: 2})
+        self.assertEqual(self.tbl.advertisement(self.port1).routes, {})
+
+if __name__ == '__main__':
+    unittest.main()